@@ -0,0 +1,246 @@
+"""
+Load and latency benchmark of the API
+
+Seeds a database with a configurable number of tasks, goals, notes and
+conversations, then drives the endpoints through the Flask app at each
+concurrency level and reports p50/p95/p99 latency, throughput and SQL
+statements per request as JSON. Save a run with --output and pass it to
+--compare on a later run to see the change per scenario; the exit status is
+1 when a scenario got slower than --tolerance allows.
+
+Usage (from master-agent-backend):
+    python benchmarks/api_bench.py --rows 10000 --concurrency 1 4 16 --output before.json
+    python benchmarks/api_bench.py --rows 10000 --concurrency 1 4 16 --compare before.json
+    python benchmarks/api_bench.py --database-url postgresql+psycopg2://... --rows 1000000 --reuse
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SEED_BATCH_SIZE = 10000
+TAGS = ['work', 'home', 'idea', 'meeting', 'health', 'travel', 'reading', 'finance']
+WORDS = ['plan', 'review', 'meeting', 'budget', 'call', 'draft', 'groceries', 'report', 'trip', 'book',
+         'doctor', 'project', 'email', 'design', 'release', 'invoice', 'workout', 'garden', 'taxes', 'party']
+
+def sentence(rng, words=6):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+# name -> (method, path or path(rng, state), JSON body or None)
+SCENARIOS = {
+    'dashboard': ('GET', '/api/dashboard', None),
+    'tasks_list': ('GET', '/api/tasks?limit=50', None),
+    'tasks_filtered': ('GET', '/api/tasks?status=pending&priority=high&limit=50', None),
+    'goals_list': ('GET', '/api/goals?limit=50', None),
+    'notes_list': ('GET', '/api/notes?limit=50', None),
+    'notes_by_tag': ('GET', '/api/notes?tag=work&tag=idea&limit=50', None),
+    'notes_tags': ('GET', '/api/notes/tags', None),
+    'conversations_list': ('GET', '/api/conversations', None),
+    'search': ('GET', '/api/search?q=budget%20meeting&limit=20', None),
+    'sync': ('GET', lambda rng, state: f'/api/sync?since={state["sync_since"]}', None),
+    'chat': ('POST', '/api/chat', lambda rng, state: {'message': 'hello, ' + sentence(rng)}),
+    'task_create': ('POST', '/api/tasks', lambda rng, state: {'title': sentence(rng, 3), 'priority': 'low'}),
+    'task_update': ('PUT', lambda rng, state: f'/api/tasks/{rng.randint(state["min_task_id"], state["max_task_id"])}',
+                    lambda rng, state: {'status': rng.choice(['pending', 'completed'])}),
+}
+
+def seed(db, models, rows, rng):
+    """Bulk insert rows of every kind for the default user, in batches"""
+    from sqlalchemy import insert
+
+    Task, Goal, Note, NoteTag, Conversation = models
+    now = datetime.utcnow()
+
+    def insert_batches(model, count, make_row):
+        for start in range(0, count, SEED_BATCH_SIZE):
+            db.session.execute(insert(model), [make_row(i) for i in range(start, min(count, start + SEED_BATCH_SIZE))])
+            db.session.commit()
+
+    def created(i, count):
+        return now - timedelta(seconds=(count - i) * 30)
+
+    insert_batches(Task, rows['tasks'], lambda i: {
+        'title': sentence(rng, 3), 'description': sentence(rng), 'user_id': 1,
+        'status': rng.choice(['pending', 'pending', 'completed']), 'priority': rng.choice(['low', 'medium', 'high']),
+        'created_at': created(i, rows['tasks']), 'updated_at': created(i, rows['tasks'])})
+    insert_batches(Goal, rows['goals'], lambda i: {
+        'title': sentence(rng, 3), 'description': sentence(rng), 'user_id': 1,
+        'status': rng.choice(['active', 'completed']), 'progress': rng.randint(0, 100),
+        'created_at': created(i, rows['goals']), 'updated_at': created(i, rows['goals'])})
+    insert_batches(Conversation, rows['conversations'], lambda i: {
+        'message': sentence(rng), 'response': sentence(rng, 12), 'user_id': 1,
+        'created_at': created(i, rows['conversations'])})
+
+    first_note_id = (db.session.query(db.func.max(Note.id)).scalar() or 0) + 1
+    insert_batches(Note, rows['notes'], lambda i: {
+        'title': sentence(rng, 3), 'content': sentence(rng, 20), 'note_type': 'text', 'user_id': 1,
+        'created_at': created(i, rows['notes']), 'updated_at': created(i, rows['notes'])})
+    # Two distinct tags per note
+    insert_batches(NoteTag, rows['notes'] * 2, lambda i: {
+        'note_id': first_note_id + i // 2, 'user_id': 1,
+        'name': TAGS[(i // 2 + i % 2 * 3) % len(TAGS)], 'position': i % 2})
+
+def run_scenario(app, name, concurrency, total_requests, state, seed_value):
+    """
+    Send total_requests requests of a scenario from `concurrency` threads
+
+    Returns:
+        dict: Latency percentiles in ms, throughput, statements per request and errors
+    """
+    method, path, body = SCENARIOS[name]
+    latencies = []
+    queries = []
+    errors = [0]
+    remaining = [total_requests]
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        client = app.test_client()
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            url = path(rng, state) if callable(path) else path
+            payload = body(rng, state) if callable(body) else body
+            state['counter'].count = 0
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=payload)
+            response.get_data()  # Drain streamed bodies
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+                queries.append(state['counter'].count)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50_ms': round(cuts[49], 2),
+        'p95_ms': round(cuts[94], 2),
+        'p99_ms': round(cuts[98], 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+    }
+
+def compare(report, baseline, tolerance):
+    """
+    Relative change of each scenario against a previous report
+
+    Returns:
+        tuple: (comparison dict, whether p95, throughput or statements per request
+        regressed beyond tolerance in any scenario)
+    """
+    comparison = {}
+    regressed = False
+    for key, result in report['results'].items():
+        before = baseline.get('results', {}).get(key)
+        if before is None:
+            continue
+        change = {
+            'p50_change': round(result['p50_ms'] / before['p50_ms'] - 1, 3) if before['p50_ms'] else None,
+            'p95_change': round(result['p95_ms'] / before['p95_ms'] - 1, 3) if before['p95_ms'] else None,
+            'throughput_change': round(result['throughput_rps'] / before['throughput_rps'] - 1, 3) if before['throughput_rps'] else None,
+            'queries_change': round(result['queries_per_request'] - before['queries_per_request'], 2),
+        }
+        change['regressed'] = ((change['p95_change'] or 0) > tolerance
+                               or (change['throughput_change'] or 0) < -tolerance
+                               or change['queries_change'] > max(0.5, before['queries_per_request'] * tolerance))
+        regressed = regressed or change['regressed']
+        comparison[key] = change
+    return comparison, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000, help='Tasks, notes and conversations to seed (1000 to 1000000)')
+    parser.add_argument('--goals', type=int, help='Goals to seed (default: rows / 10)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Concurrent clients per level')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), help='Subset of scenarios to run')
+    parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file')
+    parser.add_argument('--reuse', action='store_true', help='Skip seeding when the database already holds data')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and requests')
+    parser.add_argument('--output', help='Also write the report to this file')
+    parser.add_argument('--compare', help='Previous report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative slowdown before --compare fails')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from sqlalchemy import event, func
+    from sqlalchemy.engine import Engine
+    from src.main import app
+    from src.models.master_agent import Task, Goal, Note, NoteTag, Conversation, db
+    from src.utils.search import search_index
+
+    # SQL statements per request, counted per client thread
+    counter = threading.local()
+    event.listen(Engine, 'before_cursor_execute',
+                 lambda *_: setattr(counter, 'count', getattr(counter, 'count', 0) + 1))
+
+    rows = {'tasks': args.rows, 'notes': args.rows, 'conversations': args.rows,
+            'goals': args.goals if args.goals is not None else max(1, args.rows // 10)}
+    rng = random.Random(args.seed)
+    state = {'counter': counter, 'sync_since': (datetime.utcnow() - timedelta(hours=1)).isoformat()}
+
+    with app.app_context():
+        existing = db.session.query(func.count(Task.id)).scalar()
+        seeded_in = None
+        if not (args.reuse and existing):
+            started = time.perf_counter()
+            seed(db, (Task, Goal, Note, NoteTag, Conversation), rows, rng)
+            search_index.rebuild()
+            seeded_in = round(time.perf_counter() - started, 1)
+        state['min_task_id'], state['max_task_id'] = db.session.query(func.min(Task.id), func.max(Task.id)).one()
+        counts = {name: db.session.query(func.count(model.id)).scalar()
+                  for name, model in (('tasks', Task), ('goals', Goal), ('notes', Note), ('conversations', Conversation))}
+        dialect = db.engine.dialect.name
+
+    report = {
+        'database': dialect,
+        'rows': counts,
+        'seed_seconds': seeded_in,
+        'requests_per_level': args.requests,
+        'concurrency': args.concurrency,
+        'results': {},
+    }
+    for name in args.scenarios or SCENARIOS:
+        for concurrency in args.concurrency:
+            report['results'][f'{name}@{concurrency}'] = run_scenario(
+                app, name, concurrency, args.requests, state, args.seed)
+
+    regressed = False
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'], regressed = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
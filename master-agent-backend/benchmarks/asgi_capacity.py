@@ -0,0 +1,123 @@
+"""
+Compare concurrent chat capacity of the WSGI and ASGI apps on one instance
+
+Sends --requests chat messages at each --concurrency level to the Flask app
+served by --workers sync workers (as gunicorn runs it, one request per
+worker at a time) and to src.asgi.application on one event loop, against a
+throwaway SQLite database. The response backend adds --first-token-delay
+seconds of model-like latency, which is what pins a sync worker. Prints
+throughput and p50/p95 latency for each as JSON.
+
+Usage (from master-agent-backend):
+    python benchmarks/asgi_capacity.py --workers 2 --concurrency 1 10 50 --first-token-delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(latencies, elapsed, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+async def asgi_request(application, path, payload):
+    body = json.dumps(payload).encode()
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': path, 'root_path': '', 'query_string': b'',
+        'http_version': '1.1', 'scheme': 'http', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # no disconnect while the response is sent
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+async def run_clients(call, concurrency, requests):
+    """concurrency clients, each sending its next request when the previous one completes"""
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            status = await call(i)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started, len(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2, help='Sync workers of the WSGI instance')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50], help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per concurrency level and app')
+    parser.add_argument('--first-token-delay', type=float, default=0.5, help='Simulated model latency in seconds')
+    parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['RESPONSE_BACKEND'] = 'simulated'
+    os.environ['SIMULATED_FIRST_TOKEN_DELAY'] = str(args.first_token_delay)
+    os.environ.setdefault('SIMULATED_TOKEN_DELAY', '0')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from src.asgi import application
+    from src.main import app
+
+    report = {'workers': args.workers, 'first_token_delay': args.first_token_delay, 'levels': []}
+    with ThreadPoolExecutor(max_workers=args.workers) as workers:
+        client = app.test_client()
+
+        async def sync_call(i):
+            # A sync worker is busy for the whole request; clients queue for one
+            response = await asyncio.get_running_loop().run_in_executor(
+                workers, lambda: client.post('/api/chat', json={'message': f'hello {i}'}))
+            return response.status_code
+
+        async def asgi_call(i):
+            return await asgi_request(application, '/api/chat', {'message': f'hello {i}'})
+
+        for concurrency in args.concurrency:
+            level = {'concurrency': concurrency}
+            for name, call in (('wsgi', sync_call), ('asgi', asgi_call)):
+                latencies, elapsed, errors = asyncio.run(run_clients(call, concurrency, args.requests))
+                level[name] = summarize(latencies, elapsed, errors)
+            level['throughput_ratio'] = round(level['asgi']['requests_per_second'] / level['wsgi']['requests_per_second'], 1)
+            report['levels'].append(level)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare the batch endpoints with the single-item endpoints
+
+Creates, updates and deletes N tasks one request at a time and then through
+/api/tasks/batch, against a throwaway SQLite database, and prints operations
+per second for each.
+
+Usage (from master-agent-backend):
+    python benchmarks/batch_throughput.py --items 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=200, help='Tasks per phase')
+    parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from src.main import app
+
+    client = app.test_client()
+    n = args.items
+    report = {'items': n}
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        report[name] = {'seconds': round(elapsed, 4), 'ops_per_second': round(n / elapsed, 1)}
+
+    # Single-item endpoints
+    single_ids = []
+    timed('single_create', lambda: single_ids.extend(
+        client.post('/api/tasks', json={'title': f'single {i}'}).json['id'] for i in range(n)))
+    timed('single_update', lambda: [client.put(f'/api/tasks/{task_id}', json={'status': 'completed'})
+                                    for task_id in single_ids])
+    timed('single_delete', lambda: [client.delete(f'/api/tasks/{task_id}') for task_id in single_ids])
+
+    # Batch endpoint
+    batch_ids = []
+
+    def batch(operations):
+        response = client.post('/api/tasks/batch', json={'operations': operations})
+        assert response.status_code == 200 and response.json['failed'] == 0, response.json
+        return response.json['results']
+
+    timed('batch_create', lambda: batch_ids.extend(
+        result['id'] for result in batch([{'op': 'create', 'data': {'title': f'batch {i}'}} for i in range(n)])))
+    timed('batch_update', lambda: batch([{'op': 'update', 'id': task_id, 'data': {'status': 'completed'}}
+                                         for task_id in batch_ids]))
+    timed('batch_delete', lambda: batch([{'op': 'delete', 'id': task_id} for task_id in batch_ids]))
+
+    for phase in ('create', 'update', 'delete'):
+        report[f'{phase}_speedup'] = round(report[f'single_{phase}']['seconds'] / report[f'batch_{phase}']['seconds'], 1)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure chat intent routing as the number of intents grows
+
+Registers N synthetic intents (two keyword groups each, like create_task)
+ahead of the built-in ones and routes a fixed set of messages through the
+compiled registry and through an if/elif chain of substring checks
+equivalent to the original generate_response, printing microseconds per
+message for each.
+
+Usage (from master-agent-backend):
+    python benchmarks/intent_routing.py --intents 10 100 500 1000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+MESSAGES = [
+    'hello there',
+    'please add a task to renew my passport',
+    'how is my fitness goal going?',
+    'take a note: buy oat milk',
+    'what should I focus on this afternoon, given everything on my plate this week?',
+]
+
+def random_word(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+def timed(route, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in MESSAGES:
+            route(message)
+    return round((time.perf_counter() - started) / (repeat * len(MESSAGES)) * 1e6, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--intents', type=int, nargs='+', default=[10, 100, 500, 1000],
+                        help='Numbers of synthetic intents to register')
+    parser.add_argument('--repeat', type=int, default=200, help='Passes over the sample messages')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src.utils.intents import IntentRegistry, intent_registry
+
+    report = {'messages': len(MESSAGES), 'results': []}
+    rng = random.Random(0)
+    for count in args.intents:
+        registry = IntentRegistry()
+        chain = []
+        # Synthetic intents first, so that the built-in ones sit at the end of the chain
+        for index in range(count - len(intent_registry.intents)):
+            groups = [(random_word(rng),), (random_word(rng), random_word(rng))]
+            registry.register(f'synthetic_{index}', groups, lambda match: '')
+            chain.append((f'synthetic_{index}', groups))
+        for intent in intent_registry.intents:
+            registry.register(intent.name, intent.keyword_groups, intent.handler, [p.pattern for p in intent.patterns])
+            chain.append((intent.name, intent.keyword_groups))
+        registry.compile()
+
+        def route_chain(message):
+            message_lower = message.lower()
+            for name, groups in chain:
+                if all(any(keyword in message_lower for keyword in group) for group in groups):
+                    return name
+            return None
+
+        report['results'].append({
+            'intents': len(registry.intents),
+            'compiled_us_per_message': timed(registry.route, args.repeat),
+            'substring_chain_us_per_message': timed(route_chain, args.repeat),
+        })
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
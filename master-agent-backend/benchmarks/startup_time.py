@@ -0,0 +1,68 @@
+"""
+Measure worker startup: import of src.main to the first served request
+
+Starts fresh interpreters, as gunicorn workers do on a cold start, with the
+default startup and with SKIP_DB_INIT=true, against a database initialized
+beforehand, and prints the median import and first-request times and the
+number of SQL statements run while importing. Each statement is a round trip
+to Cloud SQL in production, so the gap grows with network latency.
+
+Usage (from master-agent-backend):
+    python benchmarks/startup_time.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a child interpreter; prints the timings as JSON
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, %r)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(1))
+from src.main import app
+imported = time.perf_counter()
+startup_queries = len(statements)
+response = app.test_client().get('/api/tasks?limit=1')
+assert response.status_code == 200, response.data
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (served - imported) * 1000,
+                  'total_ms': (served - started) * 1000, 'startup_queries': startup_queries}))
+""" % BACKEND_DIR
+
+def run_child(env):
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', CHILD], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts per mode')
+    parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+    # Create the schema once, like `flask init-db` before a deploy
+    run_child(dict(env, SKIP_DB_INIT='false'))
+
+    report = {'runs': args.runs}
+    for mode, skip in (('full_init', 'false'), ('skip_db_init', 'true')):
+        timings = [run_child(dict(env, SKIP_DB_INIT=skip)) for _ in range(args.runs)]
+        report[mode] = {key: round(statistics.median(timing[key] for timing in timings), 1)
+                        for key in ('import_ms', 'first_request_ms', 'total_ms', 'startup_queries')}
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
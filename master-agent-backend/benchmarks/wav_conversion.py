@@ -0,0 +1,97 @@
+"""
+Compare converting a recording to WAV through a temporary file and in memory
+
+Generates a --seconds long stereo 44.1 kHz recording in --format (wav needs
+no ffmpeg), then converts it --runs times the way convert_to_wav used to for
+uploads that were not WAV already (decode, export to a NamedTemporaryFile,
+read the file back for the recognizer, delete it) and the way it does now
+(decode, AudioClip.to_wav_buffer). The new conversion also normalizes to
+the 16 kHz mono the recognizer expects, so the same normalized WAV is also
+written through a temporary file, to tell the cost of the file from the
+cost of resampling. Prints the median wall and CPU time, the bytes written
+and read through system calls per conversion (from /proc/self/io, Linux
+only) and the size of the WAV data, as JSON.
+
+Usage (from master-agent-backend):
+    python benchmarks/wav_conversion.py --seconds 60 --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+from src.utils.speech_processing import AudioClip
+
+def io_counters():
+    """(bytes written, bytes read) by this process through system calls, or None"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['wchar']), int(counters['rchar'])
+    except OSError:
+        return None
+
+def temp_file_conversion(path, normalize=False):
+    """The previous convert_to_wav, plus reading the file back as the recognizer did"""
+    audio = AudioClip.from_file(path).normalized() if normalize else AudioSegment.from_file(path)
+    temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+    temp_wav_path = temp_wav.name
+    temp_wav.close()
+    audio.export(temp_wav_path, format="wav")
+    try:
+        with open(temp_wav_path, 'rb') as f:
+            return len(f.read())
+    finally:
+        os.remove(temp_wav_path)
+
+def in_memory_conversion(path):
+    return len(AudioClip.from_file(path).to_wav_buffer().getvalue())
+
+def measure(convert, path, runs):
+    wall, cpu, written, read = [], [], [], []
+    for _ in range(runs):
+        before = io_counters()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        size = convert(path)
+        wall.append(time.perf_counter() - started)
+        cpu.append(time.process_time() - cpu_started)
+        after = io_counters()
+        if before and after:
+            written.append(after[0] - before[0])
+            read.append(after[1] - before[1])
+    return {
+        'wall_ms': round(statistics.median(wall) * 1000, 1),
+        'cpu_ms': round(statistics.median(cpu) * 1000, 1),
+        'bytes_written': int(statistics.median(written)) if written else None,
+        'bytes_read': int(statistics.median(read)) if read else None,
+        'wav_bytes': size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60, help='Length of the generated recording')
+    parser.add_argument('--format', default='wav', help='Container of the generated recording (ffmpeg unless wav)')
+    parser.add_argument('--runs', type=int, default=10, help='Conversions per method')
+    args = parser.parse_args()
+
+    recording = Sine(440, sample_rate=44100).to_audio_segment(duration=args.seconds * 1000).set_channels(2)
+    path = os.path.join(tempfile.mkdtemp(), f'recording.{args.format}')
+    recording.export(path, format=args.format)
+
+    report = {'seconds': args.seconds, 'format': args.format, 'input_bytes': os.path.getsize(path), 'runs': args.runs,
+              'temp_file': measure(temp_file_conversion, path, args.runs),
+              'temp_file_normalized': measure(lambda p: temp_file_conversion(p, normalize=True), path, args.runs),
+              'in_memory': measure(in_memory_conversion, path, args.runs)}
+    os.remove(path)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+ASGI entry point: the same API on an event loop
+
+Serve with `uvicorn src.asgi:application --host 0.0.0.0 --port $PORT`.
+
+The chat endpoints, whose time is spent waiting for the response backend,
+are handled natively: a request waiting for a model holds no thread, only a
+coroutine. Every other route runs the Flask app in a thread pool after its
+body has been received, so a slow upload from a mobile client holds no
+thread while it trickles in either. Blocking work (SQL, intent actions,
+model clients without async support) runs in the same bounded pool, sized
+by ASGI_THREADS to the database connection pool, so the event loop never
+blocks and never waits for a connection.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from flask_cors.core import get_cors_headers, get_cors_options
+from werkzeug.datastructures import Headers
+
+from src.main import app, start_background_jobs
+from src.models.master_agent import db
+from src.routes.master_agent import chat_reply, chat_request, save_conversation, sse_event, stream_done
+from src.utils.conversation_context import conversation_context
+from src.utils.metrics import metrics
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS',
+                                  int(os.environ.get('DB_POOL_SIZE', 5)) + int(os.environ.get('DB_MAX_OVERFLOW', 10))))
+SPOOL_MAX_MEMORY = 1024 * 1024  # Request bodies above this are spooled to disk
+CORS_OPTIONS = get_cors_options(app)
+
+async def read_body(receive, limit=None):
+    """
+    Receive the whole request body into a spooled file
+
+    Returns:
+        SpooledTemporaryFile: The body positioned at the start, or None if it
+        is larger than limit
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            body.close()
+            return None
+        body.write(chunk)
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+def cors_headers(scope):
+    """
+    The CORS headers flask-cors adds to the Flask app's responses
+
+    Responses that do not come from the Flask app need them as well, or a
+    browser on another origin cannot read them.
+    """
+    request_headers = Headers([(name.decode('latin-1'), value.decode('latin-1'))
+                               for name, value in scope.get('headers', [])])
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in get_cors_headers(CORS_OPTIONS, request_headers, scope['method']).items(multi=True)]
+
+async def send_json(send, scope, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                + cors_headers(scope)})
+    await send({'type': 'http.response.body', 'body': body})
+
+class WsgiBridge:
+    """
+    Serves a WSGI app from ASGI
+
+    The body is received on the event loop, then the app is called in the
+    thread pool; response chunks are sent as the app yields them, so
+    server-sent events and NDJSON listings stream as under gunicorn.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        body = await read_body(receive, self.wsgi_app.config['MAX_CONTENT_LENGTH'])
+        if body is None:
+            await send_json(send, scope, {'error': 'Request body too large'}, 413)
+            return
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started[:] = [int(status.split(' ', 1)[0]),
+                              [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]]
+                return lambda data: send_chunk(data)
+
+            def send_chunk(data):
+                if len(started) == 2:
+                    send_from_thread({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                    started.append(True)
+                if data:
+                    send_from_thread({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+            result = self.wsgi_app(self.environ(scope, body), start_response)
+            try:
+                for data in result:
+                    send_chunk(data)
+                send_chunk(b'')
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+                body.close()
+
+        await loop.run_in_executor(None, run)
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking call in the thread pool, then close the database session
+
+    Closing gives the connection back to the pool, so a coroutine waiting on
+    the response backend never holds one.
+    """
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db.session.close()
+
+    return await asyncio.to_thread(call)
+
+@asynccontextmanager
+async def app_context():
+    """
+    Flask app context for a coroutine
+
+    asyncio.to_thread copies it into the worker threads, which then share the
+    request's database session; the session is closed in a thread too.
+    """
+    with app.app_context():
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(db.session.remove)
+
+async def chat(scope, receive, send):
+    """POST /api/chat, without holding a thread while the backend answers"""
+    body = await read_body(receive, app.config['MAX_CONTENT_LENGTH'])
+    if body is None:
+        await send_json(send, scope, {'error': 'Request body too large'}, 413)
+        return 413
+    try:
+        user_id, message = chat_request(json.loads(body.read() or b'{}'))
+        async with app_context():
+            context = await run_blocking(conversation_context.get, user_id)
+            response = await app.extensions['response_backend'].agenerate(message, user_id=user_id, context=context)
+            # Serialized in the thread, before the session is closed
+            reply = await run_blocking(lambda: chat_reply(save_conversation(user_id, message, response)))
+    except Exception as e:
+        await send_json(send, scope, {'error': str(e)}, 500)
+        return 500
+    await send_json(send, scope, reply)
+    return 200
+
+async def chat_stream(scope, receive, send):
+    """POST /api/chat/stream as server-sent events, forwarding tokens as the backend produces them"""
+    body = await read_body(receive, app.config['MAX_CONTENT_LENGTH'])
+    started = time.perf_counter()
+    if body is None:
+        await send_json(send, scope, {'error': 'Request body too large'}, 413)
+        return 413
+    try:
+        user_id, message = chat_request(json.loads(body.read() or b'{}'))
+    except Exception as e:
+        await send_json(send, scope, {'error': str(e)}, 500)
+        return 500
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ] + cors_headers(scope)})
+
+    async def emit(event, payload, more=True):
+        await send({'type': 'http.response.body', 'body': sse_event(event, payload).encode(), 'more_body': more})
+
+    async with app_context():
+        tokens = []
+        first_token_at = None
+        try:
+            context = await run_blocking(conversation_context.get, user_id)
+            backend = app.extensions['response_backend']
+            async for token in backend.astream(message, user_id=user_id, context=context):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                tokens.append(token)
+                await emit('token', {'token': token})
+
+            # Save the conversation only once the whole reply is known
+            response = ''.join(tokens)
+            done = await run_blocking(
+                lambda: stream_done(save_conversation(user_id, message, response), started, first_token_at))
+            await emit('done', done, more=False)
+        except Exception as e:
+            await run_blocking(db.session.rollback)
+            await emit('error', {'error': str(e)}, more=False)
+    return 200
+
+# (method, path) -> native handler; everything else goes through the WSGI bridge
+ASYNC_ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/chat/stream'): chat_stream,
+}
+
+class AsgiApp:
+    """Dispatches ASGI requests to the native handlers or to the Flask app"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.bridge = WsgiBridge(flask_app)
+        self._executor_loops = set()
+
+    def _use_executor(self):
+        # Bounded pool for asyncio.to_thread and the bridge, once per event loop
+        loop = asyncio.get_running_loop()
+        if id(loop) not in self._executor_loops:
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi'))
+            self._executor_loops.add(id(loop))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._use_executor()
+                start_background_jobs()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self._use_executor()
+
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is None:
+            await self.bridge(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = await handler(scope, receive, send)
+        if metrics.enabled:
+            metrics.request_duration.observe(time.perf_counter() - started, scope['method'], scope['path'], str(status))
+
+application = AsgiApp(app)
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+import click
+
+from src.models.master_agent import User, Note, db
+from src.models.migrations import upgrade_schema
+from src.utils.conversation_archive import conversation_archive
+from src.utils.goal_progress import reconcile_goals
+from src.utils.search import search_index
+from src.utils.sync import prune_tombstones
+from src.utils.uploads import prune_uploads
+
+def init_database():
+    """
+    Create missing tables, columns and indexes and the default user
+
+    Idempotent. Runs at startup unless SKIP_DB_INIT is set, in which case it
+    must be run with `flask --app src.main init-db` after schema changes.
+
+    Returns:
+        list: Names of the columns and indexes added to existing tables
+    """
+    db.create_all()
+    added = upgrade_schema(db)
+    search_index.create_index()
+
+    # Create default user if none exists
+    if not User.query.first():
+        default_user = User(username='admin', email='admin@masteragent.com')
+        db.session.add(default_user)
+        db.session.commit()
+    return added
+
+def register_commands(app):
+    """Register the maintenance commands, run with `flask --app src.main <command>`"""
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create the schema, search index and default user."""
+        added = init_database()
+        click.echo('Database initialized' + (f' (added {", ".join(added)})' if added else ''))
+
+    @app.cli.command('migrate-tags')
+    @click.option('--batch-size', default=500, show_default=True, help='Notes migrated per transaction')
+    def migrate_tags(batch_size):
+        """Move tags from the legacy Note.tags JSON column into note_tag rows."""
+        migrated = skipped = 0
+        last_id = 0
+        while True:
+            notes = Note.query.filter(Note.id > last_id, Note.tags.isnot(None), Note.tags != '')\
+                              .order_by(Note.id).limit(batch_size).all()
+            if not notes:
+                break
+            for note in notes:
+                try:
+                    tags = note.get_tags()
+                except ValueError:
+                    click.echo(f'Note {note.id}: unreadable tags {note.tags!r}, skipped')
+                    skipped += 1
+                    continue
+                # set_tags writes note_tag rows and clears the legacy column
+                note.set_tags(tags)
+                migrated += 1
+            last_id = notes[-1].id
+            db.session.commit()
+        click.echo(f'Migrated tags of {migrated} notes ({skipped} skipped)')
+
+    @app.cli.command('prune-tombstones')
+    @click.option('--days', default=30, show_default=True, help='Keep tombstones younger than this')
+    def prune_tombstones_command(days):
+        """Delete sync tombstones older than the retention period."""
+        deleted = prune_tombstones(timedelta(days=days))
+        click.echo(f'Deleted {deleted} tombstones')
+
+    @app.cli.command('prune-uploads')
+    def prune_uploads_command():
+        """Delete expired resumable uploads and their partial files."""
+        deleted = prune_uploads()
+        click.echo(f'Deleted {deleted} expired uploads')
+
+    @app.cli.command('reconcile-goals')
+    @click.option('--user-id', type=int, help='Only check this user\'s goals')
+    @click.option('--dry-run', is_flag=True, help='Report drift without repairing it')
+    def reconcile_goals_command(user_id, dry_run):
+        """Recount the tasks of each goal and repair drifted progress counters."""
+        drifted = reconcile_goals(user_id=user_id, dry_run=dry_run)
+        for item in drifted:
+            click.echo(f"Goal {item['goal_id']}: stored {item['stored'][0]} tasks ({item['stored'][1]} completed), "
+                       f"counted {item['counted'][0]} ({item['counted'][1]} completed)")
+        click.echo(f"{'Found' if dry_run else 'Repaired'} {len(drifted)} drifted goals")
+
+    @app.cli.command('archive-conversations')
+    @click.option('--until-done', is_flag=True, help='Keep archiving batches until nothing is past retention')
+    def archive_conversations_command(until_done):
+        """Move conversations older than CONVERSATION_RETENTION_DAYS into compressed archive segments."""
+        total = {'segments': 0, 'conversations': 0}
+        while True:
+            archived = conversation_archive.archive()
+            total = {key: total[key] + archived[key] for key in total}
+            if not until_done or not archived['segments']:
+                break
+        click.echo(f"Archived {total['conversations']} conversations in {total['segments']} segments")
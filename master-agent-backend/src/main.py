@@ -1,34 +1,101 @@
 import os
 import sys
+import threading
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from src.models.master_agent import db, User
+from src.models.master_agent import db
+from src.cli import register_commands, init_database
 from src.routes.master_agent import master_agent_bp
+from src.utils.transcription_jobs import transcription_queue
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.search import search_index
+from src.utils.conversation_context import conversation_context
+from src.utils.response_backends import init_response_backend
+from src.utils.metrics import metrics
+from src.utils.audio_storage import audio_storage
+from src.utils.transcription_cache import transcription_cache
+from src.utils.response_cache import response_cache
+from src.utils.conversation_archive import conversation_archive
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 
-# Enable CORS for all routes
+# Enable CORS for all routes; kept in app.config so src/asgi.py applies the same options
+app.config['CORS_EXPOSE_HEADERS'] = ['X-Next-Cursor', 'Link', 'ETag', 'Location', 'Upload-Offset', 'Upload-Chunk-Max']
 CORS(app)
 
 app.register_blueprint(master_agent_bp, url_prefix='/api')
+register_commands(app)
 
 # uncomment if you need to use database
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 
+def engine_options(database_url):
+    """
+    Connection pool settings from the DB_POOL_* environment variables
+
+    SQLite keeps SQLAlchemy's defaults. Pre-ping and recycling are on by
+    default so that connections closed by Cloud SQL are replaced transparently.
+    """
+    if not database_url or database_url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# Request bodies over this size get 413 before they are read; long recordings
+# go through the resumable upload endpoints in chunks
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+# Leave schema creation and seeding to `flask --app src.main init-db` so that
+# workers start without touching the database schema
+app.config['SKIP_DB_INIT'] = os.environ.get('SKIP_DB_INIT', 'false').lower() == 'true'
 
 db.init_app(app)
+transcription_queue.init_app(app)
+dashboard_cache.init_app(app)
+search_index.init_app(app)
+conversation_context.init_app(app)
+init_response_backend(app)
+metrics.init_app(app)
+audio_storage.init_app(app)
+transcription_cache.init_app(app)
+response_cache.init_app(app)
+conversation_archive.init_app(app)
 with app.app_context():
-    db.create_all()
-    
-    # Create default user if none exists
-    if not User.query.first():
-        default_user = User(username='admin', email='admin@masteragent.com')
-        db.session.add(default_user)
-        db.session.commit()
+    if metrics.enabled:
+        metrics.instrument_engine(db.engine)
+
+    if not app.config['SKIP_DB_INIT']:
+        init_database()
+
+_background_jobs_lock = threading.Lock()
+_background_jobs_started = False
+
+@app.before_request
+def start_background_jobs():
+    """
+    Start this worker's background jobs, once, on its first request
+
+    Not at import: CLI commands import the app too, and workers started with
+    SKIP_DB_INIT must not write to the database before a request needs it.
+    """
+    global _background_jobs_started
+    with _background_jobs_lock:
+        if _background_jobs_started:
+            return
+        _background_jobs_started = True
+    # Pick up voice notes whose transcription was interrupted by a restart
+    transcription_queue.schedule_recovery()
+    # Move conversations past CONVERSATION_RETENTION_DAYS to the archive in the background
+    conversation_archive.schedule()
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -28,6 +28,14 @@ class User(db.Model):
         }
 
 class Task(db.Model):
+    __table_args__ = (
+        db.Index('ix_task_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_task_user_status_created', 'user_id', 'status', 'created_at', 'id'),
+        db.Index('ix_task_user_priority_created', 'user_id', 'priority', 'created_at', 'id'),
+        db.Index('ix_task_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_task_goal_status', 'goal_id', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -36,7 +44,9 @@ class Task(db.Model):
     due_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # bumped by every update, for optimistic concurrency
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    goal_id = db.Column(db.Integer, db.ForeignKey('goal.id', ondelete='SET NULL'))  # goal the task counts towards
 
     def __repr__(self):
         return f'<Task {self.title}>'
@@ -51,18 +61,29 @@ class Task(db.Model):
             'due_date': self.due_date.isoformat() if self.due_date else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'user_id': self.user_id
+            'version': self.version,
+            'user_id': self.user_id,
+            'goal_id': self.goal_id
         }
 
 class Goal(db.Model):
+    __table_args__ = (
+        db.Index('ix_goal_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_goal_user_status_created', 'user_id', 'status', 'created_at', 'id'),
+        db.Index('ix_goal_user_updated', 'user_id', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     target_date = db.Column(db.DateTime)
-    progress = db.Column(db.Integer, default=0)  # 0-100 percentage
+    progress = db.Column(db.Integer, default=0)  # 0-100 percentage; follows the linked tasks once there are any
+    total_tasks = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # tasks linked by Task.goal_id
+    completed_tasks = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     status = db.Column(db.String(20), default='active')  # active, completed, paused
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # bumped by every update, for optimistic concurrency
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
     def __repr__(self):
@@ -75,24 +96,41 @@ class Goal(db.Model):
             'description': self.description,
             'target_date': self.target_date.isoformat() if self.target_date else None,
             'progress': self.progress,
+            'total_tasks': self.total_tasks,
+            'completed_tasks': self.completed_tasks,
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'version': self.version,
             'user_id': self.user_id
         }
 
 class Note(db.Model):
+    __table_args__ = (
+        db.Index('ix_note_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_note_user_type_created', 'user_id', 'note_type', 'created_at', 'id'),
+        db.Index('ix_note_transcription_status', 'transcription_status'),
+        db.Index('ix_note_user_updated', 'user_id', 'updated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
     content = db.Column(db.Text)
     note_type = db.Column(db.String(20), default='text')  # text, voice
-    audio_file_path = db.Column(db.String(500))  # for voice notes
+    audio_file_path = db.Column(db.String(500))  # for voice notes uploaded before audio_key
+    audio_key = db.Column(db.String(64))  # AudioBlob holding the recording of a voice note
     transcription = db.Column(db.Text)  # transcribed text for voice notes
-    tags = db.Column(db.Text)  # JSON string of tags
+    transcription_status = db.Column(db.String(20))  # pending, processing, completed, failed (voice notes only)
+    transcription_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # transcriptions that failed or came back partial
+    tags = db.Column(db.Text)  # Legacy JSON string of tags, superseded by tag_links (see the migrate-tags command)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # bumped by every update, for optimistic concurrency
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    tag_links = db.relationship('NoteTag', backref='note', lazy='selectin', order_by='NoteTag.position',
+                                cascade='all, delete-orphan')
+
     def __repr__(self):
         return f'<Note {self.title or "Untitled"}>'
 
@@ -103,20 +141,132 @@ class Note(db.Model):
             'content': self.content,
             'note_type': self.note_type,
             'audio_file_path': self.audio_file_path,
+            'audio_key': self.audio_key,
             'transcription': self.transcription,
-            'tags': json.loads(self.tags) if self.tags else [],
+            'transcription_status': self.transcription_status,
+            'tags': self.get_tags(),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'version': self.version,
             'user_id': self.user_id
         }
 
     def set_tags(self, tags_list):
-        self.tags = json.dumps(tags_list)
+        names = list(dict.fromkeys(str(tag).strip() for tag in tags_list if str(tag).strip()))
+        existing = {link.name: link for link in self.tag_links}
+        links = []
+        for position, name in enumerate(names):
+            # Reuse links that survive so the (note_id, name) constraint never sees a duplicate
+            link = existing.get(name) or NoteTag(name=name, user_id=self.user_id)
+            link.position = position
+            links.append(link)
+        if self.id is not None and [link.name for link in self.tag_links] != names:
+            self.updated_at = datetime.utcnow()  # Tag changes do not touch the note row otherwise
+        self.tag_links = links
+        self.tags = None
 
     def get_tags(self):
-        return json.loads(self.tags) if self.tags else []
+        if not self.tag_links and self.tags:
+            # Not migrated yet (see the migrate-tags command)
+            return json.loads(self.tags)
+        return [link.name for link in self.tag_links]
+
+class NoteTag(db.Model):
+    __tablename__ = 'note_tag'
+    __table_args__ = (
+        db.UniqueConstraint('note_id', 'name', name='uq_note_tag_note_name'),
+        db.Index('ix_note_tag_user_name', 'user_id', 'name', 'note_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    note_id = db.Column(db.Integer, db.ForeignKey('note.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # denormalized for per-user tag queries
+    name = db.Column(db.String(100), nullable=False)
+    position = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return f'<NoteTag {self.name}>'
+
+class Tombstone(db.Model):
+    """Record of a deleted task, goal or note, for incremental sync clients"""
+    __table_args__ = (
+        db.Index('ix_tombstone_user_type_deleted', 'user_id', 'entity_type', 'deleted_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # tasks, goals, notes
+    entity_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<Tombstone {self.entity_type} {self.entity_id}>'
+
+class AudioBlob(db.Model):
+    """Stored recording, shared by every voice note uploaded with the same bytes"""
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of the uploaded bytes
+    name = db.Column(db.String(200), nullable=False)  # object name in the audio storage backend
+    mimetype = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)  # notes referencing the blob
+    transcoded = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AudioBlob {self.key}>'
+
+class UploadSession(db.Model):
+    """Chunked voice note upload in progress; the bytes so far are in a partial file in the audio storage"""
+    __tablename__ = 'upload_session'
+    __table_args__ = (
+        db.Index('ix_upload_session_expires', 'expires_at'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)  # random token, also names the partial file
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(200))
+    filename = db.Column(db.String(200))
+    mimetype = db.Column(db.String(50))
+    size = db.Column(db.Integer)  # total announced by the client, if any
+    received = db.Column(db.Integer, nullable=False, default=0)  # offset of the next chunk
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<UploadSession {self.id}>'
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'offset': self.received,
+            'size': self.size,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None
+        }
+
+class TranscriptionCacheEntry(db.Model):
+    """Transcription of a recording, reused when the same audio is uploaded again"""
+    __tablename__ = 'transcription_cache'
+    __table_args__ = (
+        db.Index('ix_transcription_cache_raw', 'raw_key', 'config_hash'),
+        db.Index('ix_transcription_cache_used', 'last_used_at'),
+    )
+
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of the normalized audio and recognizer config
+    raw_key = db.Column(db.String(64))  # sha256 of the uploaded bytes (AudioBlob.key)
+    config_hash = db.Column(db.String(64), nullable=False)
+    transcription = db.Column(db.Text, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<TranscriptionCacheEntry {self.key}>'
 
 class Conversation(db.Model):
+    __table_args__ = (
+        db.Index('ix_conversation_user_created', 'user_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     message = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text)
@@ -137,3 +287,23 @@ class Conversation(db.Model):
             'user_id': self.user_id
         }
 
+class ConversationArchive(db.Model):
+    """Compressed segment of a user's oldest conversations, moved out of the conversation table"""
+    __tablename__ = 'conversation_archive'
+    __table_args__ = (
+        db.Index('ix_conversation_archive_user_newest', 'user_id', 'newest_created_at', 'newest_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    oldest_created_at = db.Column(db.DateTime, nullable=False)
+    oldest_id = db.Column(db.Integer, nullable=False)
+    newest_created_at = db.Column(db.DateTime, nullable=False)
+    newest_id = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON list of Conversation.to_dict(), newest first
+    raw_size = db.Column(db.Integer, nullable=False)  # bytes before compression
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ConversationArchive {self.user_id} {self.oldest_id}-{self.newest_id}>'
@@ -0,0 +1,56 @@
+from sqlalchemy import inspect, text
+
+# Columns added after the initial schema. db.create_all() only creates missing
+# tables, so existing databases get these through upgrade_schema().
+# Each entry is (table, column, column DDL).
+ADDED_COLUMNS = [
+    ('note', 'transcription_status', 'VARCHAR(20)'),
+    ('note', 'audio_key', 'VARCHAR(64)'),
+    ('task', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('goal', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('note', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('task', 'goal_id', 'INTEGER REFERENCES goal(id) ON DELETE SET NULL'),
+    ('goal', 'total_tasks', 'INTEGER NOT NULL DEFAULT 0'),
+    ('goal', 'completed_tasks', 'INTEGER NOT NULL DEFAULT 0'),
+    ('note', 'transcription_attempts', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+def upgrade_schema(db):
+    """
+    Bring an existing database up to the current models
+
+    Adds columns listed in ADDED_COLUMNS that are missing from their tables
+    and creates any index declared on the models that does not exist yet.
+    Safe to run repeatedly.
+
+    Args:
+        db: The Flask-SQLAlchemy instance (must be called inside an app context)
+
+    Returns:
+        list: Names of the columns and indexes that were added
+    """
+    inspector = inspect(db.engine)
+    added = []
+
+    with db.engine.begin() as connection:
+        for table, column, ddl in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table)}
+            if column in existing:
+                continue
+            connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+            added.append(f'{table}.{column}')
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=connection)
+                    added.append(index.name)
+
+    return added
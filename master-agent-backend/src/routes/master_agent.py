@@ -1,61 +1,246 @@
-from flask import Blueprint, jsonify, request, current_app
-from src.models.master_agent import User, Task, Goal, Note, Conversation, db
+from flask import Blueprint, jsonify, request, current_app, url_for, stream_with_context, send_file
+from src.models.master_agent import User, Task, Goal, Note, NoteTag, AudioBlob, Conversation, db
+from src.utils.transcription_jobs import transcription_queue, PENDING, COMPLETED
+from src.utils.transcription_cache import transcription_cache
+from src.utils.dashboard_stats import dashboard_cache, get_dashboard_data
+from src.utils.pagination import paginate, decode_cursor, encode_cursor, InvalidCursor, MAX_PAGE_SIZE
+from src.utils.search import search_index, KINDS
+from src.utils.batch_operations import apply_batch, BatchItemError, MAX_BATCH_SIZE
+from src.utils.sync import changes_since, collection_etag, record_deletions, SYNC_MODELS
+from src.utils.streaming import negotiate_stream_format, stream_listing
+from src.utils.response_backends import get_response_backend
+from src.utils.conversation_context import conversation_context
+from src.utils.response_cache import response_cache
+from src.utils.conversation_archive import conversation_archive
+from src.utils.audio_storage import audio_storage, EmptyAudioError, UploadTooLargeError
+from src.utils.versioning import patch_item, ItemNotFound, VersionConflict
+from src.utils.goal_progress import (apply_goal_deltas, check_goal, check_progress, goal_deltas,
+                                     record_goal_deltas, unlink_goal_tasks, InvalidGoal)
+from src.utils.uploads import (start_upload, get_session, append_chunk, finish_upload, abort_upload,
+                               UploadNotFound, OffsetMismatch)
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 import os
 import json
-import uuid
+import time
 
 master_agent_bp = Blueprint('master_agent', __name__)
 
+DEFAULT_PAGE_SIZE = 50
+
+def parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def fetch_page(query, model, default_limit=None):
+    """
+    Run a list query, paginated when the client asks for it
+
+    Pagination applies when 'limit' or 'cursor' is given, or when the endpoint
+    has a default_limit. Otherwise all rows are returned as before.
+    """
+    if default_limit is None and 'limit' not in request.args and 'cursor' not in request.args:
+        return query.all(), None
+    limit = request.args.get('limit', default_limit or DEFAULT_PAGE_SIZE, type=int)
+    return paginate(query, model, limit, request.args.get('cursor'))
+
+def conditional_list(query, model, default_limit=None, user_id=None, section=None, stream_tail=None):
+    """
+    Paginated listing with a weak ETag
+
+    The ETag is derived from an aggregate over the filtered rows, so a client
+    whose If-None-Match still matches gets a 304 without any row being loaded.
+    Clients asking for NDJSON or msgpack get every matching row streamed,
+    followed by the items of stream_tail() if given.
+    JSON pages of a user's section are served from the response cache when
+    possible, without touching the database.
+    """
+    stream_format = negotiate_stream_format()
+    cache_key = None
+    if section and not stream_format:
+        cache_key = response_cache.key(user_id, section, request.query_string.decode())
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            if request.if_none_match.contains_weak(cached['etag']):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.response_class(cached['body'], mimetype='application/json',
+                                                      headers=cached['headers'])
+            response.set_etag(cached['etag'], weak=True)
+            return response
+    
+    etag = collection_etag(query, model)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    elif stream_format:
+        response = stream_listing(query, model, stream_format, tail=stream_tail)
+    else:
+        items, next_cursor = fetch_page(query, model, default_limit)
+        response = list_response(items, next_cursor)
+        response_cache.set(cache_key, response.get_data(as_text=True), etag,
+                           {name: response.headers[name] for name in ('X-Next-Cursor', 'Link') if name in response.headers})
+    response.set_etag(etag, weak=True)
+    return response
+
+def list_response(items, next_cursor):
+    """JSON array of items; the next page is announced in X-Next-Cursor and Link headers"""
+    response = jsonify([item.to_dict() for item in items])
+    if next_cursor:
+        args = request.args.to_dict(flat=False)
+        args['cursor'] = [next_cursor]
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return response
+
+def if_match_version():
+    """
+    Item version named by the If-Match header
+
+    The header must hold a single entity tag whose value is the version,
+    strong ("3") or weak (W/"3"); several tags or * name no single version.
+
+    Returns:
+        int: The version, or None without an If-Match header
+
+    Raises:
+        ValueError: If the header does not name exactly one version
+    """
+    if 'If-Match' not in request.headers:
+        return None
+    tags = request.if_match.as_set(include_weak=True)
+    if request.if_match.star_tag or len(tags) != 1:
+        raise ValueError('If-Match must hold exactly one version, e.g. "3" or W/"3"')
+    return int(tags.pop())
+
+def patch_response(model, item_id):
+    """
+    PATCH a task, goal or note: a partial update checked against the item's version
+
+    The version the edit is based on comes from the 'version' field of the
+    body or from an If-Match header (see if_match_version); a stale version
+    gets 409 with the current item so the client can merge and retry.
+    """
+    try:
+        data = request.json or {}
+        version = data.get('version', if_match_version())
+        if version is None:
+            return jsonify({'error': 'version is required (body field or If-Match header)'}), 428
+        item_dict = patch_item(model, item_id, data, int(version))
+        return jsonify(item_dict)
+    except VersionConflict as e:
+        return jsonify({'error': str(e), 'current': e.current.to_dict()}), 409
+    except ItemNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except (BatchItemError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Chat endpoint
 @master_agent_bp.route('/chat', methods=['POST'])
 def chat():
     try:
-        data = request.json
-        user_id = data.get('user_id', 1)  # Default user for now
-        message = data.get('message', '')
+        user_id, message = chat_request(request.json)
         
-        # Simple response logic (can be enhanced with LLM integration)
-        response = generate_response(message)
+        context = conversation_context.get(user_id)
+        response = get_response_backend().generate(message, user_id=user_id, context=context)
         
-        # Save conversation
-        conversation = Conversation(
-            message=message,
-            response=response,
-            user_id=user_id
-        )
-        db.session.add(conversation)
-        db.session.commit()
+        return jsonify(chat_reply(save_conversation(user_id, message, response)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Shared by the Flask views and the native ASGI handlers in src/asgi.py
+def chat_request(data):
+    """user_id and message of a chat request body"""
+    data = data or {}
+    return data.get('user_id', 1), data.get('message', '')  # Default user for now
+
+def save_conversation(user_id, message, response):
+    """Store a chat exchange and add it to the caches holding conversations"""
+    conversation = Conversation(message=message, response=response, user_id=user_id)
+    db.session.add(conversation)
+    db.session.commit()
+    conversation_context.append(conversation)
+    response_cache.invalidate(conversation.user_id, 'conversations')
+    return conversation
+
+def chat_reply(conversation):
+    return {'response': conversation.response, 'conversation_id': conversation.id}
+
+def stream_done(conversation, started, first_token_at):
+    """Payload of the final event of a streamed reply, with its timings"""
+    finished = time.perf_counter()
+    return {
+        'conversation_id': conversation.id,
+        'response': conversation.response,
+        'ttft_ms': round(((first_token_at or finished) - started) * 1000, 1),
+        'total_ms': round((finished - started) * 1000, 1)
+    }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming chat endpoint (server-sent events)
+@master_agent_bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    try:
+        user_id, message = chat_request(request.json)
+        backend = get_response_backend()
+        started = time.perf_counter()
+        context = conversation_context.get(user_id)
         
-        return jsonify({
-            'response': response,
-            'conversation_id': conversation.id
-        })
+        def generate():
+            tokens = []
+            first_token_at = None
+            try:
+                for token in backend.stream(message, user_id=user_id, context=context):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    tokens.append(token)
+                    yield sse_event('token', {'token': token})
+                
+                # Save the conversation only once the whole reply is known
+                conversation = save_conversation(user_id, message, ''.join(tokens))
+                yield sse_event('done', stream_done(conversation, started, first_token_at))
+            except Exception as e:
+                db.session.rollback()
+                yield sse_event('error', {'error': str(e)})
+        
+        response = current_app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Conversation context cache statistics, for sizing CONVERSATION_CONTEXT_MAX_BYTES
+@master_agent_bp.route('/chat/context/stats', methods=['GET'])
+def chat_context_stats():
+    return jsonify(conversation_context.stats())
+
+# Response cache statistics: hit ratio of this worker and memory used
+@master_agent_bp.route('/cache/stats', methods=['GET'])
+def response_cache_stats():
+    return jsonify(response_cache.stats())
+
 def generate_response(message):
-    """Simple response generator - can be enhanced with LLM integration"""
-    message_lower = message.lower()
-    
-    if 'task' in message_lower and ('create' in message_lower or 'add' in message_lower):
-        return "I can help you create a task. Please use the task management interface or tell me more details about the task."
-    elif 'goal' in message_lower:
-        return "I can help you with goal tracking. What goal would you like to work on?"
-    elif 'note' in message_lower:
-        return "I can help you take notes. Would you like to create a text note or voice note?"
-    elif 'hello' in message_lower or 'hi' in message_lower:
-        return "Hello! I'm your Master Agent. I can help you manage tasks, track goals, take notes, and organize your life. How can I assist you today?"
-    else:
-        return "I understand you're asking about: " + message + ". How can I help you with this?"
+    """Reply to a message with the configured response backend"""
+    return get_response_backend().generate(message)
 
 # Task management endpoints
 @master_agent_bp.route('/tasks', methods=['GET'])
 def get_tasks():
     try:
         user_id = request.args.get('user_id', 1, type=int)
-        tasks = Task.query.filter_by(user_id=user_id).all()
-        return jsonify([task.to_dict() for task in tasks])
+        query = Task.query.filter_by(user_id=user_id)
+        
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        if request.args.get('priority'):
+            query = query.filter_by(priority=request.args['priority'])
+        
+        return conditional_list(query, Task, user_id=user_id, section='tasks')
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -69,11 +254,22 @@ def create_task():
             status=data.get('status', 'pending'),
             priority=data.get('priority', 'medium'),
             due_date=datetime.fromisoformat(data['due_date']) if data.get('due_date') else None,
-            user_id=data.get('user_id', 1)
+            user_id=data.get('user_id', 1),
+            goal_id=data.get('goal_id')
         )
+        check_goal(task.user_id, task.goal_id)
         db.session.add(task)
+        deltas = goal_deltas([], [(task.goal_id, task.status)])
+        apply_goal_deltas(deltas)
         db.session.commit()
-        return jsonify(task.to_dict()), 201
+        
+        task_dict = task.to_dict()
+        dashboard_cache.record_create(task.user_id, 'tasks', task.status, task_dict)
+        response_cache.invalidate(task.user_id, 'tasks')
+        record_goal_deltas(task.user_id, deltas)
+        return jsonify(task_dict), 201
+    except InvalidGoal as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -82,6 +278,8 @@ def update_task(task_id):
     try:
         task = Task.query.get_or_404(task_id)
         data = request.json
+        old_status = task.status
+        old_goal_id = task.goal_id
         
         task.title = data.get('title', task.title)
         task.description = data.get('description', task.description)
@@ -89,18 +287,41 @@ def update_task(task_id):
         task.priority = data.get('priority', task.priority)
         if data.get('due_date'):
             task.due_date = datetime.fromisoformat(data['due_date'])
+        if 'goal_id' in data:
+            check_goal(task.user_id, data['goal_id'])
+            task.goal_id = data['goal_id']
         
+        deltas = goal_deltas([(old_goal_id, old_status)], [(task.goal_id, task.status)])
+        apply_goal_deltas(deltas)
+        task.version = Task.version + 1
         db.session.commit()
-        return jsonify(task.to_dict())
+        
+        task_dict = task.to_dict()
+        dashboard_cache.record_update(task.user_id, 'tasks', old_status, task.status, task_dict)
+        response_cache.invalidate(task.user_id, 'tasks')
+        record_goal_deltas(task.user_id, deltas)
+        return jsonify(task_dict)
+    except InvalidGoal as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@master_agent_bp.route('/tasks/<int:task_id>', methods=['PATCH'])
+def patch_task(task_id):
+    return patch_response(Task, task_id)
+
 @master_agent_bp.route('/tasks/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id):
     try:
         task = Task.query.get_or_404(task_id)
         db.session.delete(task)
+        record_deletions('tasks', task.user_id, [task.id])
+        deltas = goal_deltas([(task.goal_id, task.status)], [])
+        apply_goal_deltas(deltas)
         db.session.commit()
+        dashboard_cache.record_delete(task.user_id, 'tasks', task.status, task.id)
+        response_cache.invalidate(task.user_id, 'tasks')
+        record_goal_deltas(task.user_id, deltas)
         return '', 204
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -110,8 +331,14 @@ def delete_task(task_id):
 def get_goals():
     try:
         user_id = request.args.get('user_id', 1, type=int)
-        goals = Goal.query.filter_by(user_id=user_id).all()
-        return jsonify([goal.to_dict() for goal in goals])
+        query = Goal.query.filter_by(user_id=user_id)
+        
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        
+        return conditional_list(query, Goal, user_id=user_id, section='goals')
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -129,6 +356,8 @@ def create_goal():
         )
         db.session.add(goal)
         db.session.commit()
+        dashboard_cache.record_create(goal.user_id, 'goals', goal.status)
+        response_cache.invalidate(goal.user_id, 'goals')
         return jsonify(goal.to_dict()), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -138,25 +367,43 @@ def update_goal(goal_id):
     try:
         goal = Goal.query.get_or_404(goal_id)
         data = request.json
+        old_status = goal.status
         
         goal.title = data.get('title', goal.title)
         goal.description = data.get('description', goal.description)
-        goal.progress = data.get('progress', goal.progress)
+        if 'progress' in data:
+            check_progress(goal.total_tasks, data['progress'])
+            goal.progress = data['progress']
         goal.status = data.get('status', goal.status)
         if data.get('target_date'):
             goal.target_date = datetime.fromisoformat(data['target_date'])
         
+        goal.version = Goal.version + 1
         db.session.commit()
+        dashboard_cache.record_update(goal.user_id, 'goals', old_status, goal.status)
+        response_cache.invalidate(goal.user_id, 'goals')
         return jsonify(goal.to_dict())
+    except InvalidGoal as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@master_agent_bp.route('/goals/<int:goal_id>', methods=['PATCH'])
+def patch_goal(goal_id):
+    return patch_response(Goal, goal_id)
+
 @master_agent_bp.route('/goals/<int:goal_id>', methods=['DELETE'])
 def delete_goal(goal_id):
     try:
         goal = Goal.query.get_or_404(goal_id)
+        unlink_goal_tasks([goal.id])
         db.session.delete(goal)
+        record_deletions('goals', goal.user_id, [goal.id])
         db.session.commit()
+        dashboard_cache.record_delete(goal.user_id, 'goals', goal.status)
+        dashboard_cache.record_sums(goal.user_id, 'goals', {'linked_tasks': -goal.total_tasks,
+                                                            'completed_tasks': -goal.completed_tasks})
+        response_cache.invalidate(goal.user_id, 'goals', 'tasks')
         return '', 204
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -166,8 +413,41 @@ def delete_goal(goal_id):
 def get_notes():
     try:
         user_id = request.args.get('user_id', 1, type=int)
-        notes = Note.query.filter_by(user_id=user_id).all()
-        return jsonify([note.to_dict() for note in notes])
+        query = Note.query.filter_by(user_id=user_id)
+        
+        if request.args.get('note_type'):
+            query = query.filter_by(note_type=request.args['note_type'])
+        tags = request.args.getlist('tag')
+        if tags:
+            query = query.filter(Note.id.in_(notes_with_tags(user_id, tags, request.args.get('tag_match', 'all'))))
+        
+        return conditional_list(query, Note, user_id=user_id, section='notes')
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def notes_with_tags(user_id, tags, match='all'):
+    """Subquery of ids of a user's notes tagged with all (or any) of the given tags"""
+    query = db.session.query(NoteTag.note_id)\
+                      .filter(NoteTag.user_id == user_id, NoteTag.name.in_(tags))
+    if match == 'any':
+        return query.distinct()
+    return query.group_by(NoteTag.note_id)\
+                .having(db.func.count(db.distinct(NoteTag.name)) == len(set(tags)))
+
+@master_agent_bp.route('/notes/tags', methods=['GET'])
+def get_note_tags():
+    try:
+        user_id = request.args.get('user_id', 1, type=int)
+        
+        counts = db.session.query(NoteTag.name, db.func.count(NoteTag.note_id))\
+                           .filter(NoteTag.user_id == user_id)\
+                           .group_by(NoteTag.name)\
+                           .order_by(db.func.count(NoteTag.note_id).desc(), NoteTag.name)\
+                           .all()
+        
+        return jsonify([{'tag': name, 'count': count} for name, count in counts])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -188,7 +468,11 @@ def create_note():
         
         db.session.add(note)
         db.session.commit()
-        return jsonify(note.to_dict()), 201
+        
+        note_dict = note.to_dict()
+        dashboard_cache.record_create(note.user_id, 'notes', note.note_type, note_dict)
+        response_cache.invalidate(note.user_id, 'notes')
+        return jsonify(note_dict), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -205,11 +489,20 @@ def update_note(note_id):
         if data.get('tags'):
             note.set_tags(data['tags'])
         
+        note.version = Note.version + 1
         db.session.commit()
-        return jsonify(note.to_dict())
+        
+        note_dict = note.to_dict()
+        dashboard_cache.record_update(note.user_id, 'notes', note.note_type, note.note_type, note_dict)
+        response_cache.invalidate(note.user_id, 'notes')
+        return jsonify(note_dict)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@master_agent_bp.route('/notes/<int:note_id>', methods=['PATCH'])
+def patch_note(note_id):
+    return patch_response(Note, note_id)
+
 @master_agent_bp.route('/notes/<int:note_id>', methods=['DELETE'])
 def delete_note(note_id):
     try:
@@ -218,14 +511,49 @@ def delete_note(note_id):
         # Delete audio file if it exists
         if note.audio_file_path and os.path.exists(note.audio_file_path):
             os.remove(note.audio_file_path)
+        audio_storage.release([note.audio_key])
         
         db.session.delete(note)
+        record_deletions('notes', note.user_id, [note.id])
         db.session.commit()
+        audio_storage.collect([note.audio_key])
+        dashboard_cache.record_delete(note.user_id, 'notes', note.note_type, note.id)
+        response_cache.invalidate(note.user_id, 'notes')
         return '', 204
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Voice note upload endpoint
+# Voice note upload endpoints
+def voice_note_response(blob, user_id, title):
+    """Create the note of a stored recording and queue its transcription"""
+    # A retried or repeated upload reuses the earlier transcription
+    cached_transcription = transcription_cache.lookup_upload(blob.key)
+    
+    # Create note record; otherwise validation and transcription run in the background
+    note = Note(
+        title=title or f"Voice Note {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+        note_type='voice',
+        audio_key=blob.key,
+        transcription=cached_transcription,
+        transcription_status=COMPLETED if cached_transcription is not None else PENDING,
+        user_id=user_id
+    )
+    
+    db.session.add(note)
+    db.session.commit()
+    
+    note_dict = note.to_dict()
+    dashboard_cache.record_create(note.user_id, 'notes', note.note_type, note_dict)
+    response_cache.invalidate(note.user_id, 'notes')
+    note_dict['from_cache'] = cached_transcription is not None
+    if cached_transcription is not None:
+        return jsonify(note_dict), 201
+    
+    transcription_queue.submit(note.id)
+    response = jsonify(note_dict)
+    response.headers['Location'] = url_for('master_agent.get_transcription_status', note_id=note.id)
+    return response, 202
+
 @master_agent_bp.route('/notes/voice', methods=['POST'])
 def upload_voice_note():
     try:
@@ -236,48 +564,143 @@ def upload_voice_note():
         user_id = request.form.get('user_id', 1, type=int)
         title = request.form.get('title', '')
         
-        # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join(current_app.root_path, 'uploads', 'voice_notes')
-        os.makedirs(upload_dir, exist_ok=True)
+        # Store the recording once per content hash
+        try:
+            blob = audio_storage.save_upload(audio_file)
+        except EmptyAudioError as e:
+            return jsonify({'error': f'Invalid audio file: {e}'}), 400
         
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}.wav"
-        file_path = os.path.join(upload_dir, filename)
+        return voice_note_response(blob, user_id, title)
+    except (UploadTooLargeError, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Resumable uploads: start, append chunks at the acknowledged offset, finish
+def upload_response(session, status=200):
+    response = jsonify(session.to_dict())
+    response.headers['Upload-Offset'] = str(session.received)
+    response.headers['Location'] = url_for('master_agent.append_voice_upload', upload_id=session.id)
+    return response, status
+
+@master_agent_bp.route('/notes/voice/uploads', methods=['POST'])
+def start_voice_upload():
+    try:
+        data = request.json or {}
+        size = data.get('size')
+        if size is not None and (not isinstance(size, int) or size < 0):
+            return jsonify({'error': 'size must be a non-negative integer'}), 400
         
-        # Save audio file
-        audio_file.save(file_path)
+        session = start_upload(data.get('user_id', 1), title=data.get('title'), filename=data.get('filename'),
+                               mimetype=data.get('mimetype'), size=size)
+        response, status = upload_response(session, 201)
+        response.headers['Upload-Chunk-Max'] = str(audio_storage.max_chunk_bytes)
+        return response, status
+    except UploadTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/voice/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def get_voice_upload(upload_id):
+    try:
+        return upload_response(get_session(upload_id))
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/voice/uploads/<upload_id>', methods=['PATCH'])
+def append_voice_upload(upload_id):
+    try:
+        offset = request.headers.get('Upload-Offset', request.args.get('offset'), type=int)
+        if offset is None:
+            return jsonify({'error': 'Upload-Offset header required'}), 400
         
-        # Import speech processing utilities
+        # The body is streamed to the partial file, never loaded whole
+        session = append_chunk(upload_id, offset, request.stream, request.content_length)
+        return upload_response(session)
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except OffsetMismatch as e:
+        response = jsonify({'error': str(e), 'offset': e.expected})
+        response.headers['Upload-Offset'] = str(e.expected)
+        return response, 409
+    except (UploadTooLargeError, RequestEntityTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/voice/uploads/<upload_id>/finish', methods=['POST'])
+def finish_voice_upload(upload_id):
+    try:
         try:
-            from src.utils.speech_processing import transcribe_audio, validate_audio_file
-            
-            # Validate audio file
-            is_valid, validation_message = validate_audio_file(file_path)
-            if not is_valid:
-                os.remove(file_path)  # Clean up invalid file
-                return jsonify({'error': f'Invalid audio file: {validation_message}'}), 400
-            
-            # Transcribe audio to text
-            transcription = transcribe_audio(file_path)
-            
-        except ImportError:
-            transcription = "Transcription not available - speech processing dependencies not installed"
-        except Exception as e:
-            transcription = f"Transcription failed: {str(e)}"
-        
-        # Create note record
-        note = Note(
-            title=title or f"Voice Note {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-            note_type='voice',
-            audio_file_path=file_path,
-            transcription=transcription,
-            user_id=user_id
-        )
+            blob, session = finish_upload(upload_id)
+        except EmptyAudioError as e:
+            return jsonify({'error': f'Invalid audio file: {e}'}), 400
+        except UploadNotFound as e:
+            return jsonify({'error': str(e)}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
         
-        db.session.add(note)
-        db.session.commit()
+        return voice_note_response(blob, session.user_id, session.title)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/voice/uploads/<upload_id>', methods=['DELETE'])
+def abort_voice_upload(upload_id):
+    try:
+        abort_upload(upload_id)
+        return '', 204
+    except UploadNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def transcription_status_dict(note):
+    return {
+        'note_id': note.id,
+        'status': note.transcription_status,
+        'transcription': note.transcription,
+        'updated_at': note.updated_at.isoformat() if note.updated_at else None
+    }
+
+# Voice note playback; supports Range requests for seeking
+@master_agent_bp.route('/notes/<int:note_id>/audio', methods=['GET'])
+def get_note_audio(note_id):
+    try:
+        note = Note.query.get_or_404(note_id)
+        blob = db.session.get(AudioBlob, note.audio_key) if note.audio_key else None
+        if blob is not None:
+            return audio_storage.send(blob)
+        if note.audio_file_path and os.path.exists(note.audio_file_path):
+            return send_file(note.audio_file_path, conditional=True)
+        return jsonify({'error': 'Note has no audio'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Transcription job status endpoints
+@master_agent_bp.route('/notes/<int:note_id>/transcription', methods=['GET'])
+def get_transcription_status(note_id):
+    try:
+        note = Note.query.get_or_404(note_id)
+        return jsonify(transcription_status_dict(note))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/transcriptions', methods=['GET', 'POST'])
+def get_transcription_statuses():
+    try:
+        if request.method == 'POST':
+            note_ids = (request.json or {}).get('note_ids', [])
+        else:
+            note_ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        
+        if not note_ids:
+            return jsonify({'error': 'No note ids provided'}), 400
         
-        return jsonify(note.to_dict()), 201
+        notes = Note.query.filter(Note.id.in_(note_ids)).all()
+        return jsonify([transcription_status_dict(note) for note in notes])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -286,65 +709,187 @@ def upload_voice_note():
 def get_conversations():
     try:
         user_id = request.args.get('user_id', 1, type=int)
-        limit = request.args.get('limit', 50, type=int)
+        query = Conversation.query.filter_by(user_id=user_id)
+        
+        response = conditional_list(query, Conversation, default_limit=DEFAULT_PAGE_SIZE,
+                                    user_id=user_id, section='conversations',
+                                    stream_tail=lambda: conversation_archive.conversations(user_id))
+        if response.status_code == 200 and response.mimetype == 'application/json' \
+                and 'X-Next-Cursor' not in response.headers:
+            response = continue_into_archive(response, user_id)
+        return response
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def continue_into_archive(response, user_id):
+    """
+    Fill the last page of the conversation table from the archive
+
+    Archived conversations are all older than the ones in the table, so the
+    listing goes on with them using the same cursors; they carry
+    'archived': true. The ETag still holds: archiving changes the table.
+    """
+    items = response.get_json()
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    if items:
+        before = (datetime.fromisoformat(items[-1]['created_at']), items[-1]['id'])
+    elif request.args.get('cursor'):
+        before = decode_cursor(request.args['cursor'])
+    else:
+        before = None
+    archived, more = conversation_archive.page(user_id, limit - len(items), before)
+    if not archived and not more:
+        return response
+    
+    items += archived
+    extended = jsonify(items)
+    if more:
+        next_cursor = encode_cursor(datetime.fromisoformat(items[-1]['created_at']), items[-1]['id'])
+        args = request.args.to_dict(flat=False)
+        args['cursor'] = [next_cursor]
+        extended.headers['X-Next-Cursor'] = next_cursor
+        extended.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    extended.headers['ETag'] = response.headers['ETag']
+    return extended
+
+# Archived conversations: segments, conversations and compressed size
+@master_agent_bp.route('/conversations/archive/stats', methods=['GET'])
+def conversation_archive_stats():
+    try:
+        user_id = request.args.get('user_id', type=int)
+        return jsonify(conversation_archive.stats(user_id))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Batch endpoints
+def batch_response(model):
+    data = request.json or {}
+    operations = data.get('operations')
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'No operations provided'}), 400
+    if len(operations) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} operations per batch'}), 413
+    
+    results, applied = apply_batch(model, operations, data.get('user_id', 1), atomic=bool(data.get('atomic')))
+    failed = sum(1 for result in results if result['status'] >= 400)
+    
+    return jsonify({
+        'applied': applied,
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results
+    }), 200 if applied else 422
+
+@master_agent_bp.route('/tasks/batch', methods=['POST'])
+def batch_tasks():
+    try:
+        return batch_response(Task)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/goals/batch', methods=['POST'])
+def batch_goals():
+    try:
+        return batch_response(Goal)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@master_agent_bp.route('/notes/batch', methods=['POST'])
+def batch_notes():
+    try:
+        return batch_response(Note)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# Incremental sync endpoint
+@master_agent_bp.route('/sync', methods=['GET'])
+def sync():
+    try:
+        user_id = request.args.get('user_id', 1, type=int)
+        since = request.args.get('since')
+        entity_types = [t for t in request.args.get('types', '').split(',') if t] or None
         
-        conversations = Conversation.query.filter_by(user_id=user_id)\
-                                        .order_by(Conversation.created_at.desc())\
-                                        .limit(limit).all()
+        if entity_types and any(t not in SYNC_MODELS for t in entity_types):
+            return jsonify({'error': f"types must be among {', '.join(SYNC_MODELS)}"}), 400
+        try:
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'error': f'Invalid since watermark: {since}'}), 400
         
-        return jsonify([conv.to_dict() for conv in conversations])
+        return jsonify(changes_since(user_id, since, entity_types))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Dashboard stats endpoint
-@master_agent_bp.route('/dashboard', methods=['GET'])
-def get_dashboard():
+# Search endpoint
+@master_agent_bp.route('/search', methods=['GET'])
+def search():
     try:
         user_id = request.args.get('user_id', 1, type=int)
+        query = request.args.get('q', '').strip()
+        kind = request.args.get('kind')
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+        offset = max(0, request.args.get('offset', 0, type=int))
         
-        # Get task statistics
-        total_tasks = Task.query.filter_by(user_id=user_id).count()
-        completed_tasks = Task.query.filter_by(user_id=user_id, status='completed').count()
-        pending_tasks = Task.query.filter_by(user_id=user_id, status='pending').count()
+        if not query:
+            return jsonify({'error': 'No search query provided'}), 400
+        if kind and kind not in KINDS:
+            return jsonify({'error': f'Unknown kind: {kind}'}), 400
         
-        # Get goal statistics
-        total_goals = Goal.query.filter_by(user_id=user_id).count()
-        active_goals = Goal.query.filter_by(user_id=user_id, status='active').count()
-        completed_goals = Goal.query.filter_by(user_id=user_id, status='completed').count()
+        # Fetch one extra hit to know whether another page exists
+        hits = search_index.search(user_id, query, kind=kind, limit=limit + 1, offset=offset)
         
-        # Get note statistics
-        total_notes = Note.query.filter_by(user_id=user_id).count()
-        text_notes = Note.query.filter_by(user_id=user_id, note_type='text').count()
-        voice_notes = Note.query.filter_by(user_id=user_id, note_type='voice').count()
+        return jsonify({
+            'query': query,
+            'results': hits[:limit],
+            'next_offset': offset + limit if len(hits) > limit else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Dashboard stats endpoint
+@master_agent_bp.route('/dashboard', methods=['GET'])
+def get_dashboard():
+    try:
+        user_id = request.args.get('user_id', 1, type=int)
         
-        # Get recent activity
-        recent_tasks = Task.query.filter_by(user_id=user_id)\
-                                .order_by(Task.created_at.desc())\
-                                .limit(5).all()
+        verify = request.args.get('verify', current_app.config.get('DASHBOARD_VERIFY_CACHE', False), type=parse_bool)
         
-        recent_notes = Note.query.filter_by(user_id=user_id)\
-                                .order_by(Note.created_at.desc())\
-                                .limit(5).all()
+        counts, recent, info = get_dashboard_data(user_id, verify=verify)
         
-        return jsonify({
+        response = {
             'tasks': {
-                'total': total_tasks,
-                'completed': completed_tasks,
-                'pending': pending_tasks,
-                'recent': [task.to_dict() for task in recent_tasks]
+                'total': counts['tasks']['total'],
+                'completed': counts['tasks']['completed'],
+                'pending': counts['tasks']['pending'],
+                'recent': recent['tasks']
             },
             'goals': {
-                'total': total_goals,
-                'active': active_goals,
-                'completed': completed_goals
+                'total': counts['goals']['total'],
+                'active': counts['goals']['active'],
+                'completed': counts['goals']['completed'],
+                'linked_tasks': counts['goals']['linked_tasks'],
+                'completed_tasks': counts['goals']['completed_tasks'],
+                'progress': counts['goals']['completed_tasks'] * 100 // counts['goals']['linked_tasks']
+                            if counts['goals']['linked_tasks'] else 0
             },
             'notes': {
-                'total': total_notes,
-                'text': text_notes,
-                'voice': voice_notes,
-                'recent': [note.to_dict() for note in recent_notes]
+                'total': counts['notes']['total'],
+                'text': counts['notes']['text'],
+                'voice': counts['notes']['voice'],
+                'recent': recent['notes']
             }
-        })
+        }
+        if verify:
+            response['cache'] = info
+        
+        response = jsonify(response)
+        response.add_etag(weak=True)
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-
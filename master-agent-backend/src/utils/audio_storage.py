@@ -0,0 +1,362 @@
+import hashlib
+import importlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from flask import send_file
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.master_agent import AudioBlob, db
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 64 * 1024
+OPUS_MIMETYPE = 'audio/ogg'
+
+class EmptyAudioError(ValueError):
+    pass
+
+class UploadTooLargeError(ValueError):
+    pass
+
+class LocalAudioStorage:
+    """
+    Stores audio objects as files under a directory
+
+    Objects are served with send_file, which answers Range requests with 206
+    and lets the WSGI server send the file with sendfile() (no copy through
+    Python).
+    """
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def staging_file(self):
+        """Temporary file on the same filesystem, so that put() is a rename"""
+        return tempfile.NamedTemporaryFile(dir=self.root, prefix='.upload-', delete=False)
+
+    def partial_path(self, upload_id):
+        """Local file collecting the chunks of a resumable upload"""
+        directory = self._path('.partial')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, upload_id)
+
+    def put(self, name, source_path):
+        """Move a local file in as an object; an existing object with the same name is kept"""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(source_path)
+        else:
+            os.replace(source_path, path)
+
+    def delete(self, name):
+        path = self._path(name)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))  # Only succeeds once the prefix directory is empty
+        except OSError:
+            pass
+
+    @contextmanager
+    def local_path(self, name):
+        """Path of the object on local disk, for decoding"""
+        yield self._path(name)
+
+    def send(self, name, mimetype):
+        # Served at the note's URL, whose bytes change when the recording is
+        # transcoded: clients revalidate with the ETag instead of caching it
+        return send_file(self._path(name), mimetype=mimetype, conditional=True, max_age=0)
+
+BACKENDS = {
+    'local': LocalAudioStorage,
+}
+
+class AudioStorage:
+    """
+    Content-addressed storage of voice note recordings
+
+    Uploads are stored once per sha256 of their bytes in an AudioBlob row
+    that counts the notes referencing it; the object is deleted with the last
+    of them. After transcription, recordings are transcoded to Opus
+    (AUDIO_OPUS_BITRATE, mono) when that makes them smaller. Objects live in a
+    pluggable backend: AUDIO_STORAGE_BACKEND is 'local' (files under
+    AUDIO_STORAGE_DIR) or 'package.module:Class' taking the app.
+
+    Resumable uploads collect their chunks in a partial file from the
+    backend, which is hashed and moved in like a regular upload when
+    finished. Uploads are limited to VOICE_UPLOAD_MAX_BYTES, and chunks to
+    VOICE_UPLOAD_CHUNK_BYTES.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.transcode_enabled = True
+        self.opus_bitrate = '24k'
+        self.max_upload_bytes = 512 * 1024 * 1024
+        self.max_chunk_bytes = 8 * 1024 * 1024
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIO_STORAGE_BACKEND', os.environ.get('AUDIO_STORAGE_BACKEND', 'local'))
+        app.config.setdefault('AUDIO_STORAGE_DIR', os.environ.get(
+            'AUDIO_STORAGE_DIR', os.path.join(app.root_path, 'uploads', 'voice_notes')))
+        app.config.setdefault('AUDIO_TRANSCODE', os.environ.get('AUDIO_TRANSCODE', 'true').lower() == 'true')
+        app.config.setdefault('AUDIO_OPUS_BITRATE', os.environ.get('AUDIO_OPUS_BITRATE', '24k'))
+        app.config.setdefault('VOICE_UPLOAD_MAX_BYTES', int(os.environ.get('VOICE_UPLOAD_MAX_BYTES', 512 * 1024 * 1024)))
+        app.config.setdefault('VOICE_UPLOAD_CHUNK_BYTES', int(os.environ.get('VOICE_UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024)))
+        self.transcode_enabled = app.config['AUDIO_TRANSCODE']
+        self.opus_bitrate = app.config['AUDIO_OPUS_BITRATE']
+        self.max_upload_bytes = app.config['VOICE_UPLOAD_MAX_BYTES']
+        self.max_chunk_bytes = app.config['VOICE_UPLOAD_CHUNK_BYTES']
+
+        spec = app.config['AUDIO_STORAGE_BACKEND']
+        if spec in BACKENDS:
+            self.backend = BACKENDS[spec](app.config['AUDIO_STORAGE_DIR'])
+        else:
+            module_name, _, class_name = spec.partition(':')
+            if not class_name:
+                raise ValueError(f'Unknown audio storage backend: {spec}')
+            self.backend = getattr(importlib.import_module(module_name), class_name)(app)
+        app.extensions['audio_storage'] = self
+
+    def save_upload(self, upload):
+        """
+        Store an uploaded file, or reference the identical one already stored
+
+        Hashes the upload while copying it to a staging file. The AudioBlob
+        reference is added in the current transaction; the caller commits.
+
+        Args:
+            upload (FileStorage): The uploaded file
+
+        Returns:
+            AudioBlob: The blob holding the recording
+
+        Raises:
+            EmptyAudioError: If the upload has no bytes
+            UploadTooLargeError: If the upload is larger than VOICE_UPLOAD_MAX_BYTES
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with self.backend.staging_file() as staging:
+            while True:
+                chunk = upload.stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    break
+                digest.update(chunk)
+                staging.write(chunk)
+        if size == 0 or size > self.max_upload_bytes:
+            os.remove(staging.name)
+            if size:
+                raise UploadTooLargeError(f'Audio file is larger than {self.max_upload_bytes} bytes')
+            raise EmptyAudioError('Audio file is empty')
+        return self._store(staging.name, digest.hexdigest(), size, upload.filename, upload.mimetype)
+
+    def _store(self, staging_path, key, size, filename, mimetype):
+        """Move a staged recording in under its hash, or reference the blob already holding it"""
+        if self._add_reference(key):
+            os.remove(staging_path)
+            return db.session.get(AudioBlob, key)
+
+        extension = os.path.splitext(filename or '')[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,8}', extension):
+            extension = '.wav'
+        mimetype = mimetype if mimetype and mimetype != 'application/octet-stream' \
+            else mimetypes.guess_type('x' + extension)[0] or 'audio/wav'
+        name = f'{key[:2]}/{key}{extension}'
+        self.backend.put(name, staging_path)
+        try:
+            with db.session.begin_nested():
+                blob = AudioBlob(key=key, name=name, mimetype=mimetype, size=size, ref_count=1)
+                db.session.add(blob)
+        except IntegrityError:
+            # Inserted concurrently by an identical upload; reference that one
+            self._add_reference(key)
+            blob = db.session.get(AudioBlob, key)
+        return blob
+
+    def start_partial(self, upload_id):
+        """Create the empty partial file of a resumable upload"""
+        open(self.backend.partial_path(upload_id), 'wb').close()
+
+    def write_partial(self, upload_id, offset, stream, total=None):
+        """
+        Write a chunk into a partial upload at an offset
+
+        Copies the stream in HASH_CHUNK_SIZE pieces, so memory use does not
+        depend on the chunk size.
+
+        Args:
+            upload_id (str): UploadSession id
+            offset (int): Position of the chunk in the recording
+            stream: Readable binary stream with the chunk
+            total (int): Size of the whole upload, if known
+
+        Returns:
+            int: Number of bytes written
+
+        Raises:
+            UploadTooLargeError: If the chunk is larger than VOICE_UPLOAD_CHUNK_BYTES
+                or would take the upload past its total or VOICE_UPLOAD_MAX_BYTES
+            FileNotFoundError: If the partial file is gone
+        """
+        total = self.max_upload_bytes if total is None else min(total, self.max_upload_bytes)
+        limit = min(self.max_chunk_bytes, total - offset)
+        written = 0
+        with open(self.backend.partial_path(upload_id), 'r+b') as partial:
+            partial.seek(offset)
+            while True:
+                chunk = stream.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    partial.truncate(offset)
+                    raise UploadTooLargeError('Chunk is too large' if limit == self.max_chunk_bytes
+                                              else f'Chunk goes past the end of the upload ({total} bytes)')
+                partial.write(chunk)
+        return written
+
+    def finish_partial(self, upload_id, size, filename, mimetype):
+        """
+        Store a completed resumable upload like save_upload()
+
+        Args:
+            upload_id (str): UploadSession id
+            size (int): Bytes acknowledged to the client; anything written past
+                them by an abandoned chunk is dropped
+
+        Returns:
+            AudioBlob: The blob holding the recording
+
+        Raises:
+            EmptyAudioError: If no bytes were uploaded
+        """
+        if size == 0:
+            raise EmptyAudioError('Audio file is empty')
+        path = self.backend.partial_path(upload_id)
+        digest = hashlib.sha256()
+        with open(path, 'r+b') as partial:
+            partial.truncate(size)
+            while True:
+                chunk = partial.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return self._store(path, digest.hexdigest(), size, filename, mimetype)
+
+    def discard_partial(self, upload_id):
+        path = self.backend.partial_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _add_reference(self, key):
+        return db.session.execute(
+            update(AudioBlob).where(AudioBlob.key == key).values(ref_count=AudioBlob.ref_count + 1)
+        ).rowcount > 0
+
+    def release(self, keys):
+        """
+        Drop one reference to each blob in the current transaction
+
+        Call collect() with the same keys after the commit.
+        """
+        for key in keys:
+            if key:
+                db.session.execute(update(AudioBlob).where(AudioBlob.key == key)
+                                   .values(ref_count=AudioBlob.ref_count - 1))
+
+    def collect(self, keys):
+        """Delete the blobs of keys that no note references any more, with their objects"""
+        for key in {key for key in keys if key}:
+            blob = db.session.get(AudioBlob, key, populate_existing=True)
+            if blob is None or blob.ref_count > 0:
+                continue
+            name = blob.name
+            deleted = db.session.execute(delete(AudioBlob).where(AudioBlob.key == key, AudioBlob.ref_count <= 0)).rowcount
+            db.session.commit()
+            if deleted:
+                self.backend.delete(name)
+
+    @contextmanager
+    def local_path(self, note):
+        """
+        Local file with the recording of a voice note
+
+        Yields:
+            str: Path to decode, or None if the note has no recording
+        """
+        blob = db.session.get(AudioBlob, note.audio_key) if note.audio_key else None
+        if blob is not None:
+            with self.backend.local_path(blob.name) as path:
+                yield path
+        else:
+            yield note.audio_file_path
+
+    def send(self, blob):
+        """Response streaming a blob, with Range and conditional request support"""
+        return self.backend.send(blob.name, blob.mimetype)
+
+    def transcode(self, key, clip):
+        """
+        Replace a stored recording with an Opus encoding, if smaller
+
+        Args:
+            key (str): AudioBlob key
+            clip (AudioClip): The decoded recording
+
+        Returns:
+            bool: Whether the stored object was replaced
+        """
+        blob = db.session.get(AudioBlob, key) if key else None
+        if not self.transcode_enabled or blob is None or blob.transcoded:
+            return False
+
+        name = f'{key[:2]}/{key}.opus'
+        old_name, old_size = blob.name, blob.size
+        staging = self.backend.staging_file()
+        staging.close()
+        try:
+            clip.audio.set_channels(1).export(staging.name, format='ogg', codec='libopus',
+                                              bitrate=self.opus_bitrate)
+        except Exception as e:
+            os.remove(staging.name)
+            logger.warning('Could not transcode audio %s to Opus: %s', key, e)
+            return False
+
+        size = os.path.getsize(staging.name)
+        if size >= old_size:
+            os.remove(staging.name)
+            db.session.execute(update(AudioBlob).where(AudioBlob.key == key).values(transcoded=True))
+            db.session.commit()
+            return False
+
+        self.backend.put(name, staging.name)
+        replaced = db.session.execute(
+            update(AudioBlob).where(AudioBlob.key == key, AudioBlob.transcoded.is_(False))
+            .values(name=name, mimetype=OPUS_MIMETYPE, size=size, transcoded=True)
+        ).rowcount
+        db.session.commit()
+        if replaced:
+            self.backend.delete(old_name)
+            logger.info('Transcoded audio %s to Opus: %d -> %d bytes', key, old_size, size)
+        return bool(replaced)
+
+audio_storage = AudioStorage()
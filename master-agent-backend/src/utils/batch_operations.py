@@ -0,0 +1,326 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select, update
+
+from src.models.master_agent import Task, Goal, Note, NoteTag, db
+from src.utils.audio_storage import audio_storage
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.goal_progress import (apply_goal_deltas, check_progress, goal_deltas, owned_goal_ids,
+                                     record_goal_deltas, unlink_goal_tasks, InvalidGoal)
+from src.utils.response_cache import response_cache
+from src.utils.search import search_index
+from src.utils.sync import record_deletions
+
+MAX_BATCH_SIZE = 1000
+
+class BatchItemError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _text(value):
+    return value if value is None else str(value)
+
+def _progress(value):
+    value = int(value)
+    if not 0 <= value <= 100:
+        raise ValueError('progress must be between 0 and 100')
+    return value
+
+def _goal_id(value):
+    return value if value is None else int(value)
+
+def _tags(value):
+    if not isinstance(value, list):
+        raise ValueError('tags must be a list')
+    return list(dict.fromkeys(str(tag).strip() for tag in value if str(tag).strip()))
+
+# Per model: section name for the dashboard, grouping column, writable fields
+# with their parser, and the defaults applied on create (matching the single
+# item endpoints).
+SPECS = {
+    Task: {
+        'section': 'tasks',
+        'group_by': 'status',
+        'fields': {'title': _text, 'description': _text, 'status': _text, 'priority': _text, 'due_date': _datetime,
+                   'goal_id': _goal_id},
+        'defaults': {'description': '', 'status': 'pending', 'priority': 'medium', 'due_date': None, 'goal_id': None},
+    },
+    Goal: {
+        'section': 'goals',
+        'group_by': 'status',
+        'fields': {'title': _text, 'description': _text, 'status': _text, 'progress': _progress, 'target_date': _datetime},
+        'defaults': {'description': '', 'status': 'active', 'progress': 0, 'target_date': None},
+    },
+    Note: {
+        'section': 'notes',
+        'group_by': 'note_type',
+        'fields': {'title': _text, 'content': _text, 'transcription': _text, 'note_type': _text, 'tags': _tags},
+        'defaults': {'title': '', 'content': '', 'note_type': 'text', 'transcription': ''},
+    },
+}
+
+def _parse(model, operation, user_id):
+    """
+    Validate one operation
+
+    Returns:
+        dict: {'op', 'id', 'values', 'tags'} with parsed column values
+
+    Raises:
+        BatchItemError: If the operation is malformed
+    """
+    if not isinstance(operation, dict):
+        raise BatchItemError('Operation must be an object')
+    op = operation.get('op')
+    if op not in ('create', 'update', 'delete'):
+        raise BatchItemError("op must be 'create', 'update' or 'delete'")
+
+    item_id = operation.get('id')
+    if op != 'create' and not isinstance(item_id, int):
+        raise BatchItemError(f'{op} requires an integer id')
+
+    data = operation.get('data') or {}
+    if not isinstance(data, dict):
+        raise BatchItemError('data must be an object')
+
+    values, tags = parse_fields(model, data)
+    if op == 'create':
+        if model is not Note and not values.get('title'):
+            raise BatchItemError('title is required')
+        values = dict(SPECS[model]['defaults'], **values, user_id=user_id)
+
+    return {'op': op, 'id': item_id, 'values': values, 'tags': tags}
+
+def parse_fields(model, data):
+    """
+    Parse the writable fields of a task, goal or note; other keys are ignored
+
+    Returns:
+        tuple: (column values, tag list or None if tags are not given)
+
+    Raises:
+        BatchItemError: If a field has an invalid value, or is null for a
+            NOT NULL column such as title
+    """
+    values = {}
+    tags = None
+    columns = model.__table__.columns
+    for field, value in data.items():
+        parser = SPECS[model]['fields'].get(field)
+        if parser is None:
+            continue
+        try:
+            parsed = parser(value)
+        except (TypeError, ValueError) as e:
+            raise BatchItemError(f'Invalid {field}: {e}')
+        if parsed is None and field in columns and not columns[field].nullable:
+            raise BatchItemError(f'{field} cannot be null')
+        if field == 'tags':
+            tags = parsed
+        else:
+            values[field] = parsed
+    return values, tags
+
+def apply_batch(model, operations, user_id, atomic=False):
+    """
+    Apply create/update/delete operations on tasks, goals or notes in one transaction
+
+    Creates use a single multi-row INSERT ... RETURNING, updates an
+    executemany UPDATE by primary key, and deletes one DELETE ... WHERE id IN.
+    Invalid operations and unknown ids are reported per item; the other
+    operations are applied unless atomic is set.
+
+    Args:
+        model: Task, Goal or Note
+        operations (list): {'op': 'create'|'update'|'delete', 'id': int, 'data': {...}}
+        user_id (int): Owner of the items
+        atomic (bool): Apply nothing if any operation fails
+
+    Returns:
+        tuple: (results in request order, whether anything was written)
+    """
+    spec = SPECS[model]
+    group_column = getattr(model, spec['group_by'])
+    results = [None] * len(operations)
+    parsed = {}
+
+    for index, operation in enumerate(operations):
+        try:
+            parsed[index] = _parse(model, operation, user_id)
+        except BatchItemError as e:
+            results[index] = {'index': index, 'status': e.status, 'error': str(e)}
+
+    # One lookup for every id that is updated or deleted
+    target_ids = {item['id'] for item in parsed.values() if item['op'] != 'create'}
+    existing = {}
+    if target_ids:
+        extra = {Task: [Task.goal_id], Goal: [Goal.total_tasks, Goal.completed_tasks],
+                 Note: [Note.audio_file_path, Note.audio_key]}[model]
+        columns = [model.id, group_column] + extra
+        rows = db.session.execute(select(*columns).where(model.id.in_(target_ids), model.user_id == user_id))
+        existing = {row[0]: row for row in rows}
+
+    seen_deletes = set()
+    for index, item in list(parsed.items()):
+        if item['op'] == 'create':
+            continue
+        if item['id'] not in existing or item['id'] in seen_deletes:
+            results[index] = {'index': index, 'op': item['op'], 'id': item['id'], 'status': 404,
+                              'error': f'{model.__name__} {item["id"]} not found'}
+            del parsed[index]
+        elif item['op'] == 'delete':
+            seen_deletes.add(item['id'])
+
+    if model is Task:
+        # Tasks can only be linked to the user's own goals; one lookup for the batch
+        writes = {index: item for index, item in parsed.items() if item['op'] != 'delete'}
+        valid_goals = owned_goal_ids(user_id, [item['values'].get('goal_id') for item in writes.values()])
+        for index, item in writes.items():
+            goal_id = item['values'].get('goal_id')
+            if goal_id is not None and goal_id not in valid_goals:
+                results[index] = {'index': index, 'op': item['op'], 'id': item['id'], 'status': 400,
+                                  'error': f'Goal {goal_id} not found'}
+                del parsed[index]
+
+    if model is Goal:
+        # Progress of a goal with linked tasks follows its tasks
+        for index, item in list(parsed.items()):
+            if item['op'] != 'update':
+                continue
+            try:
+                check_progress(existing[item['id']][2], item['values'].get('progress'))
+            except InvalidGoal as e:
+                results[index] = {'index': index, 'op': 'update', 'id': item['id'], 'status': 400, 'error': str(e)}
+                del parsed[index]
+
+    if atomic and any(result is not None for result in results):
+        for index, item in parsed.items():
+            results[index] = {'index': index, 'op': item['op'], 'id': item['id'], 'status': 424,
+                              'error': 'Not applied because another operation failed'}
+        return results, False
+
+    creates = [(index, item) for index, item in parsed.items() if item['op'] == 'create']
+    updates = [(index, item) for index, item in parsed.items()
+               if item['op'] == 'update' and item['id'] not in seen_deletes]
+    deletes = [(index, item) for index, item in parsed.items() if item['op'] == 'delete']
+
+    # Updates of an id deleted in the same batch are superseded by the delete
+    for index, item in parsed.items():
+        if item['op'] == 'update' and item['id'] in seen_deletes:
+            results[index] = {'index': index, 'op': 'update', 'id': item['id'], 'status': 409,
+                              'error': f'{model.__name__} {item["id"]} is deleted in this batch'}
+
+    now = datetime.utcnow()
+    created = []
+    if creates:
+        created = db.session.scalars(
+            insert(model).returning(model, sort_by_parameter_order=True),
+            [item['values'] for _, item in creates]
+        ).all()
+
+    if updates:
+        db.session.execute(update(model), [dict(item['values'], id=item['id'], updated_at=now)
+                                           for _, item in updates])
+        db.session.execute(update(model).where(model.id.in_({item['id'] for _, item in updates}))
+                           .values(version=model.version + 1),
+                           execution_options={'synchronize_session': False})
+
+    delete_ids = [item['id'] for _, item in deletes]
+    if model is Note:
+        _write_tags([(note, item['tags']) for note, (_, item) in zip(created, creates)]
+                    + [(item['id'], item['tags']) for _, item in updates],
+                    delete_ids, user_id)
+    if model is Goal:
+        unlink_goal_tasks(delete_ids)
+    if delete_ids:
+        db.session.execute(delete(model).where(model.id.in_(delete_ids)))
+        record_deletions(spec['section'], user_id, delete_ids)
+    audio_keys = [existing[item_id][3] for item_id in delete_ids] if model is Note else []
+    audio_storage.release(audio_keys)
+
+    # Reload updated rows once, both for the response and the caches
+    updated = {}
+    if updates:
+        updated_ids = [item['id'] for _, item in updates]
+        updated = {obj.id: obj for obj in model.query.filter(model.id.in_(updated_ids))
+                                                     .execution_options(populate_existing=True)}
+
+    if model is Note:
+        search_index.index_objects(list(created) + list(updated.values()))
+        search_index.remove('note', delete_ids)
+
+    deltas = {}
+    if model is Task:
+        deltas = goal_deltas(
+            [(existing[task_id][2], existing[task_id][1]) for task_id in list(updated) + delete_ids],
+            [(task.goal_id, task.status) for task in list(created) + list(updated.values())]
+        )
+        apply_goal_deltas(deltas)
+
+    db.session.commit()
+    audio_storage.collect(audio_keys)
+
+    section = spec['section']
+    response_cache.invalidate(user_id, section)
+    record_goal_deltas(user_id, deltas)
+    if model is Goal and delete_ids:
+        dashboard_cache.record_sums(user_id, 'goals', {
+            'linked_tasks': -sum(existing[goal_id][2] for goal_id in delete_ids),
+            'completed_tasks': -sum(existing[goal_id][3] for goal_id in delete_ids),
+        })
+        response_cache.invalidate(user_id, 'tasks')
+    for obj, (index, _) in zip(created, creates):
+        obj_dict = obj.to_dict()
+        dashboard_cache.record_create(user_id, section, getattr(obj, spec['group_by']), obj_dict)
+        results[index] = {'index': index, 'op': 'create', 'id': obj.id, 'status': 201, 'item': obj_dict}
+    for index, item in updates:
+        obj_dict = updated[item['id']].to_dict()
+        dashboard_cache.record_update(user_id, section, existing[item['id']][1],
+                                      obj_dict[spec['group_by']], obj_dict)
+        results[index] = {'index': index, 'op': 'update', 'id': item['id'], 'status': 200, 'item': obj_dict}
+    for index, item in deletes:
+        row = existing[item['id']]
+        dashboard_cache.record_delete(user_id, section, row[1], item['id'])
+        if model is Note and row[2] and os.path.exists(row[2]):
+            os.remove(row[2])
+        results[index] = {'index': index, 'op': 'delete', 'id': item['id'], 'status': 204}
+
+    return results, bool(creates or updates or deletes)
+
+def _write_tags(note_tags, delete_ids, user_id):
+    """
+    Replace the tags of created and updated notes with bulk statements
+
+    Args:
+        note_tags (list): (Note or note id, tag list or None to leave unchanged)
+        delete_ids (list): Ids of notes being deleted
+        user_id (int): Owner of the notes
+    """
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    replaced = [(note, tags) for note, tags in note_tags if tags is not None]
+    retagged_ids = [note for note, _ in replaced if isinstance(note, int)]
+    if retagged_ids or delete_ids:
+        db.session.execute(delete(NoteTag).where(NoteTag.note_id.in_(retagged_ids + list(delete_ids))))
+    if retagged_ids:
+        # Like Note.set_tags, drop the legacy JSON copy
+        db.session.execute(update(Note).where(Note.id.in_(retagged_ids)).values(tags=None),
+                           execution_options={'synchronize_session': False})
+
+    rows = [{'note_id': note if isinstance(note, int) else note.id, 'user_id': user_id,
+             'name': name, 'position': position}
+            for note, tags in replaced for position, name in enumerate(tags)]
+    links = db.session.scalars(insert(NoteTag).returning(NoteTag, sort_by_parameter_order=True), rows).all() if rows else []
+
+    # Newly created notes have no tags loaded yet; attach them without a query
+    by_note = {}
+    for link in links:
+        by_note.setdefault(link.note_id, []).append(link)
+    for note, _ in note_tags:
+        if not isinstance(note, int):
+            set_committed_value(note, 'tag_links', by_note.get(note.id, []))
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import delete, select, tuple_
+
+from src.models.master_agent import Conversation, ConversationArchive, db
+from src.utils.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+class ConversationArchiver:
+    """
+    Moves old conversations into compressed archive segments
+
+    Conversations older than CONVERSATION_RETENTION_DAYS are taken from the
+    conversation table oldest first, CONVERSATION_ARCHIVE_SEGMENT_SIZE at a
+    time per user, and stored as one zlib-compressed JSON row in
+    conversation_archive. Archiving oldest first keeps every archived
+    conversation older than every conversation still in the table, so a
+    listing reads the table first and continues into the segments.
+    Archived conversations stay in the search index.
+
+    Archiving is off unless CONVERSATION_RETENTION_DAYS is set. Every
+    CONVERSATION_ARCHIVE_INTERVAL seconds a background timer archives
+    one batch; `flask archive-conversations` runs it by hand. Several workers
+    archiving at once is safe: a segment is only kept if its rows were still
+    there to delete.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._timer = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CONVERSATION_RETENTION_DAYS', int(os.environ.get('CONVERSATION_RETENTION_DAYS', 0)))
+        app.config.setdefault('CONVERSATION_ARCHIVE_SEGMENT_SIZE', int(os.environ.get('CONVERSATION_ARCHIVE_SEGMENT_SIZE', 500)))
+        app.config.setdefault('CONVERSATION_ARCHIVE_BATCH_SEGMENTS', int(os.environ.get('CONVERSATION_ARCHIVE_BATCH_SEGMENTS', 20)))
+        app.config.setdefault('CONVERSATION_ARCHIVE_INTERVAL', int(os.environ.get('CONVERSATION_ARCHIVE_INTERVAL', 3600)))
+        self.app = app
+        app.extensions['conversation_archive'] = self
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config['CONVERSATION_RETENTION_DAYS'] > 0
+
+    def schedule(self, delay=None):
+        """Start the background archiving timer, unless it runs already or archiving is off"""
+        interval = self.app.config['CONVERSATION_ARCHIVE_INTERVAL']
+        if not self.enabled or interval <= 0:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(interval if delay is None else delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        with self.app.app_context():
+            try:
+                self.archive()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Conversation archiving failed')
+            finally:
+                db.session.remove()
+        self.schedule()
+
+    def archive(self, now=None, max_segments=None):
+        """
+        Archive one batch of conversations past the retention period
+
+        Must be called inside an app context.
+
+        Args:
+            now (datetime): Reference time for the retention period
+            max_segments (int): Segments written at most, by default
+                CONVERSATION_ARCHIVE_BATCH_SEGMENTS; each is its own transaction
+
+        Returns:
+            dict: {'segments': n, 'conversations': n}, 0s when archiving is off
+        """
+        archived = {'segments': 0, 'conversations': 0}
+        if not self.enabled:
+            return archived
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.app.config['CONVERSATION_RETENTION_DAYS'])
+        segment_size = self.app.config['CONVERSATION_ARCHIVE_SEGMENT_SIZE']
+        max_segments = self.app.config['CONVERSATION_ARCHIVE_BATCH_SEGMENTS'] if max_segments is None else max_segments
+
+        user_ids = db.session.scalars(
+            select(Conversation.user_id).where(Conversation.created_at < cutoff).distinct()
+        ).all()
+        for user_id in user_ids:
+            if archived['segments'] >= max_segments:
+                break
+            moved = 0
+            while archived['segments'] < max_segments:
+                count = self._archive_segment(user_id, cutoff, segment_size)
+                if not count:
+                    break
+                archived['segments'] += 1
+                moved += count
+            if moved:
+                archived['conversations'] += moved
+                response_cache.invalidate(user_id, 'conversations')
+        if archived['segments']:
+            logger.info('Archived %(conversations)d conversations in %(segments)d segments', archived)
+        return archived
+
+    def _archive_segment(self, user_id, cutoff, segment_size):
+        """Move a user's oldest conversations before cutoff into one segment; returns how many"""
+        conversations = Conversation.query\
+            .filter(Conversation.user_id == user_id, Conversation.created_at < cutoff)\
+            .order_by(Conversation.created_at, Conversation.id)\
+            .limit(segment_size).all()
+        if not conversations:
+            return 0
+        ids = [conversation.id for conversation in conversations]
+        raw = json.dumps([conversation.to_dict() for conversation in reversed(conversations)],
+                         separators=(',', ':')).encode()
+        db.session.add(ConversationArchive(
+            user_id=user_id,
+            oldest_created_at=conversations[0].created_at, oldest_id=conversations[0].id,
+            newest_created_at=conversations[-1].created_at, newest_id=conversations[-1].id,
+            count=len(conversations), data=zlib.compress(raw, 6), raw_size=len(raw)
+        ))
+        for conversation in conversations:
+            db.session.expunge(conversation)
+        deleted = db.session.execute(
+            delete(Conversation).where(Conversation.id.in_(ids)),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        if deleted != len(ids):
+            # Another worker archived some of these rows first
+            db.session.rollback()
+            return 0
+        db.session.commit()
+        return len(ids)
+
+    def page(self, user_id, limit, before=None):
+        """
+        Archived conversations of a user, newest first
+
+        Args:
+            user_id (int): Owner of the conversations
+            limit (int): Conversations returned at most
+            before (tuple): (created_at, id) the conversations must be older than
+
+        Returns:
+            tuple: (list of to_dict() with 'archived': True, whether older ones exist)
+        """
+        conversations = self.conversations(user_id, before)
+        items = list(islice(conversations, limit + 1))
+        conversations.close()
+        return items[:limit], len(items) > limit
+
+    def conversations(self, user_id=None, before=None):
+        """
+        Iterate over archived conversations, a user's newest first
+
+        Segments are decompressed one at a time as the iteration goes on.
+
+        Args:
+            user_id (int): Only this user's conversations, by default everyone's
+            before (tuple): (created_at, id) the conversations must be older than
+
+        Yields:
+            dict: to_dict() of a conversation with 'archived': True
+        """
+        segments = select(ConversationArchive.data)
+        if user_id is not None:
+            segments = segments.where(ConversationArchive.user_id == user_id)
+        if before is not None:
+            segments = segments.where(
+                tuple_(ConversationArchive.oldest_created_at, ConversationArchive.oldest_id) < tuple_(*before))
+        segments = segments.order_by(ConversationArchive.user_id, ConversationArchive.newest_created_at.desc(),
+                                     ConversationArchive.newest_id.desc())
+
+        for data in db.session.scalars(segments.execution_options(yield_per=4)):
+            for item in json.loads(zlib.decompress(data)):
+                if before is None or (datetime.fromisoformat(item['created_at']), item['id']) < before:
+                    item['archived'] = True
+                    yield item
+
+    def stats(self, user_id=None):
+        """Segments, archived conversations and compressed and raw sizes"""
+        query = select(db.func.count(ConversationArchive.id), db.func.sum(ConversationArchive.count),
+                       db.func.sum(db.func.length(ConversationArchive.data)), db.func.sum(ConversationArchive.raw_size))
+        if user_id is not None:
+            query = query.where(ConversationArchive.user_id == user_id)
+        segments, conversations, size, raw_size = db.session.execute(query).one()
+        return {'segments': segments, 'conversations': conversations or 0,
+                'bytes': size or 0, 'raw_bytes': raw_size or 0}
+
+conversation_archive = ConversationArchiver()
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from src.models.master_agent import Conversation
+
+# Rough per-turn overhead (dict, deque slot, small fields) added to the text
+# length when accounting for memory
+TURN_OVERHEAD_BYTES = 400
+
+def _turn(conversation):
+    return {
+        'id': conversation.id,
+        'message': conversation.message,
+        'response': conversation.response,
+        'created_at': conversation.created_at.isoformat() if conversation.created_at else None
+    }
+
+def _turn_size(turn):
+    return TURN_OVERHEAD_BYTES + len(turn['message'] or '') + len(turn['response'] or '')
+
+class ConversationContextCache:
+    """
+    Last turns of each user's conversation kept in process memory
+
+    Each user has a ring buffer (deque) of their CONVERSATION_CONTEXT_TURNS
+    most recent turns, loaded from the database on first use and appended to
+    by the chat endpoints. The least recently used users are evicted once the
+    buffers hold more than CONVERSATION_CONTEXT_MAX_BYTES of text. Turns
+    written by other gunicorn workers are not seen here, so buffers are
+    reloaded after CONVERSATION_CONTEXT_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.turns = 10
+        self.max_bytes = 16 * 1024 * 1024
+        self.ttl = 300
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CONVERSATION_CONTEXT_CACHE', os.environ.get('CONVERSATION_CONTEXT_CACHE', 'true').lower() == 'true')
+        app.config.setdefault('CONVERSATION_CONTEXT_TURNS', int(os.environ.get('CONVERSATION_CONTEXT_TURNS', 10)))
+        app.config.setdefault('CONVERSATION_CONTEXT_MAX_BYTES', int(os.environ.get('CONVERSATION_CONTEXT_MAX_BYTES', 16 * 1024 * 1024)))
+        app.config.setdefault('CONVERSATION_CONTEXT_TTL', int(os.environ.get('CONVERSATION_CONTEXT_TTL', 300)))
+        self.enabled = app.config['CONVERSATION_CONTEXT_CACHE']
+        self.turns = app.config['CONVERSATION_CONTEXT_TURNS']
+        self.max_bytes = app.config['CONVERSATION_CONTEXT_MAX_BYTES']
+        self.ttl = app.config['CONVERSATION_CONTEXT_TTL']
+        app.extensions['conversation_context'] = self
+
+    def _entry(self, user_id):
+        # Caller holds the lock
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['loaded_at'] > self.ttl:
+            self._drop(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _drop(self, user_id):
+        # Caller holds the lock
+        entry = self._entries.pop(user_id)
+        self._bytes -= entry['bytes']
+
+    def _evict(self):
+        # Caller holds the lock; the entry just used is last and is kept
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _load(self, user_id):
+        rows = Conversation.query.filter_by(user_id=user_id)\
+                                 .order_by(Conversation.created_at.desc(), Conversation.id.desc())\
+                                 .limit(self.turns).all()
+        return [_turn(conversation) for conversation in reversed(rows)]
+
+    def get(self, user_id):
+        """
+        Recent turns of a user's conversation
+
+        Args:
+            user_id (int): The user talking to the agent
+
+        Returns:
+            list: Up to CONVERSATION_CONTEXT_TURNS turns, oldest first
+        """
+        if not self.enabled:
+            return self._load(user_id)
+
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is not None:
+                self.hits += 1
+                return list(entry['turns'])
+            self.misses += 1
+
+        turns = self._load(user_id)
+        with self._lock:
+            # Another request may have loaded the user meanwhile; keep its buffer
+            if user_id not in self._entries:
+                self._entries[user_id] = {
+                    'turns': deque(turns, maxlen=self.turns),
+                    'bytes': sum(_turn_size(turn) for turn in turns),
+                    'loaded_at': time.monotonic()
+                }
+                self._bytes += self._entries[user_id]['bytes']
+                self._evict()
+        return turns
+
+    def append(self, conversation):
+        """
+        Add a committed turn to its user's buffer
+
+        Users without a buffer are left alone; their next get() loads the turn
+        from the database.
+        """
+        if not self.enabled:
+            return
+        turn = _turn(conversation)
+        with self._lock:
+            entry = self._entry(conversation.user_id)
+            if entry is None:
+                return
+            turns = entry['turns']
+            if len(turns) == turns.maxlen:
+                entry['bytes'] -= _turn_size(turns[0])
+                self._bytes -= _turn_size(turns[0])
+            turns.append(turn)
+            entry['bytes'] += _turn_size(turn)
+            self._bytes += _turn_size(turn)
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if user_id in self._entries:
+                self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'users': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'turns_per_user': self.turns,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions
+            }
+
+conversation_context = ConversationContextCache()
@@ -0,0 +1,299 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import case, func, select, true
+
+from src.models.master_agent import Task, Goal, Note, db
+
+logger = logging.getLogger(__name__)
+
+# Dashboard counters per section: (model, grouping column, counted values).
+# Every section also gets a 'total'.
+COUNTERS = {
+    'tasks': (Task, 'status', ('completed', 'pending')),
+    'goals': (Goal, 'status', ('active', 'completed')),
+    'notes': (Note, 'note_type', ('text', 'voice')),
+}
+
+# Dashboard sums per section: name -> summed column
+SUMS = {
+    'goals': {'linked_tasks': Goal.total_tasks, 'completed_tasks': Goal.completed_tasks},
+}
+
+# Sections that show their most recently created items
+RECENT = {
+    'tasks': Task,
+    'notes': Note,
+}
+RECENT_LIMIT = 5
+
+def live_counts(user_id):
+    """
+    Compute all dashboard counters in a single statement
+
+    Each table is scanned once by a conditional aggregate and the three
+    one-row results are cross-joined, so this is one round trip.
+
+    Args:
+        user_id (int): Owner of the items
+
+    Returns:
+        dict: {section: {'total': n, value: n, ...}}
+    """
+    columns = []
+    joined = None
+    for section, (model, attribute, values) in COUNTERS.items():
+        column = getattr(model, attribute)
+        aggregates = [func.count(model.id).label('total')]
+        aggregates += [func.coalesce(func.sum(case((column == value, 1), else_=0)), 0).label(value)
+                       for value in values]
+        sums = SUMS.get(section, {})
+        aggregates += [func.coalesce(func.sum(summed), 0).label(name) for name, summed in sums.items()]
+        subquery = select(*aggregates).where(model.user_id == user_id).subquery(section)
+        columns += [subquery.c[name].label(f'{section}__{name}') for name in ('total',) + values + tuple(sums)]
+        joined = subquery if joined is None else joined.join(subquery, true())
+
+    row = db.session.execute(select(*columns).select_from(joined)).mappings().one()
+
+    counts = {section: {} for section in COUNTERS}
+    for key, value in row.items():
+        section, name = key.split('__', 1)
+        counts[section][name] = int(value or 0)
+    return counts
+
+def live_recent(user_id, section):
+    """
+    Most recently created items of a dashboard section
+
+    Returns:
+        list: to_dict() of up to RECENT_LIMIT items, newest first
+    """
+    model = RECENT[section]
+    items = model.query.filter_by(user_id=user_id)\
+                       .order_by(model.created_at.desc())\
+                       .limit(RECENT_LIMIT).all()
+    return [item.to_dict() for item in items]
+
+def compare_counts(cached, live):
+    """
+    Differences between cached and live counters
+
+    Returns:
+        list: {'section', 'counter', 'cached', 'live'} for every mismatch
+    """
+    mismatches = []
+    for section, values in live.items():
+        for name, live_value in values.items():
+            cached_value = cached.get(section, {}).get(name)
+            if cached_value != live_value:
+                mismatches.append({'section': section, 'counter': name,
+                                   'cached': cached_value, 'live': live_value})
+    return mismatches
+
+class DashboardCounterCache:
+    """
+    Per-user dashboard counters and recent items kept in process memory
+
+    Entries are warmed from the database on a miss and then updated
+    incrementally by the create/update/delete endpoints. Writes served by other
+    gunicorn workers are not seen here, so entries expire after
+    DASHBOARD_CACHE_TTL seconds; the least recently used users are evicted
+    beyond DASHBOARD_CACHE_MAX_USERS.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 60
+        self.max_users = 10000
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DASHBOARD_COUNTER_CACHE', os.environ.get('DASHBOARD_COUNTER_CACHE', 'false').lower() == 'true')
+        app.config.setdefault('DASHBOARD_CACHE_TTL', int(os.environ.get('DASHBOARD_CACHE_TTL', 60)))
+        app.config.setdefault('DASHBOARD_CACHE_MAX_USERS', int(os.environ.get('DASHBOARD_CACHE_MAX_USERS', 10000)))
+        app.config.setdefault('DASHBOARD_VERIFY_CACHE', os.environ.get('DASHBOARD_VERIFY_CACHE', 'false').lower() == 'true')
+        self.enabled = app.config['DASHBOARD_COUNTER_CACHE']
+        self.ttl = app.config['DASHBOARD_CACHE_TTL']
+        self.max_users = app.config['DASHBOARD_CACHE_MAX_USERS']
+        app.extensions['dashboard_cache'] = self
+
+    def _entry(self, user_id):
+        # Caller holds the lock
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['loaded_at'] > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def get(self, user_id):
+        """
+        Cached dashboard data for a user
+
+        Returns:
+            dict: Deep copy of {'counts': ..., 'recent': {section: list or None}},
+            or None on a miss. A None recent list must be reloaded.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entry(user_id)
+            return copy.deepcopy({'counts': entry['counts'], 'recent': entry['recent']}) if entry else None
+
+    def set(self, user_id, counts, recent):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = {
+                'counts': copy.deepcopy(counts),
+                'recent': copy.deepcopy(recent),
+                'loaded_at': time.monotonic()
+            }
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def set_recent(self, user_id, recent):
+        """Store reloaded recent lists without extending the entry's lifetime"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is not None:
+                entry['recent'].update(copy.deepcopy(recent))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _adjust(self, counts, value, delta, total=True):
+        if total:
+            counts['total'] += delta
+        if value in counts and value != 'total':
+            counts[value] += delta
+
+    def record_create(self, user_id, section, value, item=None):
+        """
+        Count a newly created item
+
+        Args:
+            user_id (int): Owner of the item
+            section (str): 'tasks', 'goals' or 'notes'
+            value (str): Value of the section's grouping column
+            item (dict): to_dict() of the item, for sections with recent items
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            self._adjust(entry['counts'][section], value, 1)
+            recent = entry['recent'].get(section)
+            if recent is not None and item is not None:
+                entry['recent'][section] = ([copy.deepcopy(item)] + recent)[:RECENT_LIMIT]
+
+    def record_update(self, user_id, section, old_value, new_value, item=None):
+        """Move an item between counters when its grouping value changes"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            if old_value != new_value:
+                counts = entry['counts'][section]
+                self._adjust(counts, old_value, -1, total=False)
+                self._adjust(counts, new_value, 1, total=False)
+            recent = entry['recent'].get(section)
+            if recent is not None and item is not None:
+                entry['recent'][section] = [copy.deepcopy(item) if cached['id'] == item['id'] else cached
+                                            for cached in recent]
+
+    def record_sums(self, user_id, section, deltas):
+        """
+        Move a section's sums, e.g. the tasks linked to goals
+
+        Args:
+            deltas (dict): {name from SUMS: change}
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            counts = entry['counts'][section]
+            for name, delta in deltas.items():
+                counts[name] += delta
+
+    def record_delete(self, user_id, section, value, item_id=None):
+        """Uncount a deleted item"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            self._adjust(entry['counts'][section], value, -1)
+            recent = entry['recent'].get(section)
+            if recent is not None and any(cached['id'] == item_id for cached in recent):
+                # An older item moves into the list; reload it on the next read
+                entry['recent'][section] = None
+
+def get_dashboard_data(user_id, verify=False):
+    """
+    Dashboard counters and recent items, from the counter cache when possible
+
+    Args:
+        user_id (int): Owner of the items
+        verify (bool): Also compute the live counters, report mismatches and
+            refresh the cache with the live values
+
+    Returns:
+        tuple: (counts, recent, info) where info describes the source and,
+        when verifying, the mismatches found
+    """
+    cached = dashboard_cache.get(user_id)
+    info = {'source': 'cache' if cached else 'database'}
+
+    if cached is None or verify:
+        counts = live_counts(user_id)
+        if cached is not None:
+            info['mismatches'] = compare_counts(cached['counts'], counts)
+            if info['mismatches']:
+                logger.warning('Dashboard counter cache drift for user %s: %s', user_id, info['mismatches'])
+            # Keep the recent lists that are still valid
+            recent = cached['recent']
+        else:
+            recent = {}
+    else:
+        counts = cached['counts']
+        recent = cached['recent']
+
+    reloaded = []
+    for section in RECENT:
+        if recent.get(section) is None:
+            recent[section] = live_recent(user_id, section)
+            reloaded.append(section)
+
+    if cached is None or verify:
+        dashboard_cache.set(user_id, counts, recent)
+    elif reloaded:
+        dashboard_cache.set_recent(user_id, {section: recent[section] for section in reloaded})
+    return counts, recent, info
+
+dashboard_cache = DashboardCounterCache()
@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import bindparam, case, func, select, update
+
+from src.models.master_agent import Goal, Task, db
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+COMPLETED = 'completed'
+
+class InvalidGoal(ValueError):
+    pass
+
+def owned_goal_ids(user_id, goal_ids):
+    """
+    Which of the given goals exist and belong to the user
+
+    Returns:
+        set: The valid goal ids
+    """
+    goal_ids = {goal_id for goal_id in goal_ids if goal_id is not None}
+    if not goal_ids:
+        return set()
+    return set(db.session.scalars(select(Goal.id).where(Goal.id.in_(goal_ids), Goal.user_id == user_id)))
+
+def check_goal(user_id, goal_id):
+    """
+    Raises:
+        InvalidGoal: If goal_id is set but is not one of the user's goals
+    """
+    if goal_id is not None and goal_id not in owned_goal_ids(user_id, [goal_id]):
+        raise InvalidGoal(f'Goal {goal_id} not found')
+
+def check_progress(total_tasks, progress):
+    """
+    Raises:
+        InvalidGoal: If progress is set on a goal with linked tasks, whose
+        progress follows its tasks
+    """
+    if progress is not None and total_tasks:
+        raise InvalidGoal('progress of a goal with linked tasks follows its tasks and cannot be set')
+
+def goal_deltas(before, after):
+    """
+    Changes to goal counters for tasks that were written
+
+    Args:
+        before (list): (goal_id, status) of updated and deleted tasks before the write
+        after (list): (goal_id, status) of created and updated tasks after the write
+
+    Returns:
+        dict: {goal_id: (total_tasks change, completed_tasks change)}, without
+        goals that do not change
+    """
+    deltas = {}
+    for sign, tasks in ((-1, before), (1, after)):
+        for goal_id, status in tasks:
+            if goal_id is None:
+                continue
+            total, completed = deltas.get(goal_id, (0, 0))
+            deltas[goal_id] = (total + sign, completed + sign * (status == COMPLETED))
+    return {goal_id: delta for goal_id, delta in deltas.items() if delta != (0, 0)}
+
+def apply_goal_deltas(deltas):
+    """
+    Move goal counters and progress in the current transaction
+
+    Each counter is moved relative to its current value
+    (total_tasks = total_tasks + n) by one executemany UPDATE, so concurrent
+    task writes never overwrite each other's counts and no task is read.
+    Progress follows the counters once a goal has tasks, and goes back to 0
+    when its last task is deleted or unlinked (only goals whose tasks change
+    are updated, so a goal left without tasks had some before). Version and
+    updated_at are bumped so sync clients, listing ETags and PATCH see the
+    change.
+
+    Args:
+        deltas (dict): From goal_deltas()
+    """
+    if not deltas:
+        return
+    table = Goal.__table__
+    total = table.c.total_tasks + bindparam('d_total')
+    completed = table.c.completed_tasks + bindparam('d_completed')
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('d_id'))
+        .values(total_tasks=total,
+                completed_tasks=completed,
+                progress=case((total > 0, completed * 100 // total), else_=0),
+                version=table.c.version + 1,
+                updated_at=datetime.utcnow()),
+        [{'d_id': goal_id, 'd_total': d_total, 'd_completed': d_completed}
+         for goal_id, (d_total, d_completed) in deltas.items()]
+    )
+
+def record_goal_deltas(user_id, deltas):
+    """Update the dashboard and response caches after goal counters moved; call after the commit"""
+    if not deltas:
+        return
+    dashboard_cache.record_sums(user_id, 'goals', {
+        'linked_tasks': sum(d_total for d_total, _ in deltas.values()),
+        'completed_tasks': sum(d_completed for _, d_completed in deltas.values()),
+    })
+    response_cache.invalidate(user_id, 'goals')
+
+def unlink_goal_tasks(goal_ids):
+    """Detach the tasks of goals being deleted, as a change sync clients see (SQLite does not enforce ON DELETE SET NULL)"""
+    if goal_ids:
+        db.session.execute(update(Task).where(Task.goal_id.in_(goal_ids))
+                           .values(goal_id=None, version=Task.version + 1, updated_at=datetime.utcnow()),
+                           execution_options={'synchronize_session': False})
+
+def reconcile_goals(user_id=None, dry_run=False, batch_size=500):
+    """
+    Recount the tasks of every goal and repair counters that drifted
+
+    Counters only drift when tasks are written without going through the
+    API (by hand, or by a failed deploy). Goals are checked in batches of
+    batch_size by one grouped count of their tasks.
+
+    Args:
+        user_id (int): Only this user's goals
+        dry_run (bool): Report drift without repairing it
+
+    Returns:
+        list: {'goal_id', 'user_id', 'stored', 'counted'} for every goal that drifted
+    """
+    drifted = []
+    last_id = 0
+    while True:
+        query = select(Goal.id, Goal.user_id, Goal.total_tasks, Goal.completed_tasks)\
+            .where(Goal.id > last_id).order_by(Goal.id).limit(batch_size)
+        if user_id is not None:
+            query = query.where(Goal.user_id == user_id)
+        goals = db.session.execute(query).all()
+        if not goals:
+            break
+        last_id = goals[-1].id
+
+        counted = {row.goal_id: (row.total, int(row.completed or 0)) for row in db.session.execute(
+            select(Task.goal_id, func.count(Task.id).label('total'),
+                   func.sum(case((Task.status == COMPLETED, 1), else_=0)).label('completed'))
+            .where(Task.goal_id.in_([goal.id for goal in goals]))
+            .group_by(Task.goal_id))}
+        for goal in goals:
+            actual = counted.get(goal.id, (0, 0))
+            if actual != (goal.total_tasks, goal.completed_tasks):
+                drifted.append({'goal_id': goal.id, 'user_id': goal.user_id,
+                                'stored': [goal.total_tasks, goal.completed_tasks], 'counted': list(actual)})
+
+    if drifted and not dry_run:
+        apply_goal_deltas({item['goal_id']: (item['counted'][0] - item['stored'][0],
+                                             item['counted'][1] - item['stored'][1]) for item in drifted})
+        db.session.commit()
+        for owner in {item['user_id'] for item in drifted}:
+            dashboard_cache.invalidate(owner)
+            response_cache.invalidate(owner, 'goals')
+        logger.warning('Repaired task counters of %d goals', len(drifted))
+    return drifted
@@ -0,0 +1,203 @@
+import re
+
+from src.models.master_agent import Task, Goal, Note, db
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.response_cache import response_cache
+
+# A letter or digit not preceded by one
+WORD_START = re.compile(r'(?<![^\W_])[^\W_]')
+
+class IntentMatch:
+    """What the router found for a message"""
+
+    def __init__(self, intent, message, user_id, groups):
+        self.intent = intent
+        self.message = message
+        self.user_id = user_id
+        self.groups = groups  # named groups of the intent's first matching pattern
+
+    def group(self, name):
+        """A named group, stripped; None unless it holds a word"""
+        value = (self.groups.get(name) or '').strip(' .!?')
+        return value if WORD_START.search(value) else None
+
+class Intent:
+    def __init__(self, name, keywords, handler, patterns=(), order=0):
+        self.name = name
+        # All groups must match; any keyword of a group satisfies it
+        self.keyword_groups = [tuple(k.lower() for k in group) for group in keywords]
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        self.handler = handler
+        self.order = order
+
+class KeywordTrie:
+    """
+    Finds every registered keyword occurring in a text in one left-to-right scan
+
+    Keywords match at the start of a word ('task' matches 'tasks' but 'hi'
+    does not match 'this'). The cost depends on the length of the text and of
+    the longest keyword, not on the number of keywords.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, keyword):
+        node = self.root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[None] = keyword
+
+    def scan(self, text):
+        found = set()
+        length = len(text)
+        for word in WORD_START.finditer(text):
+            node = self.root
+            start = word.start()
+            position = start
+            while position < length:
+                node = node.get(text[position])
+                if node is None:
+                    break
+                position += 1
+                if None in node:
+                    found.add(node[None])
+        return found
+
+class IntentRegistry:
+    """
+    Registry of chat intents compiled into a single keyword matcher
+
+    Intents are tried in registration order: the first one whose keyword
+    groups are all present wins. Keyword lookup is one trie scan of the
+    message followed by work proportional to the keywords found, so routing
+    cost stays flat as intents are added.
+    """
+
+    def __init__(self):
+        self.intents = []
+        self.fallback = None
+        self._compiled = None
+
+    def intent(self, name, keywords, patterns=()):
+        """Decorator registering a handler(match) -> reply for an intent"""
+        def decorator(handler):
+            self.register(name, keywords, handler, patterns)
+            return handler
+        return decorator
+
+    def register(self, name, keywords, handler, patterns=()):
+        if not keywords:
+            raise ValueError(f'Intent {name} needs at least one keyword group')
+        self.intents.append(Intent(name, keywords, handler, patterns, order=len(self.intents)))
+        self._compiled = None
+
+    def set_fallback(self, handler):
+        self.fallback = handler
+        return handler
+
+    def compile(self):
+        trie = KeywordTrie()
+        # keyword -> [(intent, group index)]
+        index = {}
+        for intent in self.intents:
+            for group_index, group in enumerate(intent.keyword_groups):
+                for keyword in group:
+                    trie.add(keyword)
+                    index.setdefault(keyword, []).append((intent, group_index))
+        self._compiled = (trie, index)
+        return self._compiled
+
+    def route(self, message, user_id=None):
+        """
+        Find the intent of a message
+
+        Returns:
+            IntentMatch: The winning intent, or None if only the fallback applies
+        """
+        trie, index = self._compiled or self.compile()
+        satisfied = {}
+        for keyword in trie.scan(message.lower()):
+            for intent, group_index in index[keyword]:
+                satisfied.setdefault(intent, set()).add(group_index)
+
+        candidates = [intent for intent, groups in satisfied.items()
+                      if len(groups) == len(intent.keyword_groups)]
+        if not candidates:
+            return None
+
+        intent = min(candidates, key=lambda candidate: candidate.order)
+        groups = {}
+        for pattern in intent.patterns:
+            found = pattern.search(message)
+            if found:
+                groups = found.groupdict()
+                break
+        return IntentMatch(intent, message, user_id, groups)
+
+    def respond(self, message, user_id=None):
+        """Route a message and run the handler of its intent"""
+        match = self.route(message, user_id)
+        if match is None:
+            return self.fallback(IntentMatch(None, message, user_id, {}))
+        return match.intent.handler(match)
+
+intent_registry = IntentRegistry()
+
+# Item intents only write when the message names the item after an explicit
+# separator ("add a task: buy milk", "set a goal to run 10k"); a question such
+# as "can you add a task?" gets the help reply instead.
+
+@intent_registry.intent('create_task', keywords=[('task',), ('create', 'add')], patterns=[
+    r'\b(?:create|add)\s+(?:a\s+)?(?:new\s+)?task\s*(?::|-|\bcalled\b|\bnamed\b|\bto\b)\s*(?P<title>\S.*)$',
+])
+def create_task_intent(match):
+    title = match.group('title')
+    if match.user_id is None or not title:
+        return "I can help you create a task. Please use the task management interface or tell me more details about the task."
+
+    task = Task(title=title[:200], description='', user_id=match.user_id)
+    db.session.add(task)
+    db.session.commit()
+    dashboard_cache.record_create(task.user_id, 'tasks', task.status, task.to_dict())
+    response_cache.invalidate(task.user_id, 'tasks')
+    return f"Done! I created the task \"{task.title}\". You can set its priority and due date in the task list."
+
+@intent_registry.intent('goal', keywords=[('goal',)], patterns=[
+    r'\b(?:set|create|add)\s+(?:a\s+)?(?:new\s+)?goal\s*(?::|-|\bcalled\b|\bnamed\b|\bto\b)\s*(?P<title>\S.*)$',
+])
+def goal_intent(match):
+    title = match.group('title')
+    if match.user_id is None or not title:
+        return "I can help you with goal tracking. What goal would you like to work on?"
+
+    goal = Goal(title=title[:200], description='', user_id=match.user_id)
+    db.session.add(goal)
+    db.session.commit()
+    dashboard_cache.record_create(goal.user_id, 'goals', goal.status)
+    response_cache.invalidate(goal.user_id, 'goals')
+    return f"Great goal! I added \"{goal.title}\" to your goals. Update its progress as you go."
+
+@intent_registry.intent('note', keywords=[('note',)], patterns=[
+    r'\b(?:take|add|create|make|write)\s+(?:a\s+)?(?:new\s+)?note\s*(?::|-|\bthat\b|\bsaying\b)\s*(?P<content>\S.*)$',
+    r'^\s*note\s*:\s*(?P<content>\S.*)$',
+])
+def note_intent(match):
+    content = match.group('content')
+    if match.user_id is None or not content:
+        return "I can help you take notes. Would you like to create a text note or voice note?"
+
+    note = Note(title=content[:50], content=content, note_type='text', user_id=match.user_id)
+    db.session.add(note)
+    db.session.commit()
+    dashboard_cache.record_create(note.user_id, 'notes', note.note_type, note.to_dict())
+    response_cache.invalidate(note.user_id, 'notes')
+    return f"Noted! I saved a note: \"{content}\"."
+
+@intent_registry.intent('greeting', keywords=[('hello', 'hi')])
+def greeting_intent(match):
+    return "Hello! I'm your Master Agent. I can help you manage tasks, track goals, take notes, and organize your life. How can I assist you today?"
+
+@intent_registry.set_fallback
+def fallback_intent(match):
+    return "I understand you're asking about: " + match.message + ". How can I help you with this?"
@@ -0,0 +1,211 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+TRANSCRIPTION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+AUDIO_LENGTH_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Histogram:
+    """Prometheus histogram with a fixed set of label names"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, [("le", "+Inf")])} {values[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {_number(values[-2])}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {values[-1]}')
+        return lines
+
+class Counter:
+    """Prometheus counter with a fixed set of label names"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {_number(value)}')
+        return lines
+
+class Metrics:
+    """
+    Request, database and transcription metrics of this process
+
+    Every request is timed and its SQL statements counted and timed through
+    SQLAlchemy cursor events; requests slower than SLOW_REQUEST_MS are logged.
+    Everything is served in the Prometheus text format at /metrics. Each
+    gunicorn worker keeps its own numbers, so a scrape sees one worker.
+    Streamed responses are timed until their first byte.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.slow_request_ms = 1000
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Time to produce the response, per endpoint',
+            ('method', 'endpoint', 'status'))
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'SQL statements executed per request',
+            ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_db_time = Histogram(
+            'http_request_db_seconds', 'Time spent in SQL statements per request',
+            ('endpoint',))
+        self.db_queries = Counter(
+            'db_queries_total', 'SQL statements executed inside and outside requests',
+            ('context',))
+        self.transcription_duration = Histogram(
+            'transcription_duration_seconds', 'Time to transcribe a recording',
+            ('mode', 'outcome'), TRANSCRIPTION_BUCKETS)
+        self.transcription_audio = Histogram(
+            'transcription_audio_seconds', 'Length of the transcribed recordings',
+            ('mode',), AUDIO_LENGTH_BUCKETS)
+        self.transcription_chunk_duration = Histogram(
+            'transcription_chunk_duration_seconds', 'Time to recognize one chunk in long-audio mode',
+            ('outcome',), TRANSCRIPTION_BUCKETS)
+        self.recognizer_calls = Counter(
+            'recognizer_calls_total', 'Speech recognition calls by result (ok, no_speech, error, rejected)',
+            ('backend', 'result'))
+        self.collected = [self.request_duration, self.request_queries, self.request_db_time, self.db_queries,
+                          self.transcription_duration, self.transcription_audio, self.transcription_chunk_duration,
+                          self.recognizer_calls]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', 'true').lower() == 'true')
+        app.config.setdefault('SLOW_REQUEST_MS', int(os.environ.get('SLOW_REQUEST_MS', 1000)))
+        self.enabled = app.config['METRICS_ENABLED']
+        self.slow_request_ms = app.config['SLOW_REQUEST_MS']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render_response)
+
+    def instrument_engine(self, engine):
+        """Count and time the SQL statements of an engine"""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_db_time += elapsed
+            self.db_queries.inc('request')
+        else:
+            self.db_queries.inc('background')
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('metrics_started'):
+            conn.info['metrics_started'].pop()
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+
+    def _after_request(self, response):
+        if 'metrics_started' not in g or request.endpoint == 'metrics':
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+        self.request_duration.observe(elapsed, request.method, endpoint, str(response.status_code))
+        self.request_queries.observe(g.metrics_queries, endpoint)
+        self.request_db_time.observe(g.metrics_db_time, endpoint)
+
+        if elapsed * 1000 >= self.slow_request_ms:
+            logger.warning('Slow request: %s %s -> %s in %.0f ms (%d queries, %.0f ms in SQL)',
+                           request.method, request.full_path.rstrip('?'), response.status_code,
+                           elapsed * 1000, g.metrics_queries, g.metrics_db_time * 1000)
+        return response
+
+    def observe_transcription(self, seconds, mode, outcome, audio_seconds=None):
+        """
+        Record one transcription
+
+        Args:
+            seconds (float): Time spent transcribing
+            mode (str): 'short' or 'long'
+            outcome (str): 'recognized', 'unrecognized', 'deferred', 'partial' or 'error'
+            audio_seconds (float): Length of the recording, if known
+        """
+        self.transcription_duration.observe(seconds, mode, outcome)
+        if audio_seconds is not None:
+            self.transcription_audio.observe(audio_seconds, mode)
+
+    def render(self):
+        lines = []
+        for metric in self.collected:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def render_response(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+metrics = Metrics()
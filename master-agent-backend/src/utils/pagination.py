@@ -0,0 +1,72 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 500
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at, item_id):
+    """
+    Opaque cursor pointing just after an item in (created_at, id) order
+
+    Args:
+        created_at (datetime): created_at of the last item of a page
+        item_id (int): id of the last item of a page
+
+    Returns:
+        str: URL-safe cursor string
+    """
+    raw = f'{created_at.isoformat()}|{item_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Parse a cursor produced by encode_cursor
+
+    Returns:
+        tuple: (created_at, id)
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, item_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+
+def paginate(query, model, limit, cursor=None):
+    """
+    Fetch one page of a query, newest first, with keyset pagination
+
+    Rows are ordered by (created_at, id) descending and the cursor is compared
+    as a row value, so each page is a range scan on a
+    (user_id, ..., created_at, id) index instead of an OFFSET.
+
+    Args:
+        query: Query already filtered by user and any other criteria
+        model: Mapped class with created_at and id columns
+        limit (int): Page size, capped at MAX_PAGE_SIZE
+        cursor (str): Cursor returned with the previous page
+
+    Returns:
+        tuple: (items, next_cursor or None when this is the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, item_id))
+
+    items = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+
+    return items, next_cursor
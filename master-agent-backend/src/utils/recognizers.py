@@ -0,0 +1,260 @@
+import importlib
+import logging
+import os
+import random
+import threading
+import time
+
+import speech_recognition as sr
+from pydub import AudioSegment
+
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RECOGNIZER_BACKEND = os.environ.get('RECOGNIZER_BACKEND', 'google')
+RECOGNIZER_LANGUAGE = os.environ.get('RECOGNIZER_LANGUAGE', 'en-US')
+RECOGNIZER_TIMEOUT = float(os.environ.get('RECOGNIZER_TIMEOUT', 30))
+RECOGNIZER_MAX_CONCURRENCY = int(os.environ.get('RECOGNIZER_MAX_CONCURRENCY', 4))
+RECOGNIZER_QUEUE_TIMEOUT = float(os.environ.get('RECOGNIZER_QUEUE_TIMEOUT', 60))
+RECOGNIZER_RETRIES = int(os.environ.get('RECOGNIZER_RETRIES', 2))
+RECOGNIZER_BACKOFF = float(os.environ.get('RECOGNIZER_BACKOFF', 0.5))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('RECOGNIZER_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('RECOGNIZER_BREAKER_COOLDOWN', 60))
+
+# Errors worth retrying and counted by the circuit breaker
+TRANSIENT_ERRORS = (sr.RequestError, TimeoutError, OSError)
+
+class RecognitionDeferred(Exception):
+    """The recognizer is unavailable; try the transcription again later"""
+
+class GoogleRecognizer:
+    """Google Web Speech API (the free endpoint used by speech_recognition)"""
+
+    name = 'google'
+
+    def __init__(self, timeout=RECOGNIZER_TIMEOUT, language=RECOGNIZER_LANGUAGE):
+        self.timeout = timeout
+        self.language = language
+
+    def config(self):
+        return {'engine': self.name, 'language': self.language}
+
+    def recognize(self, audio_data):
+        """
+        Transcribe speech
+
+        Args:
+            audio_data (sr.AudioData): Mono 16-bit PCM
+
+        Returns:
+            str: Recognized text
+
+        Raises:
+            sr.UnknownValueError: If no speech was recognized
+            sr.RequestError: If the service failed or timed out
+        """
+        recognizer = sr.Recognizer()
+        recognizer.operation_timeout = self.timeout
+        return recognizer.recognize_google(audio_data, language=self.language)
+
+class SphinxRecognizer(GoogleRecognizer):
+    """Offline CMU Sphinx recognition (needs the pocketsphinx package)"""
+
+    name = 'sphinx'
+
+    def recognize(self, audio_data):
+        return sr.Recognizer().recognize_sphinx(audio_data, language=self.language)
+
+class StubRecognizer:
+    """
+    Offline stand-in for tests and benchmarks
+
+    Describes the audio instead of transcribing it, after STUB_RECOGNIZER_DELAY
+    seconds. Near-silent audio is reported as having no speech, like a real
+    recognizer. STUB_RECOGNIZER_FAILURE_RATE makes a share of calls fail.
+    """
+
+    name = 'stub'
+    SILENCE_RMS = 100
+
+    def __init__(self, timeout=RECOGNIZER_TIMEOUT, language=RECOGNIZER_LANGUAGE):
+        self.timeout = timeout
+        self.language = language
+        self.delay = float(os.environ.get('STUB_RECOGNIZER_DELAY', 0))
+        self.failure_rate = float(os.environ.get('STUB_RECOGNIZER_FAILURE_RATE', 0))
+
+    def config(self):
+        return {'engine': self.name}
+
+    def recognize(self, audio_data):
+        if self.delay > self.timeout:
+            time.sleep(self.timeout)
+            raise sr.RequestError('recognition request failed: timed out')
+        time.sleep(self.delay)
+        if random.random() < self.failure_rate:
+            raise sr.RequestError('recognition request failed: simulated failure')
+        segment = AudioSegment(data=audio_data.get_raw_data(), sample_width=audio_data.sample_width,
+                               frame_rate=audio_data.sample_rate, channels=1)
+        if segment.rms < self.SILENCE_RMS:
+            raise sr.UnknownValueError()
+        return f'speech ({segment.duration_seconds:.1f} seconds)'
+
+BACKENDS = {
+    'google': GoogleRecognizer,
+    'sphinx': SphinxRecognizer,
+    'stub': StubRecognizer,
+}
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive failures
+
+    While open, calls are rejected for BREAKER_COOLDOWN seconds; then a single
+    trial call is let through, which closes the breaker if it succeeds.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def retry_after(self):
+        """Seconds until a trial call is allowed (0 if closed)"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('Recognizer circuit closed')
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or (self.opened_at is None and self.failures >= self.threshold):
+                logger.warning('Recognizer circuit opened after %d failures', self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+class RecognitionService:
+    """
+    Calls the configured recognizer backend with guards
+
+    A process-wide semaphore caps outstanding recognition calls (transcription
+    workers and long-audio chunk threads share it). Transient errors are
+    retried with exponential backoff and jitter; consecutive failures open the
+    circuit breaker, after which calls fail fast with RecognitionDeferred.
+    """
+
+    def __init__(self, backend=None, max_concurrency=RECOGNIZER_MAX_CONCURRENCY,
+                 retries=RECOGNIZER_RETRIES, backoff=RECOGNIZER_BACKOFF, breaker=None):
+        self.backend = backend or load_backend(RECOGNIZER_BACKEND)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def config(self):
+        return self.backend.config()
+
+    def recognize(self, audio_data):
+        """
+        Transcribe speech through the backend
+
+        Returns:
+            str: Recognized text
+
+        Raises:
+            sr.UnknownValueError: If no speech was recognized
+            RecognitionDeferred: If the backend is unavailable (circuit open,
+                no free slot in time, or retries exhausted)
+            Exception: Any other error of the backend, after counting it
+                as a failure
+        """
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                metrics.recognizer_calls.inc(self.backend.name, 'rejected')
+                raise RecognitionDeferred(f'speech recognition circuit {self.breaker.state} after repeated failures')
+            if not self._slots.acquire(timeout=RECOGNIZER_QUEUE_TIMEOUT):
+                metrics.recognizer_calls.inc(self.backend.name, 'rejected')
+                self.breaker.record_failure()
+                raise RecognitionDeferred('speech recognition saturated')
+            try:
+                text = self.backend.recognize(audio_data)
+            except sr.UnknownValueError:
+                self.breaker.record_success()
+                metrics.recognizer_calls.inc(self.backend.name, 'no_speech')
+                raise
+            except TRANSIENT_ERRORS as e:
+                self.breaker.record_failure()
+                metrics.recognizer_calls.inc(self.backend.name, 'error')
+                logger.warning('Recognition attempt %d/%d failed: %s', attempt + 1, self.retries + 1, e)
+                error = e
+            except Exception:
+                # Not retried, but counted, so that a failing trial call
+                # reopens the breaker instead of leaving it half-open for good
+                self.breaker.record_failure()
+                metrics.recognizer_calls.inc(self.backend.name, 'error')
+                raise
+            else:
+                self.breaker.record_success()
+                metrics.recognizer_calls.inc(self.backend.name, 'ok')
+                return text
+            finally:
+                self._slots.release()
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        raise RecognitionDeferred(f'speech recognition failed: {error}')
+
+def load_backend(spec):
+    """
+    Instantiate a recognizer backend
+
+    Args:
+        spec (str): A name from BACKENDS, or 'package.module:ClassName'
+
+    Returns:
+        The backend instance
+    """
+    if spec in BACKENDS:
+        return BACKENDS[spec]()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f'Unknown recognizer backend: {spec}')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_recognition_service():
+    """The process-wide RecognitionService, created on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RecognitionService()
+        return _service
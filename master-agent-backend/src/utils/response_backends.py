@@ -0,0 +1,161 @@
+import asyncio
+import importlib
+import os
+import re
+import time
+
+from flask import current_app
+
+from src.models.master_agent import db
+from src.utils.intents import intent_registry
+
+class ResponseBackend:
+    """
+    Produces the Master Agent's reply to a chat message
+
+    Backends implement stream(); generate() joins the streamed tokens. A
+    backend backed by a real model should yield tokens as soon as they are
+    produced so that /chat/stream can forward them immediately.
+    """
+
+    name = 'base'
+
+    def stream(self, message, user_id=None, context=None):
+        """
+        Yield the reply in pieces
+
+        Args:
+            message (str): The user's message
+            user_id (int): The user talking to the agent
+            context (list): Recent conversation turns, oldest first
+
+        Yields:
+            str: Successive pieces of the reply
+        """
+        raise NotImplementedError
+
+    def generate(self, message, user_id=None, context=None):
+        """Complete reply as one string"""
+        return ''.join(self.stream(message, user_id=user_id, context=context))
+
+    async def astream(self, message, user_id=None, context=None):
+        """
+        Async version of stream(), used by the ASGI app
+
+        Runs stream() in a worker thread one piece at a time, so a blocking
+        model client never blocks the event loop. asyncio.to_thread carries the
+        app context over. Backends with an async client should override this.
+        """
+        pieces = self.stream(message, user_id=user_id, context=context)
+        done = object()
+        while True:
+            piece = await asyncio.to_thread(next, pieces, done)
+            if piece is done:
+                return
+            yield piece
+
+    async def agenerate(self, message, user_id=None, context=None):
+        """Async version of generate()"""
+        return ''.join([piece async for piece in self.astream(message, user_id=user_id, context=context)])
+
+def tokenize_reply(text):
+    """Split a reply into word tokens that keep their trailing whitespace"""
+    return re.findall(r'\S+\s*', text)
+
+class RuleBasedBackend(ResponseBackend):
+    """
+    Deterministic replies from the intent registry; the default backend and the stand-in for tests
+
+    Intents with an action (creating a task, goal or note) only run it when
+    the message names the item and a user_id is given.
+    """
+
+    name = 'rules'
+
+    def __init__(self, registry=None):
+        self.registry = registry or intent_registry
+
+    def reply(self, message, user_id=None, context=None):
+        return self.registry.respond(message, user_id=user_id)
+
+    def stream(self, message, user_id=None, context=None):
+        yield from tokenize_reply(self.reply(message, user_id=user_id, context=context))
+
+    def generate(self, message, user_id=None, context=None):
+        return self.reply(message, user_id=user_id, context=context)
+
+    async def astream(self, message, user_id=None, context=None):
+        # Intent actions write to the database; one thread hop for the whole reply
+        for token in tokenize_reply(await self.agenerate(message, user_id=user_id, context=context)):
+            yield token
+
+    async def agenerate(self, message, user_id=None, context=None):
+        def reply():
+            try:
+                return self.reply(message, user_id=user_id, context=context)
+            finally:
+                db.session.close()  # give the connection back before the caller awaits anything else
+
+        return await asyncio.to_thread(reply)
+
+class SimulatedLatencyBackend(ResponseBackend):
+    """
+    Wraps another backend and adds model-like latency
+
+    Useful to measure time-to-first-token and total latency of the streaming
+    endpoint without a real model.
+    """
+
+    name = 'simulated'
+
+    def __init__(self, inner=None, first_token_delay=None, token_delay=None):
+        self.inner = inner or RuleBasedBackend()
+        self.first_token_delay = float(first_token_delay if first_token_delay is not None
+                                       else os.environ.get('SIMULATED_FIRST_TOKEN_DELAY', 0.3))
+        self.token_delay = float(token_delay if token_delay is not None
+                                 else os.environ.get('SIMULATED_TOKEN_DELAY', 0.02))
+
+    def stream(self, message, user_id=None, context=None):
+        time.sleep(self.first_token_delay)
+        for index, token in enumerate(self.inner.stream(message, user_id=user_id, context=context)):
+            if index:
+                time.sleep(self.token_delay)
+            yield token
+
+    async def astream(self, message, user_id=None, context=None):
+        await asyncio.sleep(self.first_token_delay)
+        index = 0
+        async for token in self.inner.astream(message, user_id=user_id, context=context):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            index += 1
+            yield token
+
+BACKENDS = {
+    'rules': RuleBasedBackend,
+    'simulated': SimulatedLatencyBackend,
+}
+
+def load_backend(spec):
+    """
+    Instantiate a response backend
+
+    Args:
+        spec (str): A name from BACKENDS, or 'package.module:ClassName'
+
+    Returns:
+        ResponseBackend: The backend instance
+    """
+    if spec in BACKENDS:
+        return BACKENDS[spec]()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f'Unknown response backend: {spec}')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+def init_response_backend(app):
+    app.config.setdefault('RESPONSE_BACKEND', os.environ.get('RESPONSE_BACKEND', 'rules'))
+    app.extensions['response_backend'] = load_backend(app.config['RESPONSE_BACKEND'])
+
+def get_response_backend():
+    return current_app.extensions['response_backend']
@@ -0,0 +1,316 @@
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional dependency; only needed for RESPONSE_CACHE_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+class MemoryBackend:
+    """
+    Entries in this process, least recently used evicted first
+
+    Bounded by max_entries and max_bytes (approximate: response bodies plus
+    headers plus a fixed per-entry overhead).
+    """
+
+    name = 'memory'
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, entry)
+        self._generations = {}  # never evicted, so that an old generation cannot come back
+        self._lock = threading.Lock()
+
+    @classmethod
+    def entry_size(cls, entry):
+        return cls.ENTRY_OVERHEAD + len(entry['body']) + sum(len(k) + len(v) for k, v in entry['headers'].items())
+
+    def generation(self, user_id, section):
+        with self._lock:
+            return self._generations.get((user_id, section), 0)
+
+    def bump(self, user_id, section):
+        with self._lock:
+            self._generations[(user_id, section)] = self._generations.get((user_id, section), 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def set(self, key, entry):
+        size = self.entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, entry)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Caller holds the lock
+        self.bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'evictions': self.evictions}
+
+class LocalRedis:
+    """
+    In-process stand-in for the few Redis commands RedisBackend uses
+
+    Lets the shared backend run in tests and benchmarks without a server:
+    RESPONSE_CACHE_URL=memory://.
+    """
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._values.get(key)
+        if item is not None and item[1] is not None and item[1] < time.monotonic():
+            del self._values[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (value.encode() if isinstance(value, str) else value,
+                                 time.monotonic() + ex if ex else None)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._live(key)
+            value = int(item[0]) + 1 if item else 1
+            self._values[key] = (str(value).encode(), None)
+            return value
+
+    def flushdb(self):
+        with self._lock:
+            self._values.clear()
+
+    def info(self, section=None):
+        with self._lock:
+            return {'used_memory': sum(sys.getsizeof(key) + sys.getsizeof(value) for key, (value, _) in self._values.items())}
+
+    def dbsize(self):
+        with self._lock:
+            return len(self._values)
+
+class RedisBackend:
+    """
+    Entries shared by every worker and instance through Redis
+
+    Eviction beyond the TTL is left to the server's maxmemory policy
+    (allkeys-lru). Generation counters have no TTL; under a volatile-* policy
+    they are never evicted.
+    """
+
+    name = 'redis'
+
+    def __init__(self, ttl, url, prefix='response-cache:'):
+        self.ttl = ttl
+        self.prefix = prefix
+        if url.startswith('memory://'):
+            self.client = LocalRedis()
+        elif redis is None:
+            raise RuntimeError('RESPONSE_CACHE_BACKEND=redis needs the redis package')
+        else:
+            self.client = redis.Redis.from_url(url)
+
+    def _generation_key(self, user_id, section):
+        return f'{self.prefix}gen:{section}:{user_id}'
+
+    def generation(self, user_id, section):
+        return int(self.client.get(self._generation_key(user_id, section)) or 0)
+
+    def bump(self, user_id, section):
+        self.client.incr(self._generation_key(user_id, section))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry):
+        self.client.set(self.prefix + key, json.dumps(entry, separators=(',', ':')), ex=self.ttl)
+
+    def clear(self):
+        self.client.flushdb()
+
+    def stats(self):
+        return {'entries': self.client.dbsize(), 'bytes': self.client.info('memory').get('used_memory')}
+
+class ResponseCache:
+    """
+    Read-through cache of per-user list responses
+
+    A listing response (body, ETag and paging headers) is stored under the
+    user, the section, the section's current generation and the query
+    string. Every write to a section bumps the user's generation for it, so
+    later reads miss and older entries are never served again; they age out
+    through the TTL and LRU bounds. The generation is read before the
+    listing is queried, so a response racing with a write is stored under
+    the old generation and never served.
+
+    RESPONSE_CACHE_BACKEND is 'memory' (per process: writes served by other
+    workers are only seen after RESPONSE_CACHE_TTL), 'redis' (shared,
+    RESPONSE_CACHE_URL; memory:// runs an in-process stand-in) or
+    'package.module:Class' taking the app.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE', os.environ.get('RESPONSE_CACHE', 'false').lower() == 'true')
+        app.config.setdefault('RESPONSE_CACHE_BACKEND', os.environ.get('RESPONSE_CACHE_BACKEND', 'memory'))
+        app.config.setdefault('RESPONSE_CACHE_URL', os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0'))
+        app.config.setdefault('RESPONSE_CACHE_TTL', int(os.environ.get('RESPONSE_CACHE_TTL', 60)))
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 10000)))
+        app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+        self.enabled = app.config['RESPONSE_CACHE']
+        app.extensions['response_cache'] = self
+        if not self.enabled:
+            return
+
+        spec = app.config['RESPONSE_CACHE_BACKEND']
+        ttl = app.config['RESPONSE_CACHE_TTL']
+        if spec == 'memory':
+            self.backend = MemoryBackend(ttl, app.config['RESPONSE_CACHE_MAX_ENTRIES'], app.config['RESPONSE_CACHE_MAX_BYTES'])
+        elif spec == 'redis':
+            self.backend = RedisBackend(ttl, app.config['RESPONSE_CACHE_URL'])
+        else:
+            module_name, _, class_name = spec.partition(':')
+            if not class_name:
+                raise ValueError(f'Unknown response cache backend: {spec}')
+            self.backend = getattr(importlib.import_module(module_name), class_name)(app)
+
+    def key(self, user_id, section, variant):
+        """
+        Cache key of a listing at the section's current generation
+
+        Args:
+            variant (str): What else selects the response (query string, Accept)
+
+        Returns:
+            str: The key, or None when caching is off or the backend is unreachable
+        """
+        if not self.enabled:
+            return None
+        try:
+            generation = self.backend.generation(user_id, section)
+        except Exception as e:
+            logger.warning('Response cache unavailable: %s', e)
+            return None
+        return f'{section}:{user_id}:{generation}:{variant}'
+
+    def get(self, key):
+        """
+        Cached response entry
+
+        Returns:
+            dict: {'body': str, 'etag': str, 'headers': dict}, or None on a miss
+        """
+        if key is None:
+            return None
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            logger.warning('Response cache unavailable: %s', e)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, key, body, etag, headers):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, {'body': body, 'etag': etag, 'headers': headers})
+        except Exception as e:
+            logger.warning('Response cache unavailable: %s', e)
+
+    def invalidate(self, user_id, *sections):
+        """Drop the cached listings of a user's sections; call after the write is committed"""
+        if not self.enabled:
+            return
+        for section in sections:
+            try:
+                self.backend.bump(user_id, section)
+            except Exception as e:
+                # Entries still expire after RESPONSE_CACHE_TTL
+                logger.error('Could not invalidate cached %s of user %s: %s', section, user_id, e)
+        with self._lock:
+            self.invalidations += len(sections)
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+    def stats(self):
+        """Hit ratio and memory use of the cache (hits and misses of this process)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+        if self.enabled:
+            stats['backend'] = self.backend.name
+            try:
+                stats.update(self.backend.stats())
+            except Exception as e:
+                stats['error'] = str(e)
+        return stats
+
+response_cache = ResponseCache()
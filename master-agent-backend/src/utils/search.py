@@ -0,0 +1,471 @@
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, event, inspect, text
+from sqlalchemy.exc import OperationalError
+
+from src.models.master_agent import Note, Conversation, db
+from src.utils.conversation_archive import conversation_archive
+
+logger = logging.getLogger(__name__)
+
+# Fields whose changes require a document to be reindexed
+TRACKED_FIELDS = {
+    Note: ('title', 'content', 'transcription', 'tag_links'),
+    Conversation: ('message', 'response'),
+}
+
+KINDS = {
+    'note': Note,
+    'conversation': Conversation,
+}
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+
+def note_document(note):
+    return {
+        'kind': 'note',
+        'ref_id': note.id,
+        'user_id': note.user_id,
+        'title': note.title or '',
+        'body': '\n'.join(part for part in (note.content, note.transcription, ' '.join(note.get_tags())) if part),
+        'created_at': note.created_at,
+    }
+
+def conversation_document(conversation):
+    return {
+        'kind': 'conversation',
+        'ref_id': conversation.id,
+        'user_id': conversation.user_id,
+        'title': '',
+        'body': '\n'.join(part for part in (conversation.message, conversation.response) if part),
+        'created_at': conversation.created_at,
+    }
+
+def archived_conversation_document(item):
+    """Document of an archived conversation, from its to_dict()"""
+    return {
+        'kind': 'conversation',
+        'ref_id': item['id'],
+        'user_id': item['user_id'],
+        'title': '',
+        'body': '\n'.join(part for part in (item['message'], item['response']) if part),
+        'created_at': datetime.fromisoformat(item['created_at']) if item['created_at'] else None,
+    }
+
+DOCUMENT_BUILDERS = {
+    Note: note_document,
+    Conversation: conversation_document,
+}
+
+def document_key(obj):
+    return ('note' if isinstance(obj, Note) else 'conversation', obj.id)
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+class PostgresSearchBackend:
+    """
+    Postgres full-text search over a search_document table
+
+    A GIN index on the tsvector expression answers the match; ts_rank_cd ranks
+    and ts_headline builds the snippets. Rows are written in the same
+    transaction as the notes and conversations they describe.
+    """
+
+    name = 'postgres'
+    transactional = True
+
+    VECTOR = "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(body, ''))"
+
+    metadata = MetaData()
+    documents = Table(
+        'search_document', metadata,
+        Column('kind', String(20), primary_key=True),
+        Column('ref_id', Integer, primary_key=True),
+        Column('user_id', Integer, nullable=False, index=True),
+        Column('title', Text),
+        Column('body', Text),
+        Column('created_at', DateTime),
+    )
+
+    def create_index(self, engine):
+        created = not inspect(engine).has_table('search_document')
+        self.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_search_document_tsv ON search_document USING GIN ({self.VECTOR})'
+            ))
+        return created
+
+    def index(self, connection, documents):
+        from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(self.documents)
+        statement = statement.on_conflict_do_update(
+            index_elements=['kind', 'ref_id'],
+            set_={column: statement.excluded[column] for column in ('user_id', 'title', 'body', 'created_at')}
+        )
+        connection.execute(statement, documents)
+
+    def remove(self, connection, keys):
+        for kind, ref_id in keys:
+            connection.execute(self.documents.delete().where(
+                self.documents.c.kind == kind, self.documents.c.ref_id == ref_id))
+
+    def search(self, connection, user_id, query, kind, limit, offset):
+        rows = connection.execute(text(f"""
+            SELECT kind, ref_id, title, created_at,
+                   ts_rank_cd({self.VECTOR}, q) AS score,
+                   ts_headline('english', coalesce(body, ''), q,
+                               'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxFragments=1, MaxWords=24, MinWords=8') AS snippet
+            FROM search_document, websearch_to_tsquery('english', :query) AS q
+            WHERE user_id = :user_id
+              AND (CAST(:kind AS VARCHAR) IS NULL OR kind = :kind)
+              AND {self.VECTOR} @@ q
+            ORDER BY score DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        """), {'query': query, 'user_id': user_id, 'kind': kind, 'limit': limit, 'offset': offset})
+        return [dict(row._mapping) for row in rows]
+
+class SqliteSearchBackend:
+    """
+    SQLite FTS5 virtual table ranked with bm25()
+
+    The rowid encodes (kind, ref_id) so that a document can be replaced
+    without a separate lookup.
+    """
+
+    name = 'sqlite-fts5'
+    transactional = True
+
+    @staticmethod
+    def _rowid(kind, ref_id):
+        return ref_id * 2 + (1 if kind == 'conversation' else 0)
+
+    def create_index(self, engine):
+        created = not inspect(engine).has_table('search_index')
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                "kind UNINDEXED, ref_id UNINDEXED, user_id UNINDEXED, title, body, created_at UNINDEXED, "
+                "tokenize='porter unicode61')"
+            ))
+        return created
+
+    def index(self, connection, documents):
+        self.remove(connection, [(doc['kind'], doc['ref_id']) for doc in documents])
+        connection.execute(text(
+            'INSERT INTO search_index (rowid, kind, ref_id, user_id, title, body, created_at) '
+            'VALUES (:rowid, :kind, :ref_id, :user_id, :title, :body, :created_at)'
+        ), [dict(doc, rowid=self._rowid(doc['kind'], doc['ref_id']), created_at=_isoformat(doc['created_at']))
+            for doc in documents])
+
+    def remove(self, connection, keys):
+        for kind, ref_id in keys:
+            connection.execute(text('DELETE FROM search_index WHERE rowid = :rowid'),
+                               {'rowid': self._rowid(kind, ref_id)})
+
+    def search(self, connection, user_id, query, kind, limit, offset):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        rows = connection.execute(text(f"""
+            SELECT kind, ref_id, title, created_at,
+                   -bm25(search_index, 0, 0, 0, 2.0, 1.0, 0) AS score,
+                   snippet(search_index, 4, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS snippet
+            FROM search_index
+            WHERE search_index MATCH :match
+              AND user_id = :user_id
+              AND (:kind IS NULL OR kind = :kind)
+            ORDER BY score DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        """), {'match': match, 'user_id': user_id, 'kind': kind, 'limit': limit, 'offset': offset})
+        return [dict(row._mapping) for row in rows]
+
+def tokenize(value):
+    return re.findall(r'\w+', (value or '').lower())
+
+class MemorySearchBackend:
+    """
+    In-process inverted index, used when the database has no full-text support
+
+    A user's documents are loaded on their first search and kept up to date
+    by committed writes in this process. Writes handled by other processes are
+    picked up when the user's index expires after SEARCH_MEMORY_TTL seconds.
+    """
+
+    name = 'memory'
+    transactional = False
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._documents = {}  # (kind, ref_id) -> document with term counts
+        self._postings = defaultdict(set)  # (user_id, term) -> document keys
+        self._warmed = {}  # user_id -> monotonic load time
+        self._lock = threading.RLock()
+
+    def create_index(self, engine):
+        return False
+
+    def _add(self, doc):
+        key = (doc['kind'], doc['ref_id'])
+        self._discard(key)
+        title_terms = Counter(tokenize(doc['title']))
+        body_terms = Counter(tokenize(doc['body']))
+        entry = dict(doc, title_terms=title_terms, body_terms=body_terms)
+        self._documents[key] = entry
+        for term in set(title_terms) | set(body_terms):
+            self._postings[(doc['user_id'], term)].add(key)
+
+    def _discard(self, key):
+        entry = self._documents.pop(key, None)
+        if entry is None:
+            return
+        for term in set(entry['title_terms']) | set(entry['body_terms']):
+            postings = self._postings.get((entry['user_id'], term))
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._postings[(entry['user_id'], term)]
+
+    def index(self, connection, documents):
+        with self._lock:
+            for doc in documents:
+                if doc['user_id'] in self._warmed:
+                    self._add(doc)
+
+    def remove(self, connection, keys):
+        with self._lock:
+            for key in keys:
+                self._discard(key)
+
+    def _warm(self, user_id):
+        loaded_at = self._warmed.get(user_id)
+        if loaded_at is not None and time.monotonic() - loaded_at <= self.ttl:
+            return
+        for key in [key for key, doc in self._documents.items() if doc['user_id'] == user_id]:
+            self._discard(key)
+        for model, build in DOCUMENT_BUILDERS.items():
+            for obj in model.query.filter_by(user_id=user_id).yield_per(500):
+                self._add(build(obj))
+        for item in conversation_archive.conversations(user_id):
+            self._add(archived_conversation_document(item))
+        self._warmed[user_id] = time.monotonic()
+
+    def _snippet(self, body, terms, width=60):
+        lowered = body.lower()
+        positions = [match.start() for term in terms
+                     for match in [re.search(r'\b' + re.escape(term), lowered)] if match]
+        start = max(0, min(positions) - width) if positions else 0
+        snippet = body[start:start + width * 3]
+        for term in terms:
+            snippet = re.sub(r'(?i)\b(' + re.escape(term) + r')', HIGHLIGHT_START + r'\1' + HIGHLIGHT_END, snippet)
+        return ('…' if start else '') + snippet + ('…' if start + width * 3 < len(body) else '')
+
+    def search(self, connection, user_id, query, kind, limit, offset):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            self._warm(user_id)
+            postings = [self._postings.get((user_id, term), set()) for term in terms]
+            keys = set.intersection(*postings) if postings else set()
+            total = sum(1 for key, doc in self._documents.items() if doc['user_id'] == user_id) or 1
+
+            scored = []
+            for key in keys:
+                doc = self._documents[key]
+                if kind and doc['kind'] != kind:
+                    continue
+                score = 0.0
+                for term, docs_with_term in zip(terms, postings):
+                    idf = math.log(1 + total / len(docs_with_term))
+                    score += idf * (2 * doc['title_terms'][term] + doc['body_terms'][term])
+                scored.append((score, doc))
+
+        scored.sort(key=lambda item: (item[0], _isoformat(item[1]['created_at']) or ''), reverse=True)
+        return [{
+            'kind': doc['kind'],
+            'ref_id': doc['ref_id'],
+            'title': doc['title'],
+            'created_at': doc['created_at'],
+            'score': score,
+            'snippet': self._snippet(doc['body'], terms),
+        } for score, doc in scored[offset:offset + limit]]
+
+class SearchIndex:
+    """
+    Full-text index over notes and conversations
+
+    Picks the native full-text backend of the database (Postgres tsvector,
+    SQLite FTS5) and falls back to an in-process inverted index. Session
+    events keep the index up to date: database backends are written inside the
+    flush that changes the rows, the in-process index after commit.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', os.environ.get('SEARCH_BACKEND', 'auto'))
+        app.config.setdefault('SEARCH_MEMORY_TTL', int(os.environ.get('SEARCH_MEMORY_TTL', 300)))
+        self.app = app
+        app.extensions['search_index'] = self
+        if not self._listening:
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+            self._listening = True
+
+    def get_backend(self):
+        """Backend for the configured database, chosen on first use"""
+        if self.backend is None:
+            choice = self.app.config['SEARCH_BACKEND']
+            dialect = db.engine.dialect.name
+            if choice == 'postgres' or (choice == 'auto' and dialect == 'postgresql'):
+                self.backend = PostgresSearchBackend()
+            elif choice == 'sqlite' or (choice == 'auto' and dialect == 'sqlite' and self._has_fts5()):
+                self.backend = SqliteSearchBackend()
+            else:
+                self.backend = MemorySearchBackend(ttl=self.app.config['SEARCH_MEMORY_TTL'])
+        return self.backend
+
+    def _has_fts5(self):
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)'))
+                connection.execute(text('DROP TABLE temp.fts5_probe'))
+            return True
+        except OperationalError:
+            return False
+
+    def create_index(self):
+        """
+        Create the index structures and backfill them if they are new
+
+        Must be called inside an app context.
+        """
+        backend = self.get_backend()
+        if backend.create_index(db.engine):
+            self.rebuild()
+        return backend.name
+
+    def rebuild(self, batch_size=500):
+        """
+        Reindex every note and conversation, archived ones included
+
+        Returns:
+            int: Number of documents indexed
+        """
+        backend = self.get_backend()
+        count = 0
+        for model, build in DOCUMENT_BUILDERS.items():
+            batch = []
+            for obj in model.query.order_by(model.id).yield_per(batch_size):
+                batch.append(build(obj))
+                if len(batch) >= batch_size:
+                    count += self._write(backend, batch)
+                    batch = []
+            if batch:
+                count += self._write(backend, batch)
+        batch = []
+        for item in conversation_archive.conversations():
+            batch.append(archived_conversation_document(item))
+            if len(batch) >= batch_size:
+                count += self._write(backend, batch)
+                batch = []
+        if batch:
+            count += self._write(backend, batch)
+        db.session.commit()
+        logger.info('Search index (%s) rebuilt with %d documents', backend.name, count)
+        return count
+
+    def _write(self, backend, documents):
+        backend.index(db.session.connection(), documents)
+        return len(documents)
+
+    def index_objects(self, objects):
+        """Reindex notes or conversations written without the ORM unit of work"""
+        documents = [DOCUMENT_BUILDERS[type(obj)](obj) for obj in objects]
+        if documents:
+            self.get_backend().index(db.session.connection(), documents)
+
+    def remove(self, kind, ref_ids):
+        """Drop documents of rows deleted without the ORM unit of work"""
+        if ref_ids:
+            self.get_backend().remove(db.session.connection(), [(kind, ref_id) for ref_id in ref_ids])
+
+    def search(self, user_id, query, kind=None, limit=20, offset=0):
+        """
+        Ranked search over a user's notes and conversations
+
+        Args:
+            user_id (int): Owner of the documents
+            query (str): Free-text query
+            kind (str): Restrict to 'note' or 'conversation'
+            limit (int): Page size
+            offset (int): Number of hits to skip
+
+        Returns:
+            list: Hits with kind, id, title, snippet, score and created_at
+        """
+        hits = self.get_backend().search(db.session.connection(), user_id, query, kind, limit, offset)
+        return [{
+            'kind': hit['kind'],
+            'id': hit['ref_id'],
+            'title': hit['title'],
+            'snippet': hit['snippet'],
+            'score': round(float(hit['score']), 4),
+            'created_at': _isoformat(hit['created_at']),
+        } for hit in hits]
+
+    def _changed(self, session, obj):
+        if obj in session.new:
+            return True
+        state = inspect(obj)
+        return any(state.attrs[field].history.has_changes() for field in TRACKED_FIELDS[type(obj)])
+
+    def _after_flush(self, session, flush_context):
+        changes = session.info.setdefault('search_changes', {})
+        for obj in list(session.new) + list(session.dirty):
+            if type(obj) in TRACKED_FIELDS and self._changed(session, obj):
+                changes[document_key(obj)] = DOCUMENT_BUILDERS[type(obj)](obj)
+        for obj in session.deleted:
+            if type(obj) in TRACKED_FIELDS:
+                changes[document_key(obj)] = None
+
+        if changes and self.get_backend().transactional:
+            self._apply(session.connection(), session.info.pop('search_changes'))
+
+    def _after_commit(self, session):
+        changes = session.info.pop('search_changes', None)
+        if changes:
+            self._apply(None, changes)
+
+    def _after_rollback(self, session):
+        session.info.pop('search_changes', None)
+
+    def _apply(self, connection, changes):
+        backend = self.get_backend()
+        documents = [doc for doc in changes.values() if doc is not None]
+        removed = [key for key, doc in changes.items() if doc is None]
+        if removed:
+            backend.remove(connection, removed)
+        if documents:
+            backend.index(connection, documents)
+
+search_index = SearchIndex()
@@ -1,83 +1,359 @@
 import speech_recognition as sr
+import io
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pydub import AudioSegment
-import tempfile
+from pydub.silence import detect_nonsilent
 
-def transcribe_audio(audio_file_path):
+from src.utils.metrics import metrics
+from src.utils.recognizers import RecognitionDeferred, get_recognition_service
+
+logger = logging.getLogger(__name__)
+
+# Long-audio mode: recordings longer than this are split on silence and the
+# chunks are recognized concurrently
+LONG_AUDIO_THRESHOLD_MS = int(os.environ.get('LONG_AUDIO_THRESHOLD_MS', 60 * 1000))
+MAX_CHUNK_MS = int(os.environ.get('TRANSCRIPTION_MAX_CHUNK_MS', 30 * 1000))
+CHUNK_PARALLELISM = int(os.environ.get('TRANSCRIPTION_CHUNK_PARALLELISM', 4))
+MIN_SILENCE_MS = 500
+SILENCE_THRESH_OFFSET_DB = 16  # Silence is this many dB below the average loudness
+KEEP_SILENCE_MS = 200
+
+DEFERRED_MESSAGE = "Transcription deferred: speech recognition is unavailable, it will be retried"
+
+class AudioClip:
     """
-    Transcribe audio file to text using Google Speech Recognition
+    An uploaded recording, decoded by ffmpeg exactly once
+    
+    Validation, duration, normalization, compression and recognition input are
+    all derived from the decoded samples in memory, so one upload costs one
+    decode and no temporary files.
+    """
+    
+    RECOGNITION_FRAME_RATE = 16000
+    RECOGNITION_SAMPLE_WIDTH = 2  # 16-bit PCM
+    
+    def __init__(self, audio, path=None):
+        self.audio = audio
+        self.path = path
+        self._normalized = None
+    
+    @classmethod
+    def from_file(cls, audio_file_path):
+        """
+        Decode an audio file
+        
+        Args:
+            audio_file_path (str): Path to the audio file
+            
+        Returns:
+            AudioClip: The decoded clip
+        """
+        return cls(AudioSegment.from_file(audio_file_path), path=audio_file_path)
+    
+    def __len__(self):
+        return len(self.audio)
+    
+    @property
+    def duration(self):
+        """Duration in seconds"""
+        return len(self.audio) / 1000.0
+    
+    def validate(self):
+        """
+        Check that the decoded audio has usable content
+        
+        Returns:
+            tuple: (is_valid, error_message)
+        """
+        if len(self.audio) == 0:
+            return False, "Audio file has no content"
+        
+        if len(self.audio) < 100:  # Less than 0.1 seconds
+            return False, "Audio file is too short"
+        
+        return True, "Audio file is valid"
+    
+    def normalized(self):
+        """
+        Mono 16 kHz 16-bit version of the audio, as expected by the recognizer
+        
+        Returns:
+            AudioSegment: Normalized audio (computed once and cached)
+        """
+        if self._normalized is None:
+            self._normalized = self.audio.set_channels(1)\
+                                         .set_frame_rate(self.RECOGNITION_FRAME_RATE)\
+                                         .set_sample_width(self.RECOGNITION_SAMPLE_WIDTH)
+        return self._normalized
+    
+    def to_wav_buffer(self):
+        """
+        Export the normalized audio as WAV into memory
+        
+        Returns:
+            io.BytesIO: WAV data positioned at the start
+        """
+        buffer = io.BytesIO()
+        self.normalized().export(buffer, format="wav")
+        buffer.seek(0)
+        return buffer
+    
+    def recognition_input(self):
+        """
+        Raw PCM of the normalized audio wrapped for speech_recognition
+        
+        Returns:
+            sr.AudioData: Input for the recognizer, with no WAV round trip
+        """
+        return segment_to_audio_data(self.normalized())
+
+def segment_to_audio_data(segment):
+    """Wrap the raw samples of an AudioSegment as sr.AudioData"""
+    return sr.AudioData(segment.raw_data, segment.frame_rate, segment.sample_width)
+
+def open_audio(audio_file_path):
+    """
+    Decode and validate an audio file in one pass
     
     Args:
         audio_file_path (str): Path to the audio file
         
     Returns:
-        str: Transcribed text or error message
+        tuple: (AudioClip or None if invalid, validation message)
     """
     try:
-        # Initialize recognizer
-        recognizer = sr.Recognizer()
+        if not audio_file_path or not os.path.exists(audio_file_path):
+            return None, "Audio file does not exist"
+        
+        if os.path.getsize(audio_file_path) == 0:
+            return None, "Audio file is empty"
+        
+        clip = AudioClip.from_file(audio_file_path)
+        is_valid, message = clip.validate()
+        return (clip if is_valid else None), message
+        
+    except Exception as e:
+        return None, f"Error validating audio file: {str(e)}"
+
+def _as_clip(audio):
+    return audio if isinstance(audio, AudioClip) else AudioClip.from_file(audio)
+
+def transcribe_audio(audio, long_audio=None, parallelism=None):
+    """
+    Transcribe audio to text with the configured recognizer backend
+    
+    Args:
+        audio (AudioClip or str): Decoded clip, or path to the audio file
+        long_audio (bool): Force (True) or disable (False) chunked long-audio
+            mode. By default it is used for recordings longer than
+            LONG_AUDIO_THRESHOLD_MS.
+        parallelism (int): Number of chunks recognized concurrently in long-audio mode
         
-        # Convert audio to WAV format if needed
-        audio_path = convert_to_wav(audio_file_path)
+    Returns:
+        str: Transcribed text or error message
+    """
+    return transcribe_audio_result(audio, long_audio=long_audio, parallelism=parallelism)['text']
+
+def transcribe_audio_result(audio, long_audio=None, parallelism=None):
+    """
+    Transcribe audio and report how recognition went
+    
+    Same arguments as transcribe_audio().
+    
+    Returns:
+        dict: 'text' (transcription or error message), 'outcome' ('recognized',
+        'unrecognized' when no speech was found, 'deferred' when the recognizer
+        is unavailable and the recording should be retried later, 'partial'
+        when some chunks of a long recording failed and the text has gaps, or
+        'error') and 'mode' ('short' or 'long')
+    """
+    started = time.perf_counter()
+    result = {'text': None, 'outcome': 'error', 'mode': 'short'}
+    audio_seconds = None
+    try:
+        clip = _as_clip(audio)
+        audio_seconds = clip.duration
         
-        # Load audio file
-        with sr.AudioFile(audio_path) as source:
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-            # Record the audio
-            audio_data = recognizer.record(source)
+        if long_audio or (long_audio is None and len(clip) > LONG_AUDIO_THRESHOLD_MS):
+            result['mode'] = 'long'
+            long_result = transcribe_long_audio(clip, parallelism=parallelism)
+            log_chunk_report(clip.path, long_result)
+            if long_result['deferred_chunks']:
+                # A partial transcript would be cached and never completed
+                result.update(text=DEFERRED_MESSAGE, outcome='deferred')
+                return result
+            if long_result['text']:
+                outcome = 'partial' if long_result['failed_chunks'] else 'recognized'
+                result.update(text=long_result['text'], outcome=outcome)
+                return result
+            errors = [chunk['error'] for chunk in long_result['chunks'] if chunk['error']]
+            if errors:
+                result['text'] = errors[0]
+            else:
+                result.update(text="Could not understand audio", outcome='unrecognized')
+            return result
         
-        # Perform speech recognition
         try:
-            # Using Google Speech Recognition (free tier)
-            text = recognizer.recognize_google(audio_data)
-            return text
+            text = get_recognition_service().recognize(clip.recognition_input())
+            result.update(text=text, outcome='recognized')
         except sr.UnknownValueError:
-            return "Could not understand audio"
-        except sr.RequestError as e:
-            return f"Could not request results from speech recognition service; {e}"
+            result.update(text="Could not understand audio", outcome='unrecognized')
+        except RecognitionDeferred as e:
+            logger.warning('Transcription deferred: %s', e)
+            result.update(text=DEFERRED_MESSAGE, outcome='deferred')
+        return result
             
     except Exception as e:
-        return f"Error processing audio: {str(e)}"
+        result['text'] = f"Error processing audio: {str(e)}"
+        return result
     finally:
-        # Clean up temporary file if created
-        if 'audio_path' in locals() and audio_path != audio_file_path:
-            try:
-                os.remove(audio_path)
-            except:
-                pass
+        metrics.observe_transcription(time.perf_counter() - started, result['mode'], result['outcome'], audio_seconds)
+
+def recognizer_config():
+    """
+    Settings that determine the transcription of a recording
+
+    Part of the transcription cache key, so that changing any of them
+    invalidates cached results.
+    """
+    return {
+        **get_recognition_service().config(),
+        'long_audio_threshold_ms': LONG_AUDIO_THRESHOLD_MS,
+        'max_chunk_ms': MAX_CHUNK_MS,
+        'frame_rate': AudioClip.RECOGNITION_FRAME_RATE,
+    }
 
-def convert_to_wav(audio_file_path):
+def split_on_silence_bounded(audio, max_chunk_ms=MAX_CHUNK_MS, min_silence_ms=MIN_SILENCE_MS,
+                             silence_thresh=None, keep_silence_ms=KEEP_SILENCE_MS):
     """
-    Convert audio file to WAV format if it's not already
+    Split audio into chunks at pauses, with no chunk longer than max_chunk_ms
+    
+    Consecutive speech regions are merged while they fit in one chunk; a single
+    region longer than max_chunk_ms is cut into fixed-size windows.
     
     Args:
-        audio_file_path (str): Path to the audio file
+        audio (AudioSegment): Decoded audio
+        max_chunk_ms (int): Upper bound on chunk length in milliseconds
+        min_silence_ms (int): Minimum pause length that counts as a split point
+        silence_thresh (float): Loudness in dBFS under which audio is silence
+        keep_silence_ms (int): Padding kept around each speech region
         
     Returns:
-        str: Path to WAV file
+        list: (start_ms, end_ms) tuples in playback order
     """
-    try:
-        # Check if file is already WAV
-        if audio_file_path.lower().endswith('.wav'):
-            return audio_file_path
+    if silence_thresh is None:
+        silence_thresh = audio.dBFS - SILENCE_THRESH_OFFSET_DB
+    
+    regions = detect_nonsilent(audio, min_silence_len=min_silence_ms, silence_thresh=silence_thresh)
+    
+    chunks = []
+    for start, end in regions:
+        start = max(0, start - keep_silence_ms)
+        end = min(len(audio), end + keep_silence_ms)
         
-        # Load audio file
-        audio = AudioSegment.from_file(audio_file_path)
+        if chunks and end - chunks[-1][0] <= max_chunk_ms:
+            chunks[-1] = (chunks[-1][0], end)
+            continue
         
-        # Create temporary WAV file
-        temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        temp_wav_path = temp_wav.name
-        temp_wav.close()
+        while end - start > max_chunk_ms:
+            chunks.append((start, start + max_chunk_ms))
+            start += max_chunk_ms
+        chunks.append((start, end))
+    
+    return chunks
+
+def recognize_chunk(chunk):
+    """
+    Run speech recognition on one chunk of audio
+    
+    Args:
+        chunk (AudioSegment): Normalized audio of a single chunk
         
-        # Export as WAV
-        audio.export(temp_wav_path, format="wav")
+    Returns:
+        str: Recognized text, empty if the chunk has no recognizable speech
         
-        return temp_wav_path
+    Raises:
+        RecognitionDeferred: If the recognizer is unavailable
+    """
+    try:
+        return get_recognition_service().recognize(segment_to_audio_data(chunk))
+    except sr.UnknownValueError:
+        return ""
+
+def transcribe_long_audio(audio, parallelism=None, max_chunk_ms=MAX_CHUNK_MS):
+    """
+    Transcribe a long recording by recognizing silence-delimited chunks in parallel
+    
+    A failing chunk is reported and skipped instead of failing the whole
+    recording.
+    
+    Args:
+        audio (AudioClip or str): Decoded clip, or path to the audio file
+        parallelism (int): Number of chunks recognized concurrently
+        max_chunk_ms (int): Upper bound on chunk length in milliseconds
         
-    except Exception as e:
-        print(f"Error converting audio to WAV: {e}")
-        return audio_file_path
+    Returns:
+        dict: 'text' (stitched transcript), 'chunks' (per-chunk index, start_ms,
+        end_ms, elapsed_ms, text, error and deferred), 'failed_chunks' and
+        'deferred_chunks'
+    """
+    parallelism = parallelism or CHUNK_PARALLELISM
+    audio = _as_clip(audio).normalized()
+    bounds = split_on_silence_bounded(audio, max_chunk_ms=max_chunk_ms)
+    
+    def run(index):
+        start_ms, end_ms = bounds[index]
+        report = {'index': index, 'start_ms': start_ms, 'end_ms': end_ms, 'text': '', 'error': None,
+                  'deferred': False}
+        started = time.perf_counter()
+        try:
+            report['text'] = recognize_chunk(audio[start_ms:end_ms])
+        except RecognitionDeferred as e:
+            report.update(error=f"Speech recognition unavailable; {e}", deferred=True)
+        except Exception as e:
+            report['error'] = f"Error processing audio: {str(e)}"
+        elapsed = time.perf_counter() - started
+        report['elapsed_ms'] = round(elapsed * 1000, 1)
+        metrics.transcription_chunk_duration.observe(
+            elapsed, 'error' if report['error'] else 'recognized' if report['text'] else 'unrecognized')
+        return report
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(bounds) or 1))) as executor:
+        chunks = list(executor.map(run, range(len(bounds))))
+    
+    return {
+        'text': ' '.join(chunk['text'] for chunk in chunks if chunk['text']),
+        'chunks': chunks,
+        'failed_chunks': sum(1 for chunk in chunks if chunk['error']),
+        'deferred_chunks': sum(1 for chunk in chunks if chunk['deferred'])
+    }
+
+def log_chunk_report(audio_file_path, result):
+    """Log per-chunk timing and failures of a long-audio transcription"""
+    for chunk in result['chunks']:
+        if chunk['error']:
+            logger.warning('%s chunk %d (%d-%d ms) failed after %.1f ms: %s', audio_file_path,
+                           chunk['index'], chunk['start_ms'], chunk['end_ms'], chunk['elapsed_ms'], chunk['error'])
+        else:
+            logger.info('%s chunk %d (%d-%d ms) recognized in %.1f ms', audio_file_path,
+                        chunk['index'], chunk['start_ms'], chunk['end_ms'], chunk['elapsed_ms'])
+    logger.info('%s transcribed in %d chunks, %d failed', audio_file_path,
+                len(result['chunks']), result['failed_chunks'])
+
+def convert_to_wav(audio):
+    """
+    Convert audio to normalized WAV in memory, with no temporary file
+    
+    Args:
+        audio (AudioClip or str): Decoded clip, or path to the audio file
+        
+    Returns:
+        io.BytesIO: WAV data positioned at the start
+    """
+    return _as_clip(audio).to_wav_buffer()
 
 def validate_audio_file(audio_file_path):
     """
@@ -89,69 +365,51 @@ def validate_audio_file(audio_file_path):
     Returns:
         tuple: (is_valid, error_message)
     """
-    try:
-        if not os.path.exists(audio_file_path):
-            return False, "Audio file does not exist"
-        
-        if os.path.getsize(audio_file_path) == 0:
-            return False, "Audio file is empty"
-        
-        # Try to load the audio file
-        audio = AudioSegment.from_file(audio_file_path)
-        
-        if len(audio) == 0:
-            return False, "Audio file has no content"
-        
-        if len(audio) < 100:  # Less than 0.1 seconds
-            return False, "Audio file is too short"
-        
-        return True, "Audio file is valid"
-        
-    except Exception as e:
-        return False, f"Error validating audio file: {str(e)}"
+    clip, message = open_audio(audio_file_path)
+    return clip is not None, message
 
-def get_audio_duration(audio_file_path):
+def get_audio_duration(audio):
     """
     Get the duration of an audio file in seconds
     
     Args:
-        audio_file_path (str): Path to the audio file
+        audio (AudioClip or str): Decoded clip, or path to the audio file
         
     Returns:
         float: Duration in seconds, or 0 if error
     """
     try:
-        audio = AudioSegment.from_file(audio_file_path)
-        return len(audio) / 1000.0  # Convert milliseconds to seconds
+        return _as_clip(audio).duration
     except Exception as e:
         print(f"Error getting audio duration: {e}")
         return 0.0
 
-def compress_audio(audio_file_path, target_size_mb=5):
+def compress_audio(audio, target_size_mb=5):
     """
     Compress audio file to reduce size while maintaining quality
     
     Args:
-        audio_file_path (str): Path to the audio file
+        audio (AudioClip or str): Decoded clip, or path to the audio file
         target_size_mb (int): Target size in MB
         
     Returns:
         str: Path to compressed audio file
     """
+    audio_file_path = audio.path if isinstance(audio, AudioClip) else audio
     try:
-        audio = AudioSegment.from_file(audio_file_path)
-        
         # Get current file size
         current_size_mb = os.path.getsize(audio_file_path) / (1024 * 1024)
         
         if current_size_mb <= target_size_mb:
             return audio_file_path
         
+        segment = _as_clip(audio).audio
+        
         # Calculate compression ratio
         compression_ratio = target_size_mb / current_size_mb
         
         # Reduce bitrate and sample rate
-        compressed_audio = audio.set_frame_rate(int(audio.frame_rate * compression_ratio))
+        compressed_audio = segment.set_frame_rate(int(segment.frame_rate * compression_ratio))
         
         # Create compressed file
         compressed_path = audio_file_path.replace('.wav', '_compressed.wav')
@@ -162,4 +420,3 @@ def compress_audio(audio_file_path, target_size_mb=5):
     except Exception as e:
         print(f"Error compressing audio: {e}")
         return audio_file_path
-
@@ -0,0 +1,120 @@
+import json
+from datetime import datetime
+from functools import cache
+from itertools import islice
+
+from flask import Response, request, stream_with_context
+from sqlalchemy import select
+
+from src.models.master_agent import Note, NoteTag, db
+
+try:
+    import msgpack
+except ImportError:  # optional dependency; NDJSON is always available
+    msgpack = None
+
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+STREAM_BATCH_SIZE = 1000
+
+def negotiate_stream_format():
+    """
+    Streaming format requested by the client, if any
+
+    Chosen by ?format=ndjson|msgpack or by the Accept header. Plain
+    application/json keeps the regular buffered response.
+
+    Returns:
+        str: NDJSON, MSGPACK or None
+    """
+    available = [NDJSON] + ([MSGPACK] if msgpack is not None else [])
+    requested = request.args.get('format')
+    if requested:
+        mimetype = {'ndjson': NDJSON, 'msgpack': MSGPACK}.get(requested)
+        return mimetype if mimetype in available else None
+    best = request.accept_mimetypes.best_match(available + ['application/json'])
+    if best in available and request.accept_mimetypes[best] > request.accept_mimetypes['application/json']:
+        return best
+    return None
+
+@cache
+def projected_columns(model):
+    """
+    Columns selected for a streamed listing
+
+    The columns named by the keys of Model.to_dict(), in the same order, so
+    streamed items match the JSON listing; internal columns such as
+    Note.transcription_attempts are left out. Note's legacy tags column is
+    only read to fill 'tags' for notes not migrated to note_tag yet.
+    """
+    columns = model.__table__.columns
+    return [columns[key] for key in model().to_dict() if key in columns]
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _rows_to_dicts(model, keys, rows):
+    items = [{key: _encode(value) for key, value in zip(keys, row)} for row in rows]
+    if model is Note and items:
+        # One query for the tags of the whole batch
+        tags = {}
+        for note_id, name in db.session.execute(
+                select(NoteTag.note_id, NoteTag.name)
+                .where(NoteTag.note_id.in_([item['id'] for item in items]))
+                .order_by(NoteTag.note_id, NoteTag.position)):
+            tags.setdefault(note_id, []).append(name)
+        for item in items:
+            legacy = item.pop('tags')
+            item['tags'] = tags.get(item['id']) or (json.loads(legacy) if legacy else [])
+    return items
+
+def stream_listing(query, model, mimetype, batch_size=STREAM_BATCH_SIZE, tail=None):
+    """
+    Stream every row of a listing as NDJSON lines or concatenated msgpack maps
+
+    The query is rewritten to select plain columns, so no ORM objects are
+    built or tracked in the identity map, and rows are fetched with yield_per
+    (a server-side cursor on Postgres). Memory stays bounded by one batch
+    whatever the size of the result.
+
+    Args:
+        query: Listing query with its filters
+        model: Mapped class of the listing
+        mimetype (str): NDJSON or MSGPACK
+        batch_size (int): Rows fetched and encoded at a time
+        tail (callable): Returns an iterable of item dicts streamed after the
+            rows, such as archived conversations
+
+    Returns:
+        Response: Streaming response
+    """
+    columns = projected_columns(model)
+    keys = [column.key for column in columns]
+    rows = query.with_entities(*columns)\
+                .order_by(model.created_at.desc(), model.id.desc())\
+                .execution_options(yield_per=batch_size)
+
+    if mimetype == MSGPACK:
+        packer = msgpack.Packer()
+        encode_batch = lambda items: b''.join(packer.pack(item) for item in items)
+    else:
+        encode_batch = lambda items: ''.join(json.dumps(item) + '\n' for item in items).encode()
+
+    def generate():
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield encode_batch(_rows_to_dicts(model, keys, batch))
+                batch = []
+        if batch:
+            yield encode_batch(_rows_to_dicts(model, keys, batch))
+        if tail is not None:
+            items = tail()
+            while True:
+                batch = list(islice(items, batch_size))
+                if not batch:
+                    break
+                yield encode_batch(batch)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype)
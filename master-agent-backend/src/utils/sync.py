@@ -0,0 +1,105 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from flask import request
+from sqlalchemy import func, insert
+
+from src.models.master_agent import Task, Goal, Note, Conversation, Tombstone, db
+
+SYNC_MODELS = {
+    'tasks': Task,
+    'goals': Goal,
+    'notes': Note,
+}
+
+# Rows written by transactions that were still open when a sync ran carry an
+# updated_at slightly before their commit. Handing out a watermark this far in
+# the past makes the next sync pick them up (at the cost of re-sending a few
+# recent rows, which clients apply idempotently).
+WATERMARK_SKEW = timedelta(seconds=int(os.environ.get('SYNC_WATERMARK_SKEW_SECONDS', 5)))
+TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get('SYNC_TOMBSTONE_DAYS', 30)))
+
+def record_deletions(entity_type, user_id, entity_ids):
+    """
+    Add tombstones for deleted rows in the current transaction
+
+    Args:
+        entity_type (str): 'tasks', 'goals' or 'notes'
+        user_id (int): Owner of the rows
+        entity_ids (list): Ids of the deleted rows
+    """
+    if entity_ids:
+        now = datetime.utcnow()
+        db.session.execute(insert(Tombstone), [
+            {'entity_type': entity_type, 'entity_id': entity_id, 'user_id': user_id, 'deleted_at': now}
+            for entity_id in entity_ids
+        ])
+
+def changes_since(user_id, since=None, entity_types=None):
+    """
+    Rows changed and deleted since a watermark
+
+    Args:
+        user_id (int): Owner of the rows
+        since (datetime): Watermark from a previous sync; None for a full snapshot
+        entity_types (list): Subset of SYNC_MODELS keys
+
+    Returns:
+        dict: {'watermark': iso string, 'full': bool, type: {'changed': [...], 'deleted': [ids]}}.
+        'full' is set when everything is returned, including when the watermark
+        is older than the tombstones kept, and the client must replace its copy.
+    """
+    now = datetime.utcnow()
+    full = since is None or since < now - TOMBSTONE_RETENTION
+    result = {'watermark': (now - WATERMARK_SKEW).isoformat(), 'full': full}
+
+    for entity_type in entity_types or SYNC_MODELS:
+        model = SYNC_MODELS[entity_type]
+        query = model.query.filter(model.user_id == user_id)
+        deleted = []
+        if not full:
+            query = query.filter(model.updated_at >= since)
+            deleted = [row[0] for row in db.session.query(Tombstone.entity_id)
+                                                   .filter(Tombstone.user_id == user_id,
+                                                           Tombstone.entity_type == entity_type,
+                                                           Tombstone.deleted_at >= since)]
+        result[entity_type] = {
+            'changed': [item.to_dict() for item in query.order_by(model.updated_at, model.id)],
+            'deleted': deleted
+        }
+
+    return result
+
+def prune_tombstones(older_than=TOMBSTONE_RETENTION):
+    """
+    Delete tombstones that no client can still need
+
+    Returns:
+        int: Number of tombstones deleted
+    """
+    deleted = Tombstone.query.filter(Tombstone.deleted_at < datetime.utcnow() - older_than)\
+                             .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def collection_etag(query, model):
+    """
+    Validator for a filtered listing, computed without loading its rows
+
+    The row count and newest updated_at change on every create, update and
+    delete (conversations are append-only, so their newest id is used). The
+    request's query string and Accept header are mixed in because they select
+    the page and its format.
+
+    Args:
+        query: The listing query with its filters, before ordering and paging
+        model: Mapped class of the listing
+
+    Returns:
+        str: ETag value
+    """
+    newest = model.id if model is Conversation else model.updated_at
+    count, latest = query.with_entities(func.count(model.id), func.max(newest)).order_by(None).one()
+    raw = f'{model.__tablename__}|{count}|{latest}|{request.query_string.decode()}|{request.headers.get("Accept", "")}'
+    return hashlib.sha1(raw.encode()).hexdigest()
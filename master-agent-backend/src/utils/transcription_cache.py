@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.master_agent import TranscriptionCacheEntry, db
+
+logger = logging.getLogger(__name__)
+
+# Stores between two checks of the table size
+EVICT_EVERY = 50
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def audio_key(clip, config):
+    """
+    Cache key of a decoded recording
+
+    Hashes the normalized samples (mono, 16 kHz, 16-bit) rather than the
+    uploaded bytes, so re-encodings and container changes of the same audio
+    share an entry.
+    """
+    digest = hashlib.sha256(clip.normalized().raw_data)
+    digest.update(config_hash(config).encode())
+    return digest.hexdigest()
+
+class TranscriptionCache:
+    """
+    Persistent cache of transcriptions keyed by audio content
+
+    Entries are looked up by the hash of the uploaded bytes when a voice note
+    is uploaded (no decoding needed) and by the hash of the normalized audio
+    in the transcription job. Only definitive results are cached: recognized
+    text and 'no speech found', never service errors. Least recently used
+    entries are deleted beyond TRANSCRIPTION_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_entries = 10000
+        self._stores = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRANSCRIPTION_CACHE', os.environ.get('TRANSCRIPTION_CACHE', 'true').lower() == 'true')
+        app.config.setdefault('TRANSCRIPTION_CACHE_MAX_ENTRIES', int(os.environ.get('TRANSCRIPTION_CACHE_MAX_ENTRIES', 10000)))
+        self.enabled = app.config['TRANSCRIPTION_CACHE']
+        self.max_entries = app.config['TRANSCRIPTION_CACHE_MAX_ENTRIES']
+        app.extensions['transcription_cache'] = self
+
+    def _touch(self, entry):
+        db.session.execute(update(TranscriptionCacheEntry)
+                           .where(TranscriptionCacheEntry.key == entry.key)
+                           .values(hits=TranscriptionCacheEntry.hits + 1, last_used_at=datetime.utcnow()))
+        return entry.transcription
+
+    def lookup_upload(self, raw_key):
+        """
+        Cached transcription of an upload, by the hash of its bytes
+
+        Returns:
+            str: The transcription, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        try:
+            from src.utils.speech_processing import recognizer_config
+        except ImportError:
+            return None
+        entry = TranscriptionCacheEntry.query.filter_by(raw_key=raw_key,
+                                                        config_hash=config_hash(recognizer_config())).first()
+        return self._touch(entry) if entry else None
+
+    def lookup(self, key):
+        """
+        Cached transcription by audio key
+
+        Returns:
+            str: The transcription, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        entry = db.session.get(TranscriptionCacheEntry, key)
+        return self._touch(entry) if entry else None
+
+    def store(self, key, raw_key, config, transcription):
+        """Add a result in the current transaction; an existing entry for the key is kept"""
+        if not self.enabled:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(TranscriptionCacheEntry(key=key, raw_key=raw_key, config_hash=config_hash(config),
+                                                       transcription=transcription))
+        except IntegrityError:
+            pass  # Stored concurrently by a job for identical audio
+
+        with self._lock:
+            self._stores += 1
+            check = self._stores % EVICT_EVERY == 1
+        if check:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries beyond the size bound
+
+        Returns:
+            int: Number of entries deleted
+        """
+        excess = db.session.query(func.count(TranscriptionCacheEntry.key)).scalar() - self.max_entries
+        if excess <= 0:
+            return 0
+        oldest = select(TranscriptionCacheEntry.key).order_by(TranscriptionCacheEntry.last_used_at).limit(excess)
+        deleted = db.session.execute(delete(TranscriptionCacheEntry)
+                                     .where(TranscriptionCacheEntry.key.in_(oldest)),
+                                     execution_options={'synchronize_session': False}).rowcount
+        logger.info('Evicted %d transcription cache entries', deleted)
+        return deleted
+
+    def clear(self):
+        deleted = db.session.execute(delete(TranscriptionCacheEntry)).rowcount
+        db.session.commit()
+        return deleted
+
+transcription_cache = TranscriptionCache()
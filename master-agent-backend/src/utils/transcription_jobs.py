@@ -0,0 +1,299 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from src.models.master_agent import Note, db
+from src.utils.audio_storage import audio_storage
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.response_cache import response_cache
+from src.utils.transcription_cache import transcription_cache, audio_key
+
+logger = logging.getLogger(__name__)
+
+# Note.transcription_status values
+PENDING = 'pending'
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+FAILED = 'failed'
+DEFERRED = 'deferred'  # Recognizer unavailable; requeued after a delay
+
+class TranscriptionQueue:
+    """
+    Bounded background worker pool that fills in Note.transcription
+
+    The database is the source of truth for job state: a note is queued by
+    setting its transcription_status to 'pending', and a worker claims it with a
+    conditional UPDATE so that several gunicorn workers recovering the same
+    backlog never transcribe a note twice.
+    Every change of a note's job state bumps its version, like a client edit.
+
+    Notes deferred because the recognizer is unavailable are put back to
+    'pending' TRANSCRIPTION_RETRY_SECONDS later by a single timer, so an
+    outage costs one failed call per retry round instead of one per note.
+    A recording whose transcription failed, or of which some chunks failed
+    (keeping the text recognized so far), is deferred the same way until
+    TRANSCRIPTION_MAX_ATTEMPTS such results; the last one is kept as failed.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._inflight = set()
+        self._overflowed = False
+        self._retry_timer = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRANSCRIPTION_WORKERS', int(os.environ.get('TRANSCRIPTION_WORKERS', 2)))
+        app.config.setdefault('TRANSCRIPTION_MAX_PENDING', int(os.environ.get('TRANSCRIPTION_MAX_PENDING', 100)))
+        app.config.setdefault('TRANSCRIPTION_STALE_SECONDS', int(os.environ.get('TRANSCRIPTION_STALE_SECONDS', 900)))
+        app.config.setdefault('TRANSCRIPTION_RETRY_SECONDS', int(os.environ.get('TRANSCRIPTION_RETRY_SECONDS', 60)))
+        app.config.setdefault('TRANSCRIPTION_MAX_ATTEMPTS', int(os.environ.get('TRANSCRIPTION_MAX_ATTEMPTS', 5)))
+        self.app = app
+        app.extensions['transcription_queue'] = self
+
+    def _get_executor(self):
+        # Created lazily so that the threads are started in the serving process,
+        # not in a parent that forks workers afterwards.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['TRANSCRIPTION_WORKERS'],
+                thread_name_prefix='transcription'
+            )
+        return self._executor
+
+    def submit(self, note_id):
+        """
+        Queue a pending note for transcription
+
+        Args:
+            note_id (int): Id of a note whose transcription_status is 'pending'
+
+        Returns:
+            bool: False if the in-process backlog is full. The note stays
+            pending in the database and is picked up once a slot frees up.
+        """
+        with self._lock:
+            if note_id in self._inflight:
+                return True
+            if len(self._inflight) >= self.app.config['TRANSCRIPTION_MAX_PENDING']:
+                self._overflowed = True
+                return False
+            self._inflight.add(note_id)
+            self._get_executor().submit(self._run, note_id)
+        return True
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def _run(self, note_id):
+        with self.app.app_context():
+            try:
+                if process_note(note_id) == DEFERRED:
+                    self.schedule_retry()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Transcription job for note %s crashed', note_id)
+            finally:
+                with self._lock:
+                    self._inflight.discard(note_id)
+                    refill = self._overflowed
+                    self._overflowed = False
+                try:
+                    if refill:
+                        self.enqueue_pending()
+                finally:
+                    db.session.remove()
+
+    def enqueue_pending(self):
+        """
+        Submit every note that is waiting for transcription
+
+        Returns:
+            int: Number of notes submitted
+        """
+        note_ids = [row[0] for row in db.session.query(Note.id)
+                                              .filter(Note.transcription_status == PENDING)
+                                              .order_by(Note.id).all()]
+        submitted = 0
+        for note_id in note_ids:
+            if not self.submit(note_id):
+                break
+            submitted += 1
+        return submitted
+
+    def schedule_retry(self, delay=None):
+        """Requeue deferred notes after a delay, unless a retry is already scheduled"""
+        with self._lock:
+            if self._retry_timer is not None:
+                return
+            self._retry_timer = threading.Timer(
+                self.app.config['TRANSCRIPTION_RETRY_SECONDS'] if delay is None else delay, self._retry_deferred)
+            self._retry_timer.daemon = True
+            self._retry_timer.start()
+
+    def _retry_deferred(self):
+        with self._lock:
+            self._retry_timer = None
+        with self.app.app_context():
+            try:
+                self.requeue_deferred()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Could not requeue deferred transcriptions')
+                self.schedule_retry()
+            finally:
+                db.session.remove()
+
+    def requeue_deferred(self):
+        """
+        Put deferred notes back to 'pending' and submit them
+
+        Returns:
+            int: Number of notes submitted
+        """
+        reset = db.session.execute(
+            update(Note)
+            .where(Note.transcription_status == DEFERRED)
+            .values(transcription_status=PENDING, version=Note.version + 1, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if reset:
+            logger.info('Retrying %s deferred transcriptions', reset)
+        return self.enqueue_pending()
+
+    def schedule_recovery(self, delay=0):
+        """Run recover() in a background thread after delay seconds"""
+        timer = threading.Timer(delay, self._recover)
+        timer.daemon = True
+        timer.start()
+
+    def _recover(self):
+        with self.app.app_context():
+            try:
+                self.recover()
+            except Exception as e:
+                db.session.rollback()
+                # Tables not created yet (SKIP_DB_INIT before the first init-db)
+                logger.warning('Could not recover transcription jobs: %s', getattr(e, 'orig', e))
+            finally:
+                db.session.remove()
+
+    def recover(self):
+        """
+        Requeue jobs left behind by a crashed or restarted worker
+
+        Notes stuck in 'processing' for longer than TRANSCRIPTION_STALE_SECONDS
+        are put back to 'pending', as are deferred notes, then all pending notes
+        are submitted. Must be called inside an app context.
+
+        Returns:
+            int: Number of notes submitted
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['TRANSCRIPTION_STALE_SECONDS'])
+        reset = db.session.execute(
+            update(Note)
+            .where(Note.transcription_status == PROCESSING, Note.updated_at < cutoff)
+            .values(transcription_status=PENDING, version=Note.version + 1, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if reset:
+            logger.warning('Recovered %s stale transcription jobs', reset)
+        return self.requeue_deferred()
+
+def claim_note(note_id):
+    """
+    Atomically move a note from 'pending' to 'processing'
+
+    Returns:
+        bool: True if this caller owns the job
+    """
+    claimed = db.session.execute(
+        update(Note)
+        .where(Note.id == note_id, Note.transcription_status == PENDING)
+        .values(transcription_status=PROCESSING, version=Note.version + 1, updated_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def process_note(note_id):
+    """
+    Validate and transcribe the audio of a voice note
+
+    Args:
+        note_id (int): Id of the note to process
+
+    Returns:
+        str: Final transcription_status ('deferred' if the recognizer was
+        unavailable, or if recognition failed or only part of the recording
+        was recognized and attempts remain), or None if the job was taken
+        elsewhere
+    """
+    if not claim_note(note_id):
+        return None
+
+    note = db.session.get(Note, note_id)
+    if note is None:  # Deleted while queued
+        return None
+    status = COMPLETED
+    clip = None
+    released_key = None
+
+    try:
+        from src.utils.speech_processing import open_audio, transcribe_audio_result, recognizer_config
+
+        # Decode once; validation, recognition and transcoding share the decoded clip
+        with audio_storage.local_path(note) as audio_path:
+            clip, validation_message = open_audio(audio_path)
+        if clip is not None:
+            config = recognizer_config()
+            cache_key = audio_key(clip, config)
+            transcription = transcription_cache.lookup(cache_key)
+            if transcription is None:
+                result = transcribe_audio_result(clip)
+                transcription = result['text']
+                if result['outcome'] == 'deferred':
+                    status = DEFERRED
+                elif result['outcome'] in ('partial', 'error'):
+                    # Error or text with gaps: shown meanwhile, never cached, retried a few times
+                    note.transcription_attempts += 1
+                    max_attempts = transcription_queue.app.config['TRANSCRIPTION_MAX_ATTEMPTS']
+                    status = DEFERRED if note.transcription_attempts < max_attempts else FAILED
+                else:
+                    transcription_cache.store(cache_key, note.audio_key, config, transcription)
+        else:
+            status = FAILED
+            transcription = f'Invalid audio file: {validation_message}'
+            if note.audio_file_path and os.path.exists(note.audio_file_path):
+                os.remove(note.audio_file_path)  # Clean up invalid file
+            note.audio_file_path = None
+            released_key, note.audio_key = note.audio_key, None
+            audio_storage.release([released_key])
+    except ImportError:
+        transcription = "Transcription not available - speech processing dependencies not installed"
+    except Exception as e:
+        status = FAILED
+        transcription = f"Transcription failed: {str(e)}"
+
+    note.transcription = transcription
+    note.transcription_status = status
+    # A PATCH based on the version before the job is then a conflict instead of overwriting its result
+    note.version = Note.version + 1
+    db.session.commit()
+    dashboard_cache.record_update(note.user_id, 'notes', note.note_type, note.note_type, note.to_dict())
+    response_cache.invalidate(note.user_id, 'notes')
+
+    audio_storage.collect([released_key])
+    if clip is not None and note.audio_key and status != DEFERRED:
+        # Compact long-term copy; playback switches to it once stored
+        audio_storage.transcode(note.audio_key, clip)
+    return status
+
+transcription_queue = TranscriptionQueue()
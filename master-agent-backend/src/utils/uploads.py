@@ -0,0 +1,156 @@
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+from src.models.master_agent import UploadSession, db
+from src.utils.audio_storage import audio_storage, UploadTooLargeError
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TTL = timedelta(seconds=int(os.environ.get('VOICE_UPLOAD_TTL_SECONDS', 24 * 3600)))
+
+class UploadNotFound(Exception):
+    pass
+
+class OffsetMismatch(Exception):
+    """The chunk does not start where the upload ends"""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected a chunk at offset {expected}')
+        self.expected = expected
+
+def get_session(upload_id):
+    """
+    Open upload session by id
+
+    Raises:
+        UploadNotFound: If the session does not exist or has expired
+    """
+    session = db.session.get(UploadSession, upload_id, populate_existing=True)
+    if session is None or session.expires_at < datetime.utcnow():
+        raise UploadNotFound(f'Upload {upload_id} not found or expired')
+    return session
+
+def start_upload(user_id, title=None, filename=None, mimetype=None, size=None):
+    """
+    Open a resumable voice note upload
+
+    Args:
+        size (int): Total size announced by the client, checked against
+            VOICE_UPLOAD_MAX_BYTES up front and against the received bytes on finish
+
+    Returns:
+        UploadSession: The committed session
+
+    Raises:
+        UploadTooLargeError: If the announced size is over the limit
+    """
+    if size is not None and size > audio_storage.max_upload_bytes:
+        raise UploadTooLargeError(f'Audio file is larger than {audio_storage.max_upload_bytes} bytes')
+    session = UploadSession(id=uuid.uuid4().hex, user_id=user_id, title=title, filename=filename,
+                            mimetype=mimetype, size=size, received=0,
+                            expires_at=datetime.utcnow() + UPLOAD_TTL)
+    audio_storage.start_partial(session.id)
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+def append_chunk(upload_id, offset, stream, length=None):
+    """
+    Write the next chunk of an upload
+
+    The chunk must start at the offset acknowledged so far, which makes a
+    retried chunk safe: a client that lost the response asks for the offset
+    and resends from there. Of two concurrent appends at the same offset,
+    only the first to commit moves the offset.
+
+    Args:
+        upload_id (str): UploadSession id
+        offset (int): Position of the chunk
+        stream: Readable binary stream with the chunk
+        length (int): Content-Length of the chunk, if known, to reject
+            oversized chunks before reading them
+
+    Returns:
+        UploadSession: The session with its new offset
+
+    Raises:
+        UploadNotFound: If the session does not exist or has expired
+        OffsetMismatch: If offset is not the current end of the upload
+        UploadTooLargeError: If the chunk or the upload would be too large
+    """
+    session = get_session(upload_id)
+    if offset != session.received:
+        raise OffsetMismatch(session.received)
+    total = min(session.size, audio_storage.max_upload_bytes) if session.size is not None \
+        else audio_storage.max_upload_bytes
+    if length is not None and length > audio_storage.max_chunk_bytes:
+        raise UploadTooLargeError('Chunk is too large')
+    if length is not None and offset + length > total:
+        raise UploadTooLargeError(f'Chunk goes past the end of the upload ({total} bytes)')
+
+    written = audio_storage.write_partial(upload_id, offset, stream, total=session.size)
+    moved = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload_id, UploadSession.received == offset)
+        .values(received=offset + written)
+    ).rowcount
+    db.session.commit()
+    if not moved:
+        raise OffsetMismatch(get_session(upload_id).received)
+    return get_session(upload_id)
+
+def finish_upload(upload_id):
+    """
+    Turn a complete upload into a stored recording
+
+    The session is deleted and the AudioBlob reference added in the current
+    transaction; the caller creates the note and commits. Deleting the session
+    first claims it, so a finish retried concurrently gets UploadNotFound.
+
+    Returns:
+        tuple: (AudioBlob, UploadSession)
+
+    Raises:
+        UploadNotFound: If the session does not exist or has expired
+        ValueError: If fewer bytes than announced were received
+        EmptyAudioError: If no bytes were received
+    """
+    session = get_session(upload_id)
+    if session.size is not None and session.received != session.size:
+        raise ValueError(f'Upload incomplete: {session.received} of {session.size} bytes received')
+    claimed = db.session.execute(
+        delete(UploadSession).where(UploadSession.id == upload_id, UploadSession.received == session.received),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not claimed:
+        raise UploadNotFound(f'Upload {upload_id} not found or expired')
+    db.session.expunge(session)
+    blob = audio_storage.finish_partial(upload_id, session.received, session.filename, session.mimetype)
+    return blob, session
+
+def abort_upload(upload_id):
+    session = get_session(upload_id)
+    db.session.delete(session)
+    db.session.commit()
+    audio_storage.discard_partial(upload_id)
+
+def prune_uploads(now=None):
+    """
+    Delete expired upload sessions and their partial files
+
+    Returns:
+        int: Number of sessions deleted
+    """
+    expired = UploadSession.query.filter(UploadSession.expires_at < (now or datetime.utcnow())).all()
+    for session in expired:
+        db.session.delete(session)
+    db.session.commit()
+    for session in expired:
+        audio_storage.discard_partial(session.id)
+    if expired:
+        logger.info('Pruned %d expired uploads', len(expired))
+    return len(expired)
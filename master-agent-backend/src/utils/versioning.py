@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from src.models.master_agent import Task, Goal, Note, db
+from src.utils.batch_operations import SPECS, parse_fields
+from src.utils.dashboard_stats import dashboard_cache
+from src.utils.goal_progress import apply_goal_deltas, check_goal, check_progress, goal_deltas, record_goal_deltas
+from src.utils.response_cache import response_cache
+from src.utils.search import search_index
+
+class ItemNotFound(LookupError):
+    pass
+
+class VersionConflict(Exception):
+    """The item was changed since the version the client edited"""
+
+    def __init__(self, current):
+        super().__init__(f'{type(current).__name__} {current.id} is at version {current.version}')
+        self.current = current
+
+def patch_item(model, item_id, data, version):
+    """
+    Apply a partial update to a task, goal or note if it is still at version
+
+    The fields are written and the version bumped by a single
+    UPDATE ... WHERE id AND version ... RETURNING, so the edit costs one round
+    trip and an edit based on an older version is rejected instead of
+    overwriting the newer one. Only when no row matched is the item read,
+    to tell a conflict from a missing item. Tags of a note are replaced
+    through the ORM afterwards.
+
+    An edit that moves the item between dashboard counters (status,
+    note_type) or moves a task between goals first locks the row and reads
+    its previous values, which the counters need: two round trips. So does
+    setting the progress of a goal, which is only allowed while the goal has
+    no linked tasks.
+
+    Args:
+        model: Task, Goal or Note
+        item_id (int): Id of the item
+        data (dict): Fields to change; keys that are not writable are ignored
+        version (int): Version the client's edit is based on
+
+    Returns:
+        dict: to_dict() of the committed item
+
+    Raises:
+        BatchItemError: If a field has an invalid value
+        InvalidGoal: If a task is linked to a goal that is not the user's, or
+            progress is set on a goal with linked tasks
+        ItemNotFound: If there is no such item
+        VersionConflict: If the item is no longer at version
+    """
+    values, tags = parse_fields(model, data)
+    spec = SPECS[model]
+    group = spec['group_by']
+    counted = [group] + (['goal_id'] if model is Task else [])
+    sets_progress = model is Goal and 'progress' in values
+    previous = None
+    if sets_progress or any(column in values for column in counted):
+        previous = db.session.execute(
+            select(*(getattr(model, column) for column in counted), model.user_id,
+                   *([Goal.total_tasks] if sets_progress else []))
+            .where(model.id == item_id, model.version == version)
+            .with_for_update()
+        ).one_or_none()
+        if previous is None:
+            raise _missing_or_conflict(model, item_id)
+        if values.get('goal_id') is not None:
+            check_goal(previous.user_id, values['goal_id'])
+        if sets_progress:
+            check_progress(previous.total_tasks, values['progress'])
+
+    item = db.session.scalars(
+        update(model)
+        .where(model.id == item_id, model.version == version)
+        .values(**values, version=model.version + 1, updated_at=datetime.utcnow())
+        .returning(model),
+        execution_options={'populate_existing': True}
+    ).one_or_none()
+
+    if item is None:
+        raise _missing_or_conflict(model, item_id)
+
+    if model is Note:
+        if tags is not None:
+            item.set_tags(tags)
+        if values:
+            search_index.index_objects([item])
+    deltas = {}
+    if model is Task and previous is not None:
+        deltas = goal_deltas([(previous.goal_id, previous.status)], [(item.goal_id, item.status)])
+        apply_goal_deltas(deltas)
+    # Serialized before the commit expires it, so the response needs no reload
+    item_dict = item.to_dict()
+    db.session.commit()
+
+    old_value = getattr(previous, group) if previous is not None else item_dict[group]
+    dashboard_cache.record_update(item_dict['user_id'], spec['section'], old_value, item_dict[group], item_dict)
+    response_cache.invalidate(item_dict['user_id'], spec['section'])
+    record_goal_deltas(item_dict['user_id'], deltas)
+    return item_dict
+
+def _missing_or_conflict(model, item_id):
+    db.session.rollback()
+    current = db.session.get(model, item_id)
+    if current is None:
+        return ItemNotFound(f'{model.__name__} {item_id} not found')
+    return VersionConflict(current)